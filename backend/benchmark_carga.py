@@ -0,0 +1,365 @@
+"""
+Benchmark de carga reproducible para Ciudad Feria.
+
+Levanta `server.app` en el mismo proceso (httpx + ASGITransport, sin red) contra
+un mongod local o, con --memoria, contra mongomock-motor. Siembra eventos,
+entradas y acreditaciones y ejecuta mezclas realistas:
+
+  compra     pico de compras en /comprar-entrada
+  escaneo    apertura de puertas: ráfaga de /validar-entrada (con duplicados e inválidos)
+  dashboard  paneles del admin consultando estadísticas, compras, aforo y /metrics
+  pdf        PDF masivo de acreditaciones de un evento
+  mixto      todo lo anterior a la vez
+
+El resultado es JSON (rendimiento y percentiles de latencia por escenario) para
+comparar entre commits:
+
+  python benchmark_carga.py --entradas 2000 --salida base.json
+  python benchmark_carga.py --entradas 2000 --comparar base.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+ESCENARIOS = ["compra", "escaneo", "dashboard", "pdf", "mixto"]
+
+
+def percentil(valores_ordenados: list, p: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not valores_ordenados:
+        return 0.0
+    indice = max(0, min(len(valores_ordenados) - 1, round(p / 100 * len(valores_ordenados) + 0.5) - 1))
+    return valores_ordenados[indice]
+
+
+class Medicion:
+    """Latencias y códigos de estado de un escenario"""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.latencias = []
+        self.estados = {}
+        self.errores = 0
+        self.inicio = None
+        self.fin = None
+
+    def registrar(self, segundos: float, estado):
+        self.latencias.append(segundos)
+        self.estados[str(estado)] = self.estados.get(str(estado), 0) + 1
+        if not isinstance(estado, int) or estado >= 500:
+            self.errores += 1
+
+    def resumen(self) -> dict:
+        duracion = (self.fin or time.perf_counter()) - (self.inicio or time.perf_counter())
+        ms = sorted(l * 1000 for l in self.latencias)
+        return {
+            "peticiones": len(ms),
+            "errores": self.errores,
+            "estados": self.estados,
+            "duracion_s": round(duracion, 3),
+            "rps": round(len(ms) / duracion, 1) if duracion > 0 else 0.0,
+            "latencia_ms": {
+                "media": round(sum(ms) / len(ms), 2) if ms else 0.0,
+                "p50": round(percentil(ms, 50), 2),
+                "p95": round(percentil(ms, 95), 2),
+                "p99": round(percentil(ms, 99), 2),
+                "max": round(ms[-1], 2) if ms else 0.0
+            }
+        }
+
+
+async def ejecutar(cliente, medicion: Medicion, peticiones, concurrencia: int, duracion: float = None):
+    """Consume un iterable de (método, url, kwargs) con `concurrencia` trabajadores"""
+    iterador = iter(peticiones)
+    limite = time.perf_counter() + duracion if duracion else None
+
+    async def trabajador():
+        while limite is None or time.perf_counter() < limite:
+            try:
+                metodo, url, kwargs = next(iterador)
+            except StopIteration:
+                return
+            inicio = time.perf_counter()
+            try:
+                respuesta = await cliente.request(metodo, url, **kwargs)
+                estado = respuesta.status_code
+                await respuesta.aread()
+            except Exception as e:
+                estado = type(e).__name__
+            medicion.registrar(time.perf_counter() - inicio, estado)
+
+    medicion.inicio = time.perf_counter()
+    await asyncio.gather(*[trabajador() for _ in range(concurrencia)])
+    medicion.fin = time.perf_counter()
+    return medicion
+
+
+# ==================== SIEMBRA ====================
+
+async def sembrar(server, cliente, args, rnd: random.Random) -> dict:
+    """Crea eventos, entradas aprobadas y acreditaciones usando los mismos caminos que producción"""
+    db = server.db
+    for coleccion in ["eventos", "entradas", "acreditaciones", "categorias_acreditacion"]:
+        await db[coleccion].delete_many({})
+    server.invalidar_evento_cache()
+
+    eventos = []
+    for i in range(args.eventos):
+        evento = server.Evento(
+            nombre=f"Evento de carga {i + 1}",
+            descripcion="Evento sembrado por benchmark_carga.py",
+            fecha="2026-01-20",
+            hora="20:00",
+            ubicacion=f"Escenario {i + 1}",
+            categoria="conciertos",
+            precio=25.0,
+            imagen="",
+            asientos_disponibles=args.entradas * 10
+        ).model_dump()
+        evento["fecha_creacion"] = evento["fecha_creacion"].isoformat()
+        eventos.append(evento)
+    await db.eventos.insert_many([dict(e) for e in eventos])
+
+    # Entradas: compradas por el endpoint real (QR, hash) y luego aprobadas
+    payloads, ids = [], []
+    pendientes = args.entradas
+    while pendientes > 0:
+        lote = []
+        for _ in range(min(args.concurrencia, pendientes)):
+            cantidad = min(rnd.randint(1, 4), pendientes)
+            pendientes -= cantidad
+            lote.append(cliente.post("/api/comprar-entrada", json=cuerpo_compra(rnd, rnd.choice(eventos)["id"], cantidad)))
+            if pendientes <= 0:
+                break
+        for respuesta in await asyncio.gather(*lote):
+            respuesta.raise_for_status()
+            for entrada in respuesta.json()["entradas"]:
+                ids.append(entrada["id"])
+                payloads.append(entrada["qr_payload"])
+    for i in range(0, len(ids), 1000):
+        respuesta = await cliente.post("/api/admin/aprobar-compra", json={"entrada_ids": ids[i:i + 1000]}, headers=args.headers)
+        respuesta.raise_for_status()
+
+    categoria = server.CategoriaAcreditacion(nombre="Prensa", zonas_acceso=["general", "prensa"]).model_dump()
+    await db.categorias_acreditacion.insert_one(dict(categoria))
+    evento_pdf = eventos[0]["id"]
+    creaciones = [
+        cliente.post("/api/admin/acreditaciones", headers=args.headers, json={
+            "evento_id": evento_pdf,
+            "categoria_id": categoria["id"],
+            "categoria_nombre": categoria["nombre"],
+            "nombre_persona": f"Periodista {i + 1}",
+            "cedula": f"V-{10000000 + i}",
+            "organizacion": "Diario de carga",
+            "cargo": "Reportero",
+            "zonas_acceso": categoria["zonas_acceso"]
+        })
+        for i in range(args.acreditaciones)
+    ]
+    for respuesta in await asyncio.gather(*creaciones):
+        respuesta.raise_for_status()
+
+    return {"eventos": [e["id"] for e in eventos], "payloads": payloads, "evento_pdf": evento_pdf}
+
+
+def cuerpo_compra(rnd: random.Random, evento_id: str, cantidad: int) -> dict:
+    n = rnd.randint(1, 10 ** 8)
+    return {
+        "evento_id": evento_id,
+        "nombre_comprador": f"Comprador {n}",
+        "cedula_comprador": f"V-{n}",
+        "email_comprador": f"comprador{n % 5000}@carga.test",
+        "telefono_comprador": "04140000000",
+        "cantidad": cantidad,
+        "precio_total": 25.0 * cantidad,
+        "metodo_pago": "pago_movil",
+        "comprobante_pago": None
+    }
+
+
+# ==================== MEZCLAS ====================
+
+def peticiones_compra(rnd, datos, total):
+    for _ in range(total):
+        cuerpo = cuerpo_compra(rnd, rnd.choice(datos["eventos"]), rnd.choice([1, 1, 1, 2, 2, 4]))
+        yield "POST", "/api/comprar-entrada", {"json": cuerpo}
+
+
+def peticiones_escaneo(rnd, datos, total):
+    """Cada entrada pasa una vez; ~10% reintentos del mismo QR y ~3% QR inválidos"""
+    payloads = list(datos["payloads"])
+    rnd.shuffle(payloads)
+    escaneados = []
+    for i in range(total):
+        azar = rnd.random()
+        if azar < 0.03:
+            payload = "QR-INVALIDO-" + str(i)
+        elif azar < 0.13 and escaneados:
+            payload = rnd.choice(escaneados)
+        else:
+            payload = payloads[i % len(payloads)]
+            escaneados.append(payload)
+        yield "POST", "/api/validar-entrada", {"json": {"qr_payload": payload, "accion": "entrada"}}
+
+
+def peticiones_dashboard(rnd, datos, headers, total=None):
+    i = 0
+    while total is None or i < total:
+        i += 1
+        evento = rnd.choice(datos["eventos"])
+        yield rnd.choice([
+            ("GET", "/api/admin/estadisticas", {"headers": headers}),
+            ("GET", "/api/admin/compras", {"headers": headers, "params": {"estado": "pendiente"}}),
+            ("GET", f"/api/admin/aforo/{evento}", {"headers": headers}),
+            ("GET", "/metrics", {})
+        ])
+
+
+def peticiones_pdf(datos, headers, total):
+    for _ in range(total):
+        yield "GET", f"/api/admin/acreditaciones/evento/{datos['evento_pdf']}/pdf", {"headers": headers}
+
+
+async def correr_escenario(nombre, cliente, datos, args, rnd) -> dict:
+    c = args.concurrencia
+    if nombre == "compra":
+        return (await ejecutar(cliente, Medicion(nombre), peticiones_compra(rnd, datos, args.peticiones), c)).resumen()
+    if nombre == "escaneo":
+        return (await ejecutar(cliente, Medicion(nombre), peticiones_escaneo(rnd, datos, args.peticiones), c * 2)).resumen()
+    if nombre == "dashboard":
+        return (await ejecutar(cliente, Medicion(nombre), peticiones_dashboard(rnd, datos, args.headers, args.peticiones), max(1, c // 4))).resumen()
+    if nombre == "pdf":
+        return (await ejecutar(cliente, Medicion(nombre), peticiones_pdf(datos, args.headers, args.pdfs), 2)).resumen()
+
+    # mixto: compras y escaneos simultáneos con paneles abiertos y un PDF en curso
+    mediciones = [Medicion(n) for n in ["compra", "escaneo", "dashboard", "pdf"]]
+    await asyncio.gather(
+        ejecutar(cliente, mediciones[0], peticiones_compra(rnd, datos, args.peticiones // 2), c, args.duracion),
+        ejecutar(cliente, mediciones[1], peticiones_escaneo(rnd, datos, args.peticiones), c, args.duracion),
+        ejecutar(cliente, mediciones[2], peticiones_dashboard(rnd, datos, args.headers), max(1, c // 8), args.duracion),
+        ejecutar(cliente, mediciones[3], peticiones_pdf(datos, args.headers, args.pdfs), 1, args.duracion)
+    )
+    return {m.nombre: m.resumen() for m in mediciones}
+
+
+# ==================== PRINCIPAL ====================
+
+def commit_actual() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def comparar(actual: dict, base: dict) -> dict:
+    """Diferencia porcentual de rps y p95/p99 respecto a un resultado anterior"""
+    def delta(a, b):
+        return round((a - b) / b * 100, 1) if b else None
+
+    diferencias = {}
+    for nombre, resumen in actual["escenarios"].items():
+        anterior = base.get("escenarios", {}).get(nombre)
+        if not anterior:
+            continue
+        pares = resumen.items() if nombre == "mixto" else [(nombre, resumen)]
+        previos = anterior if nombre == "mixto" else {nombre: anterior}
+        for sub, r in pares:
+            p = previos.get(sub)
+            if not p:
+                continue
+            clave = f"{nombre}.{sub}" if nombre == "mixto" else nombre
+            diferencias[clave] = {
+                "rps_%": delta(r["rps"], p["rps"]),
+                "p95_%": delta(r["latencia_ms"]["p95"], p["latencia_ms"]["p95"]),
+                "p99_%": delta(r["latencia_ms"]["p99"], p["latencia_ms"]["p99"])
+            }
+    return diferencias
+
+
+async def principal(args):
+    # La configuración debe existir antes de importar server (lee el entorno al importarse)
+    os.environ["MONGO_URL"] = args.mongo
+    os.environ["DB_NAME"] = args.db
+    sys.path.insert(0, str(ROOT_DIR))
+    import httpx
+    import server
+
+    if args.memoria:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--memoria requiere mongomock-motor (pip install mongomock-motor)")
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[args.db]
+
+    rnd = random.Random(args.semilla)
+    args.headers = {"Authorization": f"Bearer {server.create_access_token({'sub': 'benchmark'})}"}
+
+    await server.app.router.startup()
+    try:
+        transporte = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://carga", timeout=None) as cliente:
+            inicio = time.perf_counter()
+            datos = await sembrar(server, cliente, args, rnd)
+            siembra_s = round(time.perf_counter() - inicio, 2)
+
+            escenarios = {}
+            for nombre in args.escenarios:
+                escenarios[nombre] = await correr_escenario(nombre, cliente, datos, args, rnd)
+                print(f"[{nombre}] listo", file=sys.stderr)
+    finally:
+        await server.app.router.shutdown()
+
+    resultado = {
+        "commit": commit_actual(),
+        "fecha": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "mongo": "mongomock" if args.memoria else args.mongo,
+        "config": {
+            "semilla": args.semilla, "eventos": args.eventos, "entradas": args.entradas,
+            "acreditaciones": args.acreditaciones, "peticiones": args.peticiones,
+            "concurrencia": args.concurrencia, "pdfs": args.pdfs, "duracion": args.duracion
+        },
+        "siembra_s": siembra_s,
+        "escenarios": escenarios
+    }
+    if args.comparar:
+        resultado["comparacion"] = comparar(resultado, json.loads(Path(args.comparar).read_text()))
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga de Ciudad Feria (en proceso)")
+    parser.add_argument("--mongo", default=os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="ciudadferia_benchmark", help="Base de datos desechable (se vacía al sembrar)")
+    parser.add_argument("--memoria", action="store_true", help="Usar mongomock-motor en lugar de mongod")
+    parser.add_argument("--escenarios", nargs="+", choices=ESCENARIOS, default=ESCENARIOS)
+    parser.add_argument("--semilla", type=int, default=2026)
+    parser.add_argument("--eventos", type=int, default=5)
+    parser.add_argument("--entradas", type=int, default=1000)
+    parser.add_argument("--acreditaciones", type=int, default=40)
+    parser.add_argument("--peticiones", type=int, default=1000, help="Peticiones por escenario")
+    parser.add_argument("--concurrencia", type=int, default=32)
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--duracion", type=float, default=30.0, help="Tope en segundos del escenario mixto")
+    parser.add_argument("--salida", help="Guardar el JSON en este archivo")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para calcular diferencias")
+    args = parser.parse_args()
+
+    resultado = asyncio.run(principal(args))
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        Path(args.salida).write_text(texto)
+    print(texto)
+
+
+if __name__ == "__main__":
+    main()
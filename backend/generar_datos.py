@@ -0,0 +1,417 @@
+"""
+Generador de datos sintéticos para pruebas de carga.
+
+A diferencia de seed_data.py / seed_categorias.py / seed_metodos_pago.py (un puñado
+de documentos escritos a mano), genera una feria completa y reproducible:
+
+  - eventos generales, con mesas y mixtos (con sus documentos de asientos)
+  - entradas en todos los estados de pago, con historial de accesos
+  - categorías de acreditación y acreditaciones
+  - categorías y métodos de pago de los seeds
+
+Los documentos tienen la misma forma que los que crea el servidor (QR compacto
+encriptado y hash válidos: se pueden escanear). El QR no se renderiza salvo con
+--qr-imagenes; se genera bajo demanda igual que en los lotes térmicos.
+
+Uso:
+  python generar_datos.py --entradas 50000 --limpiar
+  python generar_datos.py --entradas 2000000 --eventos 40 --escritores 8 --lote 10000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+sys.path.insert(0, str(ROOT_DIR))
+
+from server import construir_payload_qr, generar_hash, renderizar_qr_png  # noqa: E402
+from seed_categorias import categorias_iniciales  # noqa: E402
+from seed_metodos_pago import metodos_pago_iniciales  # noqa: E402
+
+FECHA_BASE = datetime(2026, 1, 10, tzinfo=timezone.utc)
+
+NOMBRES = ["José", "María", "Luis", "Carmen", "Carlos", "Ana", "Jesús", "Rosa", "Miguel", "Yolanda",
+           "Pedro", "Daniela", "Andrés", "Gabriela", "Rafael", "Valentina", "Jorge", "Andreína"]
+APELLIDOS = ["Pérez", "González", "Rodríguez", "Contreras", "Ramírez", "Chacón", "Moreno", "Sánchez",
+             "Medina", "Zambrano", "Méndez", "Guerrero", "Vivas", "Colmenares", "Useche", "Rosales"]
+LUGARES = ["Plaza de Toros de San Cristóbal", "Avenida España", "Parque Metropolitano",
+           "Estadio Pueblo Nuevo", "Complejo Ferial", "Polideportivo"]
+CATEGORIAS_EVENTO = ["conciertos", "culturales", "deportivos", "infantiles", "gastronomicos"]
+METODOS_PAGO = ["transferencia", "pago-movil", "efectivo", "zelle"]
+ESTADOS_PAGO = [("aprobado", 0.72), ("pendiente", 0.18), ("rechazado", 0.10)]
+CATEGORIAS_ACREDITACION = [
+    ("Prensa", "#1E40AF", ["general", "prensa"]),
+    ("Staff", "#059669", ["general", "backstage"]),
+    ("Artista", "#DB2777", ["general", "backstage", "camerinos"]),
+    ("Seguridad", "#DC2626", ["general", "backstage", "perimetro"]),
+    ("Protocolo", "#CA8A04", ["general", "vip"]),
+]
+
+
+def uuid_det(rnd: random.Random) -> str:
+    """UUID4 derivado de la semilla (reproducible entre corridas)"""
+    return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+
+def elegir_ponderado(rnd: random.Random, opciones: list):
+    return rnd.choices([o for o, _ in opciones], weights=[p for _, p in opciones])[0]
+
+
+def nombre_persona(rnd: random.Random) -> str:
+    return f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+
+
+# ==================== EVENTOS Y ASIENTOS ====================
+
+def generar_eventos(rnd: random.Random, cantidad: int) -> list:
+    eventos = []
+    for i in range(cantidad):
+        tipo_asientos = elegir_ponderado(rnd, [("general", 0.6), ("mesas", 0.2), ("mixto", 0.2)])
+        precio = float(rnd.choice([10, 15, 20, 25, 35, 50, 75]))
+        evento = {
+            "id": uuid_det(rnd),
+            "nombre": f"{rnd.choice(['Gran Concierto', 'Festival', 'Noche de', 'Show'])} Feria {i + 1}",
+            "descripcion": "Evento generado para pruebas de carga",
+            "fecha": (FECHA_BASE + timedelta(days=rnd.randint(0, 14))).strftime("%Y-%m-%d"),
+            "hora": f"{rnd.choice([15, 17, 19, 20, 21])}:00",
+            "ubicacion": rnd.choice(LUGARES),
+            "categoria": rnd.choice(CATEGORIAS_EVENTO),
+            "precio": precio,
+            "imagen": "",
+            "template_entrada": None,
+            "posicion_qr": {"x": 50, "y": 40, "size": 200},
+            "link_externo": None,
+            "categorias_asientos": [
+                {"nombre": "General", "precio": precio},
+                {"nombre": "VIP", "precio": precio * 2}
+            ],
+            "tipo_asientos": tipo_asientos,
+            "configuracion_asientos": None,
+            "fecha_creacion": (FECHA_BASE - timedelta(days=45)).isoformat()
+        }
+        if tipo_asientos == "general":
+            evento["capacidad"] = rnd.choice([2000, 5000, 10000, 20000])
+        else:
+            mesas = [
+                {
+                    "id": str(m + 1),
+                    "nombre": f"Mesa {m + 1}",
+                    "sillas": rnd.choice([4, 6, 8, 10]),
+                    "precio": precio * (3 if m < 10 else 2),
+                    "categoria": "VIP" if m < 10 else "Preferencial"
+                }
+                for m in range(rnd.randint(20, 120))
+            ]
+            configuracion = {"mesas": mesas}
+            capacidad = sum(m["sillas"] for m in mesas)
+            if tipo_asientos == "mixto":
+                configuracion["entradas_generales"] = rnd.choice([500, 1000, 3000])
+                capacidad += configuracion["entradas_generales"]
+            evento["configuracion_asientos"] = configuracion
+            evento["capacidad"] = capacidad
+        eventos.append(evento)
+    return eventos
+
+
+def generar_asientos(evento: dict) -> list:
+    """Mismos documentos que crea /admin/eventos/{id}/configurar-asientos"""
+    configuracion = evento.get("configuracion_asientos") or {}
+    asientos = []
+    for mesa in configuracion.get("mesas", []):
+        for silla in range(1, mesa["sillas"] + 1):
+            asientos.append({
+                "id": f"M{mesa['id']}-S{silla}",
+                "evento_id": evento["id"],
+                "tipo": "mesa",
+                "mesa_id": mesa["id"],
+                "mesa_nombre": mesa["nombre"],
+                "silla_numero": silla,
+                "categoria": mesa["categoria"],
+                "precio": mesa["precio"],
+                "estado": "disponible"
+            })
+    return asientos
+
+
+# ==================== ENTRADAS ====================
+
+class GeneradorEntradas:
+    """Reparte las entradas entre eventos respetando la capacidad y los asientos de mesa"""
+
+    def __init__(self, rnd: random.Random, eventos: list, total: int, qr_imagenes: bool):
+        self.rnd = rnd
+        self.eventos = eventos
+        self.qr_imagenes = qr_imagenes
+        self.vendidas = {e["id"]: 0 for e in eventos}
+        self.sillas_libres = {
+            e["id"]: [a["id"] for a in generar_asientos(e)] for e in eventos
+        }
+        for sillas in self.sillas_libres.values():
+            rnd.shuffle(sillas)
+        self.generales = [e for e in eventos if e["tipo_asientos"] == "general"] or eventos
+        self.pesos = [e["capacidad"] for e in eventos]
+        self.emails = max(1, total // 3)  # ~3 entradas por comprador
+
+    def _evento_con_cupo(self) -> dict:
+        evento = self.rnd.choices(self.eventos, weights=self.pesos)[0]
+        if self.vendidas[evento["id"]] >= evento["capacidad"]:
+            evento = self.rnd.choice(self.generales)  # los generales absorben el excedente
+        return evento
+
+    def compra(self, maximo: int = 4) -> list:
+        """Una compra de 1 a 4 entradas del mismo comprador y evento"""
+        rnd = self.rnd
+        evento = self._evento_con_cupo()
+        cantidad = min(rnd.choice([1, 1, 1, 2, 2, 3, 4]), maximo)
+        n = rnd.randrange(self.emails)
+        comprador = {
+            "nombre_comprador": nombre_persona(rnd),
+            "cedula_comprador": f"V-{8000000 + n}",
+            "email_comprador": f"cliente{n}@{rnd.choice(['gmail.com', 'hotmail.com', 'yahoo.es'])}",
+            "telefono_comprador": f"04{rnd.choice(['14', '24', '16', '26'])}{rnd.randint(1000000, 9999999)}"
+        }
+        estado_pago = elegir_ponderado(rnd, ESTADOS_PAGO)
+        fecha_evento = datetime.strptime(evento["fecha"], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        fecha_compra = fecha_evento - timedelta(minutes=rnd.randint(60, 60 * 24 * 30))
+        metodo_pago = rnd.choice(METODOS_PAGO)
+
+        documentos = []
+        for i in range(cantidad):
+            entrada_id = uuid_det(rnd)
+            codigo_alfanumerico = f"CF-2026-{entrada_id.replace('-', '')[-6:].upper()}-{rnd.getrandbits(20):05X}"
+            asiento, mesa, categoria = None, None, "General"
+            sillas = self.sillas_libres[evento["id"]]
+            if sillas and (evento["tipo_asientos"] == "mesas" or rnd.random() < 0.4):
+                asiento = sillas.pop() if estado_pago != "rechazado" else sillas[-1]
+                mesa = asiento.split("-")[0].replace("M", "")
+                categoria = "VIP"
+
+            datos_entrada = {
+                "entrada_id": entrada_id,
+                "codigo_alfanumerico": codigo_alfanumerico,
+                "evento_id": evento["id"],
+                "nombre_evento": evento["nombre"],
+                **comprador,
+                "numero_entrada": i + 1,
+                "asiento": asiento
+            }
+            hash_validacion = generar_hash(datos_entrada)
+            datos_entrada["hash"] = hash_validacion
+            # Nonce derivado de la semilla (como nuevo_qr_nonce, 8 hex): payload reproducible
+            qr_nonce = f"{rnd.getrandbits(32):08x}"
+            qr_payload = construir_payload_qr(datos_entrada, qr_nonce)
+
+            documento = {
+                "id": entrada_id,
+                "evento_id": evento["id"],
+                "nombre_evento": evento["nombre"],
+                **comprador,
+                "fecha_compra": fecha_compra.isoformat(),
+                "codigo_qr": renderizar_qr_png(qr_payload) if self.qr_imagenes else None,
+                "qr_payload": qr_payload,
+                "qr_nonce": qr_nonce,
+                "asiento": asiento,
+                "mesa": mesa,
+                "estado_pago": estado_pago,
+                "metodo_pago": metodo_pago,
+                "comprobante_pago": None,
+                "usado": False,
+                "fecha_uso": None,
+                "estado_entrada": "fuera",
+                "historial_acceso": [],
+                "hash_validacion": hash_validacion,
+                "codigo_alfanumerico": codigo_alfanumerico,
+                "categoria_asiento": categoria
+            }
+            if estado_pago == "aprobado" and rnd.random() < 0.55:
+                self._simular_accesos(documento, fecha_evento)
+            if estado_pago != "rechazado":
+                self.vendidas[evento["id"]] += 1
+            documentos.append(documento)
+        return documentos
+
+    def _simular_accesos(self, documento: dict, fecha_evento: datetime):
+        """Historial de entradas y salidas alternadas, como lo dejan los escáneres"""
+        rnd = self.rnd
+        momento = fecha_evento + timedelta(minutes=rnd.randint(-90, 120))
+        historial = []
+        for paso in range(rnd.choice([1, 1, 1, 2, 3, 4, 6])):
+            historial.append({"tipo": "entrada" if paso % 2 == 0 else "salida", "fecha": momento.isoformat()})
+            momento += timedelta(minutes=rnd.randint(5, 90))
+        documento.update({
+            "usado": True,
+            "fecha_uso": historial[0]["fecha"],
+            "estado_entrada": "dentro" if historial[-1]["tipo"] == "entrada" else "fuera",
+            "historial_acceso": historial
+        })
+
+
+# ==================== ACREDITACIONES ====================
+
+def generar_acreditaciones(rnd: random.Random, eventos: list, cantidad: int, qr_imagenes: bool):
+    categorias = [
+        {
+            "id": uuid_det(rnd), "nombre": nombre, "color": color, "zonas_acceso": zonas,
+            "capacidad": max(100, cantidad), "descripcion": None, "activa": True,
+            "template_imagen": None, "config_elementos": None
+        }
+        for nombre, color, zonas in CATEGORIAS_ACREDITACION
+    ]
+    acreditaciones = []
+    for _ in range(cantidad):
+        categoria = rnd.choice(categorias)
+        acreditacion_id = uuid_det(rnd)
+        codigo = f"AC-{categoria['nombre'][:3].upper()}-{acreditacion_id[:8].upper()}"
+        qr_payload = construir_payload_qr({"tipo": "acreditacion", "acreditacion_id": acreditacion_id})
+        acreditacion = {
+            "id": acreditacion_id,
+            "evento_id": rnd.choice(eventos)["id"],
+            "categoria_id": categoria["id"],
+            "categoria_nombre": categoria["nombre"],
+            "nombre_persona": nombre_persona(rnd),
+            "cedula": f"V-{5000000 + rnd.randrange(20000000)}",
+            "organizacion": rnd.choice(["Diario La Nación", "Alcaldía", "Producción Feria", "Protección Civil", None]),
+            "cargo": rnd.choice(["Coordinador", "Reportero", "Técnico", "Músico", None]),
+            "email": None,
+            "telefono": None,
+            "foto": None,
+            "zonas_acceso": categoria["zonas_acceso"],
+            "codigo_alfanumerico": codigo,
+            "codigo_qr": renderizar_qr_png(qr_payload) if qr_imagenes else None,
+            "qr_payload": qr_payload,
+            "fecha_creacion": (FECHA_BASE - timedelta(days=rnd.randint(1, 20))).isoformat(),
+            "estado": "activa",
+            "estado_entrada": "fuera",
+            "historial_acceso": []
+        }
+        if rnd.random() < 0.4:
+            acreditacion["estado_entrada"] = "dentro"
+            acreditacion["historial_acceso"] = [{"tipo": "entrada", "fecha": FECHA_BASE.isoformat()}]
+        acreditaciones.append(acreditacion)
+    return categorias, acreditaciones
+
+
+# ==================== ESCRITURA ====================
+
+class Progreso:
+    def __init__(self, total: int):
+        self.total = total
+        self.escritos = 0
+        self.inicio = time.perf_counter()
+        self.ultimo_reporte = 0.0
+
+    def avanzar(self, cantidad: int):
+        self.escritos += cantidad
+        ahora = time.perf_counter()
+        if ahora - self.ultimo_reporte > 2 or self.escritos >= self.total:
+            self.ultimo_reporte = ahora
+            velocidad = self.escritos / max(ahora - self.inicio, 1e-6)
+            print(f"   entradas: {self.escritos:,}/{self.total:,} ({velocidad:,.0f}/s)", flush=True)
+
+
+async def escritor(coleccion, cola: asyncio.Queue, progreso: Progreso):
+    while True:
+        lote = await cola.get()
+        if lote is None:
+            return
+        await coleccion.insert_many(lote, ordered=False)
+        progreso.avanzar(len(lote))
+
+
+async def generar(args):
+    rnd = random.Random(args.semilla)
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], maxPoolSize=max(10, args.escritores * 2))
+    db = client[os.environ['DB_NAME']]
+
+    if args.limpiar:
+        print("Eliminando datos existentes...")
+        for coleccion in ["eventos", "entradas", "asientos", "acreditaciones", "categorias_acreditacion"]:
+            await db[coleccion].delete_many({})
+    elif await db.entradas.estimated_document_count():
+        print("Aviso: la base ya tiene entradas; los datos generados se agregan (usa --limpiar para reemplazar)")
+
+    inicio = time.perf_counter()
+    eventos = generar_eventos(rnd, args.eventos)
+    generador = GeneradorEntradas(rnd, eventos, args.entradas, args.qr_imagenes)
+
+    # Entradas: el generador produce lotes mientras varios escritores insertan en paralelo
+    print(f"Generando {args.entradas:,} entradas con {args.escritores} escritores (lotes de {args.lote:,})...")
+    cola = asyncio.Queue(maxsize=args.escritores * 2)
+    progreso = Progreso(args.entradas)
+    escritores = [asyncio.create_task(escritor(db.entradas, cola, progreso)) for _ in range(args.escritores)]
+    pendientes = args.entradas
+    lote = []
+    while pendientes > 0:
+        compra = generador.compra(pendientes)
+        lote.extend(compra)
+        pendientes -= len(compra)
+        if len(lote) >= args.lote or pendientes <= 0:
+            await cola.put(lote)  # espera si los escritores van atrasados
+            lote = []
+    for _ in escritores:
+        await cola.put(None)
+    await asyncio.gather(*escritores)
+
+    # Eventos con el cupo restante ya descontado, y sus asientos
+    documentos_eventos = []
+    for evento in eventos:
+        documento = {k: v for k, v in evento.items() if k != "capacidad"}
+        # Como en /comprar-entrada, solo los eventos generales descuentan cupo
+        documento["asientos_disponibles"] = evento["capacidad"]
+        if evento["tipo_asientos"] == "general":
+            documento["asientos_disponibles"] = max(0, evento["capacidad"] - generador.vendidas[evento["id"]])
+        documentos_eventos.append(documento)
+    await db.eventos.insert_many(documentos_eventos, ordered=False)
+    asientos = [a for e in eventos for a in generar_asientos(e)]
+    for i in range(0, len(asientos), args.lote):
+        await db.asientos.insert_many(asientos[i:i + args.lote], ordered=False)
+    print(f"✅ {len(eventos)} eventos ({sum(e['tipo_asientos'] != 'general' for e in eventos)} con mesas) y {len(asientos):,} asientos")
+
+    categorias_acreditacion, acreditaciones = generar_acreditaciones(rnd, eventos, args.acreditaciones, args.qr_imagenes)
+    await db.categorias_acreditacion.insert_many(categorias_acreditacion, ordered=False)
+    for i in range(0, len(acreditaciones), args.lote):
+        await db.acreditaciones.insert_many(acreditaciones[i:i + args.lote], ordered=False)
+    print(f"✅ {len(acreditaciones):,} acreditaciones en {len(categorias_acreditacion)} categorías")
+
+    # Catálogos de los seeds (idempotente)
+    for categoria in categorias_iniciales:
+        await db.categorias.update_one({"id": categoria["id"]}, {"$setOnInsert": categoria}, upsert=True)
+    for metodo in metodos_pago_iniciales:
+        await db.metodos_pago.update_one({"id": metodo["id"]}, {"$setOnInsert": metodo}, upsert=True)
+
+    await db.eventos.create_index("id", unique=True)
+    await db.entradas.create_index("id", unique=True)
+    await db.entradas.create_index("email_comprador")
+    await db.entradas.create_index("evento_id")
+    await db.acreditaciones.create_index("id", unique=True)
+    await db.asientos.create_index([("evento_id", 1), ("id", 1)])
+    print(f"✅ Índices creados. Total: {time.perf_counter() - inicio:.1f}s")
+    client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera una feria sintética reproducible para pruebas de carga")
+    parser.add_argument("--semilla", type=int, default=2026, help="Misma semilla, mismos datos")
+    parser.add_argument("--eventos", type=int, default=12)
+    parser.add_argument("--entradas", type=int, default=50000)
+    parser.add_argument("--acreditaciones", type=int, default=1500)
+    parser.add_argument("--lote", type=int, default=5000, help="Documentos por insert_many")
+    parser.add_argument("--escritores", type=int, default=4, help="Inserciones concurrentes")
+    parser.add_argument("--qr-imagenes", action="store_true", help="Renderizar también la imagen del QR (lento)")
+    parser.add_argument("--limpiar", action="store_true", help="Vaciar eventos, entradas, asientos y acreditaciones antes")
+    args = parser.parse_args()
+    asyncio.run(generar(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, status, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, status, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import DuplicateKeyError
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
 from datetime import datetime, timezone, timedelta
@@ -12,12 +14,16 @@ import os
 import uuid
 import qrcode
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import base64
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 import hashlib
 import json
+import zlib
+import secrets
+import numpy as np
 import logging
 import jwt
 from passlib.context import CryptContext
@@ -32,7 +38,13 @@ from email import encoders
 # ========== VERSIÓN DEL SISTEMA ==========
 SYSTEM_VERSION = "3.4.0-PDF-4PERPAGE-20250110"
 import asyncio
+import time
+import threading
+import sys
+import inspect
+import collections
 import hmac
+import re
 import cloudinary
 import cloudinary.uploader
 
@@ -48,8 +60,125 @@ cloudinary.config(
     api_secret=os.environ.get('CLOUDINARY_API_SECRET')
 )
 
+# ==================== MÉTRICAS (formato de texto Prometheus) ====================
+# Registro mínimo en memoria: contadores e histogramas con etiquetas. Se expone
+# en GET /metrics junto con la latencia por ruta y por operación de Mongo.
+
+METRICAS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_metricas_lock = threading.Lock()
+_metricas_tipos: dict = {}    # nombre -> (tipo, ayuda)
+_contadores: dict = {}        # (nombre, etiquetas) -> valor
+_histogramas: dict = {}       # (nombre, etiquetas) -> [cuentas por bucket..., suma, total]
+
+def registrar_metrica(nombre: str, tipo: str, ayuda: str):
+    _metricas_tipos[nombre] = (tipo, ayuda)
+
+def metrica_inc(nombre: str, valor: float = 1, **etiquetas):
+    clave = (nombre, tuple(sorted(etiquetas.items())))
+    with _metricas_lock:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+def metrica_observar(nombre: str, valor: float, **etiquetas):
+    clave = (nombre, tuple(sorted(etiquetas.items())))
+    with _metricas_lock:
+        serie = _histogramas.get(clave)
+        if serie is None:
+            serie = [0] * (len(METRICAS_BUCKETS) + 2)
+            _histogramas[clave] = serie
+        for i, limite in enumerate(METRICAS_BUCKETS):
+            if valor <= limite:
+                serie[i] += 1
+        serie[-2] += valor
+        serie[-1] += 1
+
+def metrica_cache(cache: str, acierto: bool):
+    metrica_inc("ciudadferia_cache_aciertos_total" if acierto else "ciudadferia_cache_fallos_total", cache=cache)
+
+def _formatear_etiquetas(etiquetas) -> str:
+    if not etiquetas:
+        return ""
+    pares = ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in etiquetas)
+    return "{" + pares + "}"
+
+def exportar_metricas() -> str:
+    """Serializa el registro en el formato de exposición de texto de Prometheus"""
+    lineas = []
+    with _metricas_lock:
+        contadores = dict(_contadores)
+        histogramas = {k: list(v) for k, v in _histogramas.items()}
+
+    nombres = sorted({n for n, _ in contadores} | {n for n, _ in histogramas})
+    for nombre in nombres:
+        tipo, ayuda = _metricas_tipos.get(nombre, ("counter", nombre))
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        for (n, etiquetas), valor in sorted(contadores.items()):
+            if n == nombre:
+                lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas)} {valor}")
+        for (n, etiquetas), serie in sorted(histogramas.items()):
+            if n != nombre:
+                continue
+            for limite, cuenta in zip(METRICAS_BUCKETS, serie):
+                lineas.append(f"{nombre}_bucket{_formatear_etiquetas(etiquetas + (('le', limite),))} {cuenta}")
+            lineas.append(f"{nombre}_bucket{_formatear_etiquetas(etiquetas + (('le', '+Inf'),))} {serie[-1]}")
+            lineas.append(f"{nombre}_sum{_formatear_etiquetas(etiquetas)} {serie[-2]}")
+            lineas.append(f"{nombre}_count{_formatear_etiquetas(etiquetas)} {serie[-1]}")
+
+    # Ratio de aciertos por caché (calculado al exportar)
+    aciertos = {dict(e)["cache"]: v for (n, e), v in contadores.items() if n == "ciudadferia_cache_aciertos_total"}
+    fallos = {dict(e)["cache"]: v for (n, e), v in contadores.items() if n == "ciudadferia_cache_fallos_total"}
+    caches = sorted(set(aciertos) | set(fallos))
+    if caches:
+        lineas.append("# HELP ciudadferia_cache_ratio_aciertos Proporción de aciertos por caché")
+        lineas.append("# TYPE ciudadferia_cache_ratio_aciertos gauge")
+        for cache in caches:
+            total = aciertos.get(cache, 0) + fallos.get(cache, 0)
+            ratio = aciertos.get(cache, 0) / total if total else 0
+            lineas.append(f'ciudadferia_cache_ratio_aciertos{{cache="{cache}"}} {ratio:.4f}')
+    return "\n".join(lineas) + "\n"
+
+registrar_metrica("ciudadferia_http_duracion_segundos", "histogram", "Latencia de las peticiones HTTP por ruta")
+registrar_metrica("ciudadferia_http_peticiones_total", "counter", "Peticiones HTTP por ruta y código de estado")
+registrar_metrica("ciudadferia_mongo_duracion_segundos", "histogram", "Duración de los comandos de Mongo por colección y operación")
+registrar_metrica("ciudadferia_mongo_errores_total", "counter", "Comandos de Mongo fallidos por colección y operación")
+registrar_metrica("ciudadferia_qr_renderizados_total", "counter", "Imágenes QR renderizadas")
+registrar_metrica("ciudadferia_emails_total", "counter", "Envíos de email por resultado")
+registrar_metrica("ciudadferia_escaneos_total", "counter", "Resultados de validación en puerta")
+registrar_metrica("ciudadferia_cache_aciertos_total", "counter", "Aciertos de caché")
+registrar_metrica("ciudadferia_cache_fallos_total", "counter", "Fallos de caché")
+
+class MonitorComandosMongo(monitoring.CommandListener):
+    """Mide cada comando de pymongo (command monitoring) por colección y operación"""
+
+    def __init__(self):
+        self._colecciones = {}  # request_id -> colección
+
+    def started(self, event):
+        coleccion = event.command.get(event.command_name)
+        if not isinstance(coleccion, str):
+            coleccion = event.command.get("collection", "")  # getMore
+        self._colecciones[(event.connection_id, event.request_id)] = coleccion
+
+    def _terminar(self, event):
+        coleccion = self._colecciones.pop((event.connection_id, event.request_id), "")
+        return coleccion if isinstance(coleccion, str) else ""
+
+    def succeeded(self, event):
+        metrica_observar(
+            "ciudadferia_mongo_duracion_segundos", event.duration_micros / 1e6,
+            coleccion=self._terminar(event), operacion=event.command_name
+        )
+
+    def failed(self, event):
+        coleccion = self._terminar(event)
+        metrica_observar(
+            "ciudadferia_mongo_duracion_segundos", event.duration_micros / 1e6,
+            coleccion=coleccion, operacion=event.command_name
+        )
+        metrica_inc("ciudadferia_mongo_errores_total", coleccion=coleccion, operacion=event.command_name)
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MonitorComandosMongo()])
 db = client[os.environ['DB_NAME']]
 
 app = FastAPI()
@@ -276,6 +405,18 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# bcrypt tarda 100-300 ms: se ejecuta en un pool acotado para no frenar el event loop
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '2'))
+_pool_bcrypt = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool_bcrypt, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool_bcrypt, get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -287,13 +428,40 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Tokens ya verificados: sha256(token) -> (exp, username). Los paneles del admin
+# consultan muchos endpoints por minuto con el mismo token.
+TOKEN_CACHE_MAX = int(os.environ.get('TOKEN_CACHE_MAX', '1024'))
+_tokens_verificados: dict = {}  # orden de inserción = LRU
+
+def _guardar_token_verificado(clave: str, expira: float, username: str):
+    _tokens_verificados[clave] = (expira, username)
+    if len(_tokens_verificados) > TOKEN_CACHE_MAX:
+        # Primero descartar los expirados; si no alcanza, el menos usado
+        ahora = time.time()
+        for k in [k for k, (exp, _) in _tokens_verificados.items() if exp <= ahora]:
+            del _tokens_verificados[k]
+        while len(_tokens_verificados) > TOKEN_CACHE_MAX:
+            _tokens_verificados.pop(next(iter(_tokens_verificados)))
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    clave = hashlib.sha256(token.encode()).hexdigest()
+    cacheado = _tokens_verificados.pop(clave, None)
+    if cacheado:
+        expira, username = cacheado
+        if expira <= time.time():
+            raise HTTPException(status_code=401, detail="Token expired")
+        _tokens_verificados[clave] = cacheado  # mover al final (más reciente)
+        metrica_cache("tokens", True)
+        return username
+    metrica_cache("tokens", False)
+    
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid token")
+        _guardar_token_verificado(clave, float(payload.get("exp", 0)), username)
         return username
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -314,11 +482,15 @@ def generar_codigo_alfanumerico(evento_id: str, entrada_id: str) -> str:
     
     return f"CF-2026-{codigo_unico}-{parte_aleatoria}"
 
-def generar_qr_seguro(datos: dict) -> str:
-    """Genera QR con payload compacto para mejor escaneabilidad"""
+def construir_payload_qr(datos: dict, nonce: Optional[str] = None) -> str:
+    """
+    Construye el payload compacto encriptado (sin renderizar la imagen del QR).
+    Con `nonce` el IV se deriva por HMAC de (id, nonce): el mismo ticket produce
+    siempre el mismo payload y por lo tanto el mismo QR. Sin nonce el IV es aleatorio.
+    """
     # Detectar si es acreditación o entrada
     es_acreditacion = datos.get('tipo') == 'acreditacion' or 'acreditacion_id' in datos
-    
+
     if es_acreditacion:
         # Payload compacto para ACREDITACIÓN
         datos_compactos = {
@@ -334,7 +506,10 @@ def generar_qr_seguro(datos: dict) -> str:
         }
     
     datos_json = json.dumps(datos_compactos, separators=(',', ':'))  # Sin espacios
-    iv = os.urandom(16)
+    if nonce is None:
+        iv = os.urandom(16)
+    else:
+        iv = hmac.new(HMAC_SECRET_KEY, f"{datos_compactos['id']}|{nonce}".encode(), hashlib.sha256).digest()[:16]
     cipher = Cipher(
         algorithms.AES(ENCRYPTION_KEY[:32]),
         modes.CFB(iv),
@@ -342,28 +517,161 @@ def generar_qr_seguro(datos: dict) -> str:
     )
     encryptor = cipher.encryptor()
     datos_encriptados = encryptor.update(datos_json.encode()) + encryptor.finalize()
-    payload = base64.b64encode(iv + datos_encriptados).decode()
-    
+    return base64.b64encode(iv + datos_encriptados).decode()
+
+# ---------- Codificadores de imagen (PNG / WebP / JPEG) ----------
+# Un único punto de salida para las imágenes generadas: el formato se negocia por
+# endpoint con el header Accept y la compresión se ajusta por variables de entorno.
+# Cada codificación registra tiempo y bytes para comparar CPU contra ancho de banda.
+
+FORMATOS_IMAGEN = {
+    # formato: (formato PIL, media type, extensión)
+    "png": ("PNG", "image/png", "png"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+IMAGEN_PNG_COMPRESION = int(os.environ.get('IMAGEN_PNG_COMPRESION', '6'))  # 0-9 (zlib)
+IMAGEN_WEBP_CALIDAD = int(os.environ.get('IMAGEN_WEBP_CALIDAD', '80'))
+IMAGEN_WEBP_METODO = int(os.environ.get('IMAGEN_WEBP_METODO', '4'))  # 0 rápido - 6 más pequeño
+IMAGEN_JPEG_CALIDAD = int(os.environ.get('IMAGEN_JPEG_CALIDAD', '85'))
+
+registrar_metrica("ciudadferia_imagen_codificacion_segundos", "histogram", "Tiempo de codificación de imágenes por formato y uso")
+registrar_metrica("ciudadferia_imagen_bytes_total", "counter", "Bytes de imagen codificados por formato y uso")
+
+def codificar_imagen(img: Image.Image, formato: str = "png", uso: str = "otro") -> bytes:
+    """Codifica la imagen en el formato pedido"""
+    inicio = time.perf_counter()
+    buffer = BytesIO()
+    if formato == "webp":
+        img.save(buffer, format="WEBP", quality=IMAGEN_WEBP_CALIDAD, method=IMAGEN_WEBP_METODO)
+    elif formato == "jpeg":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buffer, format="JPEG", quality=IMAGEN_JPEG_CALIDAD, optimize=True, progressive=True)
+    else:
+        img.save(buffer, format="PNG", optimize=IMAGEN_PNG_COMPRESION >= 9, compress_level=IMAGEN_PNG_COMPRESION)
+    datos = buffer.getvalue()
+    metrica_observar("ciudadferia_imagen_codificacion_segundos", time.perf_counter() - inicio, formato=formato, uso=uso)
+    metrica_inc("ciudadferia_imagen_bytes_total", len(datos), formato=formato, uso=uso)
+    return datos
+
+def negociar_formato_imagen(accept: Optional[str], disponibles: tuple, por_defecto: str = "png") -> str:
+    """
+    Elige el formato según el header Accept (con sus q). Un formato no listado
+    explícitamente compite con la q de image/* o, si no está, la de */*; entre
+    formatos con la misma q gana el orden de `disponibles` (preferencia del servidor).
+    Los navegadores listan image/webp y cubren PNG/JPEG con comodines: a igual q se
+    sirve el formato que prefiere el servidor para esa imagen.
+    """
+    if not accept:
+        return por_defecto
+    preferencias = {}
+    for parte in accept.split(","):
+        tipo, _, parametros = parte.strip().partition(";")
+        q = 1.0
+        for parametro in parametros.split(";"):
+            clave, _, valor = parametro.strip().partition("=")
+            if clave == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        preferencias[tipo.strip().lower()] = q
+
+    comodin = preferencias.get("image/*", preferencias.get("*/*", 0.0))
+    mejor, mejor_q = None, 0.0
+    for formato in disponibles:
+        q = preferencias.get(FORMATOS_IMAGEN[formato][1], comodin)
+        if q > mejor_q:
+            mejor, mejor_q = formato, q
+    return mejor or por_defecto
+
+# ---------- Servicio de QR: payload estable + matriz de módulos cacheada ----------
+# Todos los renderizadores (data URI, imagen de entrada, ticket térmico) piden la
+# matriz booleana del payload a este caché y la rasterizan directamente al tamaño
+# en píxeles que necesitan, sin reescalar una imagen intermedia.
+
+QR_BORDE = 4  # módulos de zona silenciosa
+QR_MATRICES_MAX = int(os.environ.get('QR_MATRICES_MAX', '4096'))
+_qr_matrices: dict = {}  # payload -> np.ndarray bool (orden de inserción = LRU)
+
+def nuevo_qr_nonce() -> str:
+    """Nonce que se guarda en la entrada; cambiarlo (regenerar QR) cambia el payload"""
+    return secrets.token_hex(4)
+
+def payload_qr_entrada(entrada: dict) -> str:
+    """Payload compacto determinista de una entrada: id + hash parcial + qr_nonce guardado"""
+    return construir_payload_qr(
+        {"entrada_id": entrada.get('id', ''), "hash": entrada.get('hash_validacion', '')},
+        nonce=entrada.get('qr_nonce') or ""
+    )
+
+def construir_matriz_qr(payload: str, version: Optional[int] = None) -> np.ndarray:
+    """Matriz de módulos (True = negro, sin borde) del payload, sin caché"""
     qr = qrcode.QRCode(
-        version=None,
+        version=version,
         error_correction=qrcode.constants.ERROR_CORRECT_H,  # Máxima corrección
-        box_size=10,
-        border=4,
+        border=0,
     )
     qr.add_data(payload)
     qr.make(fit=True)
-    
-    tipo_str = "acreditación" if es_acreditacion else "entrada"
-    logging.info(f"QR {tipo_str} generado: versión={qr.version}, módulos={qr.modules_count}, payload={len(payload)} chars")
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-    
-    return f"data:image/png;base64,{qr_base64}", payload
+    matriz = np.array(qr.modules, dtype=bool)
+    matriz.setflags(write=False)
+    logging.info(f"QR generado: versión={qr.version}, módulos={qr.modules_count}, payload={len(payload)} chars")
+    metrica_inc("ciudadferia_qr_renderizados_total", origen="matriz")
+    return matriz
+
+def matriz_qr(payload: str) -> np.ndarray:
+    """Matriz de módulos del payload, cacheada (payloads estables: se repiten entre renders)"""
+    matriz = _qr_matrices.pop(payload, None)
+    metrica_cache("qr_matrices", matriz is not None)
+    if matriz is None:
+        matriz = construir_matriz_qr(payload)
+        if len(_qr_matrices) >= QR_MATRICES_MAX:
+            _qr_matrices.pop(next(iter(_qr_matrices)))
+    _qr_matrices[payload] = matriz  # al final: más reciente
+    return matriz
+
+def rasterizar_qr(matriz: np.ndarray, tamano: int, borde: int = QR_BORDE, modo: str = 'L') -> Image.Image:
+    """
+    Imagen de exactamente tamano x tamano px en modo '1', 'L' o 'RGB'.
+    Si el tamaño es múltiplo exacto de los módulos se expande con np.repeat;
+    si no, cada píxel toma el módulo que le corresponde (sin interpolación).
+    """
+    con_borde = np.pad(matriz, borde, constant_values=False)
+    total = con_borde.shape[0]
+    if tamano % total == 0:
+        escala = tamano // total
+        pixeles = con_borde.repeat(escala, axis=0).repeat(escala, axis=1)
+    else:
+        indices = (np.arange(tamano) * total) // tamano
+        pixeles = con_borde[np.ix_(indices, indices)]
+    if modo == '1':
+        return Image.fromarray(~pixeles)  # bool -> modo '1' (True = blanco)
+    gris = np.where(pixeles, 0, 255).astype(np.uint8)
+    if modo == 'RGB':
+        return Image.fromarray(np.repeat(gris[:, :, None], 3, axis=2), 'RGB')
+    return Image.fromarray(gris, 'L')
+
+def tamano_qr_escalado(matriz: np.ndarray, minimo_px: int, borde: int = QR_BORDE) -> int:
+    """Menor múltiplo entero del ancho en módulos que cubre minimo_px (camino rápido de rasterizar_qr)"""
+    total = matriz.shape[0] + 2 * borde
+    return total * max(1, -(-minimo_px // total))
+
+def codificar_qr_png(matriz: np.ndarray, box_size: int = 10) -> str:
+    """QR de 1 bit como data URI PNG"""
+    img = rasterizar_qr(matriz, (matriz.shape[0] + 2 * QR_BORDE) * box_size, modo='1')
+    return f"data:image/png;base64,{base64.b64encode(codificar_imagen(img, 'png', 'qr')).decode()}"
+
+def renderizar_qr_png(payload: str, box_size: int = 10) -> str:
+    """Renderiza el payload como QR PNG y lo devuelve como data URI"""
+    metrica_inc("ciudadferia_qr_renderizados_total", origen="data_uri")
+    return codificar_qr_png(matriz_qr(payload), box_size)
+
+def generar_qr_seguro(datos: dict, nonce: Optional[str] = None) -> str:
+    """Genera QR con payload compacto para mejor escaneabilidad"""
+    payload = construir_payload_qr(datos, nonce)
+    return renderizar_qr_png(payload), payload
 
 def validar_qr(payload: str) -> Optional[dict]:
     try:
@@ -387,6 +695,75 @@ def generar_hash(datos: dict) -> str:
     datos_string = json.dumps(datos, sort_keys=True)
     return hashlib.sha256(datos_string.encode()).hexdigest()
 
+def rango_fechas_utc(desde: Optional[str], hasta: Optional[str]) -> dict:
+    """
+    Convierte desde/hasta (ISO 8601) en {"$gte": ..., "$lte": ...} con fechas UTC.
+    Un `hasta` de solo fecha (AAAA-MM-DD) incluye todo ese día; sin zona se asume UTC.
+    """
+    rango = {}
+    for operador, valor in (("$gte", desde), ("$lte", hasta)):
+        if not valor:
+            continue
+        try:
+            fecha = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Fecha inválida: {valor} (use ISO 8601, ej. 2026-01-20)")
+        if operador == "$lte" and len(valor) == 10:
+            fecha = fecha + timedelta(days=1) - timedelta(microseconds=1)
+        if fecha.tzinfo is None:
+            fecha = fecha.replace(tzinfo=timezone.utc)
+        rango[operador] = fecha.astimezone(timezone.utc)
+    return rango
+
+# ==================== CACHÉ DE METADATOS DE EVENTOS ====================
+# Nombre, ubicación, tipo de asientos y configuración de categorías casi nunca
+# cambian durante una jornada de puerta. Se guardan en memoria con TTL y se
+# invalidan en cada edición del admin. asientos_disponibles queda fuera porque
+# cambia con cada compra.
+
+EVENTO_CACHE_TTL = int(os.environ.get('EVENTO_CACHE_TTL', '60'))  # segundos
+EVENTO_CACHE_PROYECCION = {"_id": 0, "asientos_disponibles": 0}
+_eventos_cache: dict = {}  # evento_id -> (expira_monotonic, doc | None)
+
+async def obtener_evento_cache(evento_id: str) -> Optional[dict]:
+    """Devuelve los metadatos del evento desde caché (o Mongo si expiró). None si no existe."""
+    ahora = time.monotonic()
+    cacheado = _eventos_cache.get(evento_id)
+    if cacheado and cacheado[0] > ahora:
+        metrica_cache("eventos", True)
+        return dict(cacheado[1]) if cacheado[1] is not None else None
+    metrica_cache("eventos", False)
+
+    evento = await db.eventos.find_one({"id": evento_id}, EVENTO_CACHE_PROYECCION)
+    # También se cachean los ausentes (ej. "ciudad-feria-general" de taquilla)
+    _eventos_cache[evento_id] = (ahora + EVENTO_CACHE_TTL, evento)
+    return dict(evento) if evento is not None else None
+
+def invalidar_evento_cache(evento_id: Optional[str] = None):
+    """Invalida un evento concreto o toda la caché"""
+    if evento_id is None:
+        _eventos_cache.clear()
+    else:
+        _eventos_cache.pop(evento_id, None)
+
+async def contar_escaneo(canal: str, validacion) -> dict:
+    """Ejecuta una validación de puerta y cuenta su resultado (valido/fraude/ya_dentro/invalido)"""
+    try:
+        respuesta = await validacion
+    except HTTPException:
+        metrica_inc("ciudadferia_escaneos_total", canal=canal, resultado="invalido")
+        raise
+    if respuesta.get('valido'):
+        resultado = "valido"
+    elif respuesta.get('tipo_alerta') == 'fraude':
+        resultado = "fraude"
+    elif respuesta.get('tipo_alerta') == 'ya_dentro' or 'ya está dentro' in respuesta.get('mensaje', '').lower():
+        resultado = "ya_dentro"
+    else:
+        resultado = "invalido"
+    metrica_inc("ciudadferia_escaneos_total", canal=canal, resultado=resultado)
+    return respuesta
+
 # Public Routes
 @api_router.get("/")
 async def root():
@@ -475,8 +852,85 @@ async def obtener_version():
         "mensaje": "Si ves esta versión, el deploy fue exitoso"
     }
 
+# ---------- Compras idempotentes (cabecera Idempotency-Key) ----------
+# La primera petición con una clave reserva su documento en db.compra_requests (índice
+# único); los reintentos con la misma clave reciben la respuesta guardada sin volver a
+# generar entradas ni QR. Los documentos expiran por TTL (por eso fecha_creacion se
+# guarda como fecha BSON y no como texto ISO).
+
+IDEMPOTENCIA_TTL_HORAS = int(os.environ.get('IDEMPOTENCIA_TTL_HORAS', '24'))
+IDEMPOTENCIA_PROCESANDO_MAX_S = 120  # una compra "procesando" más tiempo se da por abandonada
+IDEMPOTENCIA_CLAVE_MAX = 255
+
+registrar_metrica("ciudadferia_compras_idempotencia_total", "counter", "Compras con Idempotency-Key por resultado")
+
+def huella_compra(compra: CompraEntrada) -> str:
+    """Hash del cuerpo: la misma clave con otros datos es un error del cliente"""
+    return hashlib.sha256(compra.model_dump_json().encode()).hexdigest()
+
+async def reservar_clave_compra(clave: str, huella: str) -> Optional[dict]:
+    """
+    Reserva la clave para esta petición. Devuelve None si le toca procesar la compra,
+    o el documento existente si es un reintento (completada o aún procesando).
+    """
+    ahora = datetime.now(timezone.utc)
+    try:
+        await db.compra_requests.insert_one({
+            "clave": clave, "huella": huella, "estado": "procesando", "fecha_creacion": ahora
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+    # Un intento que murió a medias no debe bloquear la clave hasta que expire
+    abandonada = await db.compra_requests.find_one_and_update(
+        {"clave": clave, "huella": huella, "estado": "procesando",
+         "fecha_creacion": {"$lt": ahora - timedelta(seconds=IDEMPOTENCIA_PROCESANDO_MAX_S)}},
+        {"$set": {"fecha_creacion": ahora}}
+    )
+    if abandonada:
+        return None
+    existente = await db.compra_requests.find_one({"clave": clave}, {"_id": 0})
+    # Expiró entre el insert y la lectura: se reintenta la reserva
+    return existente if existente else await reservar_clave_compra(clave, huella)
+
 @api_router.post("/comprar-entrada")
-async def comprar_entrada(compra: CompraEntrada):
+async def comprar_entrada(compra: CompraEntrada, request: Request):
+    """Registra una compra; con Idempotency-Key los reintentos devuelven la primera respuesta"""
+    clave = request.headers.get("idempotency-key")
+    if clave is None:
+        return await registrar_compra(compra)
+    if not clave.strip() or len(clave) > IDEMPOTENCIA_CLAVE_MAX:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key inválida (1 a {IDEMPOTENCIA_CLAVE_MAX} caracteres)")
+    
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    huella = huella_compra(compra)
+    existente = await reservar_clave_compra(clave, huella)
+    if existente:
+        if existente["huella"] != huella:
+            metrica_inc("ciudadferia_compras_idempotencia_total", resultado="conflicto")
+            raise HTTPException(status_code=422, detail="La Idempotency-Key ya se usó con datos de compra distintos")
+        if existente["estado"] != "completada":
+            metrica_inc("ciudadferia_compras_idempotencia_total", resultado="en_proceso")
+            raise HTTPException(status_code=409, detail="Esta compra todavía se está procesando",
+                                headers={"Retry-After": "2"})
+        metrica_inc("ciudadferia_compras_idempotencia_total", resultado="repetida")
+        return JSONResponse(content=existente["respuesta"], headers={"Idempotent-Replayed": "true"})
+    
+    try:
+        resultado = jsonable_encoder(await registrar_compra(compra))
+    except BaseException:
+        # Los errores no se guardan: el cliente puede reintentar con la misma clave
+        await asyncio.shield(db.compra_requests.delete_one({"clave": clave, "estado": "procesando"}))
+        raise
+    await db.compra_requests.update_one(
+        {"clave": clave},
+        {"$set": {"estado": "completada", "respuesta": resultado}}
+    )
+    metrica_inc("ciudadferia_compras_idempotencia_total", resultado="nueva")
+    return resultado
+
+async def registrar_compra(compra: CompraEntrada) -> dict:
     evento = await db.eventos.find_one({"id": compra.evento_id}, {"_id": 0})
     if not evento:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
@@ -536,7 +990,8 @@ async def comprar_entrada(compra: CompraEntrada):
         hash_validacion = generar_hash(datos_entrada)
         datos_entrada['hash'] = hash_validacion
         
-        qr_image, qr_payload = generar_qr_seguro(datos_entrada)
+        qr_nonce = nuevo_qr_nonce()
+        qr_image, qr_payload = generar_qr_seguro(datos_entrada, qr_nonce)
         
         entrada = Entrada(
             id=entrada_id,
@@ -562,6 +1017,7 @@ async def comprar_entrada(compra: CompraEntrada):
         doc_entrada['fecha_compra'] = doc_entrada['fecha_compra'].isoformat()
         doc_entrada['codigo_alfanumerico'] = codigo_alfanumerico
         doc_entrada['categoria_asiento'] = compra.categoria_asiento
+        doc_entrada['qr_nonce'] = qr_nonce
         await db.entradas.insert_one(doc_entrada)
         
         entrada_dict = entrada.model_dump()
@@ -584,6 +1040,9 @@ async def comprar_entrada(compra: CompraEntrada):
 
 @api_router.post("/validar-entrada")
 async def validar_entrada(request: Request):
+    return await contar_escaneo("qr", _validar_entrada(request))
+
+async def _validar_entrada(request: Request):
     body = await request.json()
     qr_payload = body.get('qr_payload')
     accion = body.get('accion', 'verificar')  # verificar, entrada, salida
@@ -656,6 +1115,7 @@ async def validar_entrada(request: Request):
                 {"id": acreditacion_id},
                 {"$set": {"estado_entrada": "dentro", "historial_acceso": historial}}
             )
+            await registrar_flujo(acreditacion.get("evento_id"), "entrada", categoria)
             
             return {
                 "valido": True,
@@ -668,6 +1128,8 @@ async def validar_entrada(request: Request):
                 {"id": acreditacion_id},
                 {"$set": {"estado_entrada": "fuera"}}
             )
+            if acreditacion.get("estado_entrada") == "dentro":
+                await registrar_flujo(acreditacion.get("evento_id"), "salida", categoria)
             return {
                 "valido": True,
                 "tipo": "acreditacion", 
@@ -758,7 +1220,7 @@ async def validar_entrada(request: Request):
     
     if accion == 'verificar':
         # Obtener info del evento para la ubicación
-        evento_info = await db.eventos.find_one({"id": entrada.get('evento_id')}, {"_id": 0, "ubicacion": 1})
+        evento_info = await obtener_evento_cache(entrada.get('evento_id'))
         ubicacion = evento_info.get('ubicacion', '') if evento_info else ''
         categoria = entrada.get('categoria_entrada') or entrada.get('categoria_asiento') or 'General'
         
@@ -810,9 +1272,10 @@ async def validar_entrada(request: Request):
                 }
             }
         )
+        await registrar_flujo(entrada.get("evento_id"), "entrada", categoria)
         
         # Obtener ubicación
-        evento_info = await db.eventos.find_one({"id": entrada.get('evento_id')}, {"_id": 0, "ubicacion": 1})
+        evento_info = await obtener_evento_cache(entrada.get('evento_id'))
         ubicacion = evento_info.get('ubicacion', '') if evento_info else ''
         
         return {
@@ -852,6 +1315,7 @@ async def validar_entrada(request: Request):
                 }
             }
         )
+        await registrar_flujo(entrada.get("evento_id"), "salida", entrada.get("categoria_entrada") or entrada.get("categoria_asiento") or "General")
         
         return {
             "valido": True,
@@ -865,6 +1329,9 @@ async def validar_entrada(request: Request):
 
 @api_router.post("/validar-entrada-codigo")
 async def validar_entrada_por_codigo(request: Request):
+    return await contar_escaneo("codigo", _validar_entrada_por_codigo(request))
+
+async def _validar_entrada_por_codigo(request: Request):
     """Valida una entrada por su código alfanumérico"""
     body = await request.json()
     codigo = body.get('codigo', '').strip().upper()
@@ -922,6 +1389,7 @@ async def validar_entrada_por_codigo(request: Request):
                     {"id": acreditacion['id']},
                     {"$set": {"estado_entrada": "dentro", "historial_acceso": historial}}
                 )
+                await registrar_flujo(acreditacion.get("evento_id"), "entrada", categoria)
                 
                 return {
                     "valido": True,
@@ -934,6 +1402,8 @@ async def validar_entrada_por_codigo(request: Request):
                     {"id": acreditacion['id']},
                     {"$set": {"estado_entrada": "fuera"}}
                 )
+                if acreditacion.get("estado_entrada") == "dentro":
+                    await registrar_flujo(acreditacion.get("evento_id"), "salida", categoria)
                 return {
                     "valido": True,
                     "tipo": "acreditacion",
@@ -952,7 +1422,7 @@ async def validar_entrada_por_codigo(request: Request):
     categoria = entrada.get('categoria_entrada') or entrada.get('categoria_asiento') or 'General'
     
     # Obtener ubicación del evento
-    evento_info = await db.eventos.find_one({"id": entrada.get('evento_id')}, {"_id": 0, "ubicacion": 1})
+    evento_info = await obtener_evento_cache(entrada.get('evento_id'))
     ubicacion = evento_info.get('ubicacion', '') if evento_info else ''
     
     if accion == 'verificar':
@@ -994,6 +1464,7 @@ async def validar_entrada_por_codigo(request: Request):
             {"id": entrada_id},
             {"$set": {"estado_entrada": "dentro", "historial_acceso": historial}}
         )
+        await registrar_flujo(entrada.get("evento_id"), "entrada", categoria)
         
         return {
             "valido": True,
@@ -1023,6 +1494,7 @@ async def validar_entrada_por_codigo(request: Request):
             {"id": entrada_id},
             {"$set": {"estado_entrada": "fuera", "historial_acceso": historial}}
         )
+        await registrar_flujo(entrada.get("evento_id"), "salida", categoria)
         
         return {
             "valido": True,
@@ -1044,7 +1516,7 @@ async def regenerar_qr_entrada(entrada_id: str, current_user: str = Depends(get_
         raise HTTPException(status_code=400, detail="Solo se pueden regenerar QRs de entradas aprobadas")
     
     # Obtener evento
-    evento = await db.eventos.find_one({"id": entrada['evento_id']}, {"_id": 0})
+    evento = await obtener_evento_cache(entrada['evento_id'])
     nombre_evento = evento['nombre'] if evento else entrada.get('nombre_evento', '')
     
     # Regenerar QR con los mismos datos que se usan en la validación
@@ -1064,8 +1536,9 @@ async def regenerar_qr_entrada(entrada_id: str, current_user: str = Depends(get_
     hash_validacion = generar_hash(datos_entrada)
     datos_entrada['hash'] = hash_validacion
     
-    # Generar QR
-    qr_image, qr_payload = generar_qr_seguro(datos_entrada)
+    # Generar QR (nonce nuevo: el QR anterior deja de coincidir con el guardado)
+    qr_nonce = nuevo_qr_nonce()
+    qr_image, qr_payload = generar_qr_seguro(datos_entrada, qr_nonce)
     
     # Actualizar entrada
     await db.entradas.update_one(
@@ -1075,6 +1548,7 @@ async def regenerar_qr_entrada(entrada_id: str, current_user: str = Depends(get_
                 "codigo_qr": qr_image,
                 "qr_payload": qr_payload,
                 "hash_validacion": hash_validacion,
+                "qr_nonce": qr_nonce,
                 "nombre_evento": nombre_evento
             }
         }
@@ -1086,15 +1560,125 @@ async def regenerar_qr_entrada(entrada_id: str, current_user: str = Depends(get_
         "entrada_id": entrada_id
     }
 
+# Búsqueda por email sin distinguir mayúsculas: la consulta usa la misma collation
+# que el índice (email_comprador, fecha_compra, id), así no hace falta migrar datos.
+COLLATION_EMAIL = {"locale": "es", "strength": 2}
+MIS_ENTRADAS_LIMITE_MAX = 100
+PROYECCION_TARJETA_ENTRADA = {
+    "_id": 0, "id": 1, "evento_id": 1, "nombre_evento": 1, "nombre_comprador": 1,
+    "fecha_compra": 1, "estado_pago": 1, "usado": 1, "estado_entrada": 1,
+    "categoria_asiento": 1, "categoria_entrada": 1, "asiento": 1, "mesa": 1, "silla": 1,
+    "codigo_alfanumerico": 1
+}
+
+def _codificar_cursor(fecha_compra, entrada_id: str) -> str:
+    valor = fecha_compra.isoformat() if isinstance(fecha_compra, datetime) else fecha_compra
+    return base64.urlsafe_b64encode(json.dumps([valor, entrada_id]).encode()).decode()
+
+def _decodificar_cursor(cursor: str) -> tuple:
+    try:
+        fecha_compra, entrada_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return fecha_compra, entrada_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+
 @api_router.get("/mis-entradas/{email}")
-async def obtener_mis_entradas(email: str):
-    entradas = await db.entradas.find({"email_comprador": email}, {"_id": 0}).to_list(100)
+async def obtener_mis_entradas(email: str, limite: int = 20, cursor: Optional[str] = None, vista: str = "tarjeta"):
+    """
+    Entradas de un comprador, de la más reciente a la más antigua, paginadas por cursor.
+    La vista "tarjeta" omite el QR y el comprobante (se sirven en /entrada/{id}/qr y
+    /entrada/{id}/comprobante); "completa" devuelve el documento entero.
+    """
+    limite = max(1, min(limite, MIS_ENTRADAS_LIMITE_MAX))
+    filtro = {"email_comprador": email.strip()}
+    if cursor:
+        fecha_compra, entrada_id = _decodificar_cursor(cursor)
+        filtro["$or"] = [
+            {"fecha_compra": {"$lt": fecha_compra}},
+            {"fecha_compra": fecha_compra, "id": {"$lt": entrada_id}}
+        ]
+    proyeccion = {"_id": 0} if vista == "completa" else PROYECCION_TARJETA_ENTRADA
+    entradas = await db.entradas.find(filtro, proyeccion, collation=COLLATION_EMAIL).sort(
+        [("fecha_compra", -1), ("id", -1)]
+    ).limit(limite + 1).to_list(limite + 1)
+
+    siguiente = None
+    if len(entradas) > limite:
+        entradas = entradas[:limite]
+        siguiente = _codificar_cursor(entradas[-1].get("fecha_compra"), entradas[-1]["id"])
     for entrada in entradas:
         if isinstance(entrada.get('fecha_compra'), str):
             entrada['fecha_compra'] = datetime.fromisoformat(entrada['fecha_compra'])
         if entrada.get('fecha_uso') and isinstance(entrada.get('fecha_uso'), str):
             entrada['fecha_uso'] = datetime.fromisoformat(entrada['fecha_uso'])
-    return entradas
+        if entrada.get("estado_pago") == "aprobado":
+            entrada["qr_url"] = f"/api/entrada/{entrada['id']}/qr"
+    return {"entradas": entradas, "siguiente": siguiente}
+
+def _respuesta_imagen_cacheable(request: Request, contenido: bytes, media_type: str, privada: bool = False):
+    """Imagen con ETag y Cache-Control; responde 304 si el cliente ya la tiene"""
+    from fastapi.responses import Response
+
+    etag = '"' + hashlib.sha1(contenido).hexdigest() + '"'
+    cabeceras = {
+        "ETag": etag,
+        "Cache-Control": f"{'private' if privada else 'public'}, max-age=86400"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cabeceras)
+    return Response(content=contenido, media_type=media_type, headers=cabeceras)
+
+@api_router.get("/entrada/{entrada_id}/qr")
+async def obtener_qr_entrada(entrada_id: str, request: Request):
+    """PNG del QR de una entrada aprobada (el guardado, o renderizado desde el payload)"""
+    entrada = await db.entradas.find_one(
+        {"id": entrada_id}, {"_id": 0, "estado_pago": 1, "codigo_qr": 1, "qr_payload": 1}
+    )
+    if not entrada:
+        raise HTTPException(status_code=404, detail="Entrada no encontrada")
+    if entrada.get('estado_pago') != 'aprobado':
+        raise HTTPException(status_code=403, detail="Entrada no aprobada aún")
+
+    codigo_qr = entrada.get("codigo_qr")
+    if not codigo_qr and entrada.get("qr_payload"):
+        codigo_qr = renderizar_qr_png(entrada["qr_payload"])
+    if not codigo_qr or not codigo_qr.startswith("data:image"):
+        raise HTTPException(status_code=404, detail="La entrada no tiene QR")
+    return _respuesta_imagen_cacheable(request, base64.b64decode(codigo_qr.split(",", 1)[1]), "image/png")
+
+@api_router.get("/entrada/{entrada_id}/comprobante")
+async def obtener_comprobante_entrada(entrada_id: str, email: str, request: Request):
+    """Comprobante de pago de una entrada; exige el email del comprador"""
+    from fastapi.responses import RedirectResponse
+
+    entrada = await db.entradas.find_one(
+        {"id": entrada_id, "email_comprador": email.strip()},
+        {"_id": 0, "comprobante_pago": 1},
+        collation=COLLATION_EMAIL
+    )
+    if not entrada:
+        raise HTTPException(status_code=404, detail="Entrada no encontrada")
+    comprobante = entrada.get("comprobante_pago")
+    if not comprobante:
+        raise HTTPException(status_code=404, detail="La entrada no tiene comprobante")
+    if comprobante.startswith("http") or comprobante.startswith(MEDIA_PREFIJO):
+        return RedirectResponse(comprobante)
+    if not comprobante.startswith("data:"):
+        raise HTTPException(status_code=404, detail="Formato de comprobante no soportado")
+    # El tipo del data URI lo declara el comprador: se sirve el que indican los bytes,
+    # y solo si es una imagen raster o un PDF (nunca HTML/SVG desde el origen de la API)
+    try:
+        contenido = base64.b64decode(comprobante.split(",", 1)[1])
+    except (IndexError, ValueError):
+        raise HTTPException(status_code=415, detail="Formato de comprobante no soportado")
+    media_type = await asyncio.to_thread(tipo_media_seguro, contenido)
+    if media_type is None:
+        raise HTTPException(status_code=415, detail="Formato de comprobante no soportado")
+    respuesta = _respuesta_imagen_cacheable(request, contenido, media_type, privada=True)
+    respuesta.headers["X-Content-Type-Options"] = "nosniff"
+    if not media_type.startswith("image/"):
+        respuesta.headers["Content-Disposition"] = f"attachment; filename=comprobante_{entrada_id}.pdf"
+    return respuesta
 
 # Admin Routes
 @api_router.post("/admin/login")
@@ -1104,7 +1688,7 @@ async def admin_login(login: AdminLogin):
     if not admin:
         # Create default admin on first login attempt
         if login.username == "admin" and login.password == "admin123":
-            hashed = get_password_hash("admin123")
+            hashed = await get_password_hash_async("admin123")
             await db.admin_users.insert_one({
                 "username": "admin", 
                 "hashed_password": hashed,
@@ -1114,7 +1698,7 @@ async def admin_login(login: AdminLogin):
         else:
             raise HTTPException(status_code=401, detail="Usuario o contraseña incorrectos")
     
-    if not verify_password(login.password, admin["hashed_password"]):
+    if not await verify_password_async(login.password, admin["hashed_password"]):
         raise HTTPException(status_code=401, detail="Usuario o contraseña incorrectos")
     
     # Include role in token
@@ -1142,7 +1726,7 @@ async def crear_usuario(user: UserCreate, current_user: str = Depends(get_curren
     if existing:
         raise HTTPException(status_code=400, detail="El usuario ya existe")
     
-    hashed = get_password_hash(user.password)
+    hashed = await get_password_hash_async(user.password)
     new_user = {
         "username": user.username,
         "hashed_password": hashed,
@@ -1172,6 +1756,7 @@ async def crear_evento_admin(evento: EventoCreate, current_user: str = Depends(g
     doc = evento_obj.model_dump()
     doc['fecha_creacion'] = doc['fecha_creacion'].isoformat()
     await db.eventos.insert_one(doc)
+    invalidar_evento_cache(evento_obj.id)
     return evento_obj
 
 @api_router.put("/admin/eventos/{evento_id}")
@@ -1184,6 +1769,7 @@ async def actualizar_evento_admin(evento_id: str, evento: EventoUpdate, current_
     
     if update_data:
         await db.eventos.update_one({"id": evento_id}, {"$set": update_data})
+        invalidar_evento_cache(evento_id)
     
     evento_actualizado = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
     return evento_actualizado
@@ -1191,6 +1777,7 @@ async def actualizar_evento_admin(evento_id: str, evento: EventoUpdate, current_
 @api_router.delete("/admin/eventos/{evento_id}")
 async def eliminar_evento_admin(evento_id: str, current_user: str = Depends(get_current_user)):
     result = await db.eventos.delete_one({"id": evento_id})
+    invalidar_evento_cache(evento_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
     return {"message": "Evento eliminado exitosamente"}
@@ -1209,7 +1796,7 @@ async def eliminar_entrada_admin(entrada_id: str, current_user: str = Depends(ge
 async def obtener_asistencia_evento(evento_id: str, current_user: str = Depends(get_current_user)):
     """Obtener estadísticas de asistencia (quiénes han entrado) por evento"""
     
-    evento = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
+    evento = await obtener_evento_cache(evento_id)
     if not evento:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
     
@@ -1355,35 +1942,141 @@ async def listar_compras_admin(
             entrada['fecha_compra'] = datetime.fromisoformat(entrada['fecha_compra'])
     return entradas
 
-@api_router.post("/admin/aprobar-compra")
-async def aprobar_compra_admin(datos: AprobarCompra, current_user: str = Depends(get_current_user)):
-    result = await db.entradas.update_many(
-        {"id": {"$in": datos.entrada_ids}},
-        {"$set": {"estado_pago": "aprobado"}}
-    )
-    
+# ---------- Moderación masiva de compras ----------
+# Aprobar o rechazar por lista de ids (de cualquier tamaño) o por filtro, por bloques.
+# Al rechazar, una agregación agrupa el bloque por evento, se borra por evento y un solo
+# bulk_write aplica los $inc con lo realmente borrado. Solo los eventos de entrada general descuentan inventario
+# al comprar, así que solo a esos se les devuelve.
+
+MODERACION_CHUNK = 1000
+MODERACION_SINCRONA_MAX = 1000  # por encima de esto se procesa como trabajo en segundo plano
+ACCIONES_MODERACION = ("aprobar", "rechazar")
+
+class ModeracionCompras(BaseModel):
+    accion: str
+    entrada_ids: Optional[List[str]] = None
+    evento_id: Optional[str] = None
+    estado: Optional[str] = None
+
+def filtro_moderacion(accion: str, entrada_ids: Optional[List[str]] = None,
+                      evento_id: Optional[str] = None, estado: Optional[str] = None) -> dict:
+    """Filtro de entradas a moderar; exige ids o algún criterio para no tocar todas las compras"""
+    if accion not in ACCIONES_MODERACION:
+        raise HTTPException(status_code=400, detail="La acción debe ser 'aprobar' o 'rechazar'")
+    if entrada_ids is None and not evento_id and not estado:
+        raise HTTPException(status_code=400, detail="Indica entrada_ids, evento_id o estado")
+    filtro = {}
+    if entrada_ids is not None:
+        filtro["id"] = {"$in": entrada_ids}
+    if evento_id:
+        filtro["evento_id"] = evento_id
+    if estado:
+        filtro["estado_pago"] = estado
+    if accion == "aprobar":
+        # Las ya aprobadas salen del filtro: reanudar es volver a consultar
+        filtro["estado_pago"] = {"$eq": estado, "$ne": "aprobado"} if estado else {"$ne": "aprobado"}
+    return filtro
+
+async def eliminar_por_evento(ids: List[str]) -> list:
+    """
+    Agrupa el bloque por evento en una agregación y borra evento a evento: cada delta es
+    el deleted_count real, así dos rechazos simultáneos del mismo bloque no devuelven
+    el inventario dos veces (el segundo no borra nada).
+    """
+    grupos = await db.entradas.aggregate([
+        {"$match": {"id": {"$in": ids}}},
+        {"$group": {"_id": "$evento_id", "ids": {"$push": "$id"}}}
+    ]).to_list(None)
+    deltas = []
+    for grupo in grupos:
+        result = await db.entradas.delete_many({"id": {"$in": grupo["ids"]}, "evento_id": grupo["_id"]})
+        if result.deleted_count:
+            deltas.append({"_id": grupo["_id"], "cantidad": result.deleted_count})
+    return deltas
+
+async def aplicar_devoluciones(deltas: list) -> int:
+    """Devuelve el inventario con un solo bulk_write; retorna cuántos eventos modificó"""
+    if not deltas:
+        return 0
+    result = await db.eventos.bulk_write([
+        UpdateOne(
+            {"id": d["_id"], "tipo_asientos": {"$nin": ["mesas", "mixto"]}},
+            {"$inc": {"asientos_disponibles": d["cantidad"]}}
+        )
+        for d in deltas
+    ], ordered=False)
+    return result.modified_count
+
+async def moderar_compras(accion: str, filtro: dict, ctx=None) -> dict:
+    """
+    Aplica la acción por bloques de MODERACION_CHUNK. Con ctx (trabajo) reporta progreso;
+    como cada bloque sale del filtro al procesarse, al reanudar basta con volver a consultar.
+    """
+    total = await db.entradas.count_documents(filtro)
+    procesadas = actualizaciones_inventario = 0
+    if ctx is not None and ctx.punto_control:
+        procesadas = ctx.punto_control.get("procesadas", 0)
+        total += procesadas
+    while True:
+        bloque = await db.entradas.find(filtro, {"_id": 0, "id": 1}).limit(MODERACION_CHUNK).to_list(MODERACION_CHUNK)
+        if not bloque:
+            break
+        ids = [e["id"] for e in bloque]
+        if accion == "aprobar":
+            result = await db.entradas.update_many({"id": {"$in": ids}}, {"$set": {"estado_pago": "aprobado"}})
+            procesadas += result.modified_count
+        else:
+            # Se borra antes de devolver: si el proceso cae entre medias se pierde la
+            # devolución de un bloque (se corrige a mano), pero nunca se devuelve dos veces
+            deltas = await eliminar_por_evento(ids)
+            actualizaciones_inventario += await aplicar_devoluciones(deltas)
+            procesadas += sum(d["cantidad"] for d in deltas)
+        if ctx is not None:
+            await ctx.progreso(procesadas, total, punto_control={"procesadas": procesadas})
+    
+    if accion == "aprobar":
+        return {"message": f"{procesadas} entrada(s) aprobada(s)", "aprobadas": procesadas}
     return {
-        "message": f"{result.modified_count} entrada(s) aprobada(s)",
-        "aprobadas": result.modified_count
+        "message": f"{procesadas} entrada(s) rechazada(s)",
+        "eliminadas": procesadas,
+        "actualizaciones_inventario": actualizaciones_inventario
     }
 
+async def ejecutar_moderacion(accion: str, parametros: dict, current_user: str, en_segundo_plano: Optional[bool] = None):
+    """Modera en la petición si es pequeño; si no (o si se pide), encola un trabajo"""
+    filtro = filtro_moderacion(accion, **parametros)
+    if en_segundo_plano is None:
+        ids = parametros.get("entrada_ids")
+        cantidad = len(ids) if ids is not None else await db.entradas.count_documents(filtro)
+        en_segundo_plano = cantidad > MODERACION_SINCRONA_MAX
+    if en_segundo_plano:
+        job = await encolar_job("moderar_compras", {"accion": accion, **parametros}, current_user)
+        return respuesta_job_encolado(job)
+    resultado = await moderar_compras(accion, filtro)
+    logging.info(f"Moderación ({accion}) por {current_user}: {resultado['message']}")
+    return resultado
+
+@api_router.post("/admin/aprobar-compra")
+async def aprobar_compra_admin(datos: AprobarCompra, current_user: str = Depends(get_current_user)):
+    return await ejecutar_moderacion("aprobar", {"entrada_ids": datos.entrada_ids}, current_user)
+
 @api_router.post("/admin/rechazar-compra")
 async def rechazar_compra_admin(datos: AprobarCompra, current_user: str = Depends(get_current_user)):
     # Devolver asientos y eliminar entradas
-    entradas = await db.entradas.find({"id": {"$in": datos.entrada_ids}}).to_list(100)
-    
-    for entrada in entradas:
-        await db.eventos.update_one(
-            {"id": entrada['evento_id']},
-            {"$inc": {"asientos_disponibles": 1}}
-        )
-    
-    result = await db.entradas.delete_many({"id": {"$in": datos.entrada_ids}})
-    
-    return {
-        "message": f"{result.deleted_count} entrada(s) rechazada(s)",
-        "eliminadas": result.deleted_count
-    }
+    return await ejecutar_moderacion("rechazar", {"entrada_ids": datos.entrada_ids}, current_user)
+
+@api_router.post("/admin/compras/moderar")
+async def moderar_compras_admin(
+    datos: ModeracionCompras,
+    en_segundo_plano: Optional[bool] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Aprueba o rechaza compras por ids o por filtro (evento_id, estado).
+    Más de MODERACION_SINCRONA_MAX entradas (o en_segundo_plano=true) responde 202 con el trabajo.
+    """
+    parametros = datos.model_dump(exclude={"accion"}, exclude_none=True)
+    return await ejecutar_moderacion(datos.accion, parametros, current_user, en_segundo_plano)
 
 @api_router.get("/metodos-pago")
 async def listar_metodos_pago():
@@ -1487,15 +2180,10 @@ async def obtener_asientos_evento(evento_id: str):
         "disponibles": evento.get('asientos_disponibles', 0) - len(asientos_ocupados) - len(asientos_pendientes)
     }
 
-@api_router.post("/admin/eventos/{evento_id}/configurar-asientos")
-async def configurar_asientos_evento(
-    evento_id: str, 
-    request: Request,
-    current_user: str = Depends(get_current_user)
-):
-    """Configurar el sistema de asientos para un evento"""
-    body = await request.json()
-    
+ASIENTOS_CHUNK = 1000  # documentos por insert_many al regenerar los asientos
+
+async def aplicar_configuracion_asientos(evento_id: str, body: dict, ctx=None) -> dict:
+    """Guarda la configuración y regenera los asientos del evento; con ctx (trabajo) reporta progreso"""
     evento = await db.eventos.find_one({"id": evento_id})
     if not evento:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
@@ -1532,6 +2220,7 @@ async def configurar_asientos_evento(
             }
         }
     )
+    invalidar_evento_cache(evento_id)
     
     # Crear/actualizar documento de asientos
     await db.asientos.delete_many({"evento_id": evento_id})
@@ -1585,8 +2274,10 @@ async def configurar_asientos_evento(
         
         # Entradas generales no necesitan documento individual
     
-    if asientos_docs:
-        await db.asientos.insert_many(asientos_docs)
+    for i in range(0, len(asientos_docs), ASIENTOS_CHUNK):
+        await db.asientos.insert_many(asientos_docs[i:i + ASIENTOS_CHUNK])
+        if ctx is not None:
+            await ctx.progreso(min(i + ASIENTOS_CHUNK, len(asientos_docs)), len(asientos_docs), "Creando asientos")
     
     return {
         "success": True,
@@ -1596,6 +2287,23 @@ async def configurar_asientos_evento(
         "asientos_creados": len(asientos_docs)
     }
 
+@api_router.post("/admin/eventos/{evento_id}/configurar-asientos")
+async def configurar_asientos_evento(
+    evento_id: str, 
+    request: Request,
+    en_segundo_plano: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """Configurar el sistema de asientos para un evento (en_segundo_plano=true lo encola como trabajo)"""
+    body = await request.json()
+    
+    if en_segundo_plano:
+        if not await db.eventos.find_one({"id": evento_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Evento no encontrado")
+        job = await encolar_job("configurar_asientos", {"evento_id": evento_id, "body": body}, current_user)
+        return respuesta_job_encolado(job)
+    return await aplicar_configuracion_asientos(evento_id, body)
+
 @api_router.post("/reservar-asientos")
 async def reservar_asientos(request: Request):
     """Reservar asientos temporalmente durante el proceso de compra"""
@@ -1634,44 +2342,394 @@ async def reservar_asientos(request: Request):
         "expira_en": 600  # 10 minutos
     }
 
+# ==================== ALMACENAMIENTO DE ARCHIVOS ====================
+# Archivos direccionados por contenido: la clave es el sha256 de los bytes, así
+# la misma imagen se guarda una sola vez y la URL nunca cambia de contenido
+# (se sirve con caché inmutable). Dos backends: disco local (servido en
+# /api/media/{clave}) y Cloudinary.
+
+MEDIA_DIR = ROOT_DIR / "media"
+MEDIA_PREFIJO = "/api/media/"
+MEDIA_CHUNK = 256 * 1024
+# Solo imágenes raster y PDF: nada que un navegador ejecute (SVG/HTML) se sirve desde el origen de la API
+EXTENSIONES_MEDIA = {
+    "image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif",
+    "application/pdf": "pdf",
+}
+MEDIA_TYPES = {extension: media_type for media_type, extension in EXTENSIONES_MEDIA.items()}
+CLAVE_MEDIA_RE = re.compile(r"[0-9a-f]{64}\.[a-z0-9]{2,5}")
+ALMACENAMIENTO_IMAGENES = os.environ.get(
+    'ALMACENAMIENTO_IMAGENES', 'cloudinary' if os.environ.get('CLOUDINARY_CLOUD_NAME') else 'local'
+)
+
+def clave_contenido(origen, media_type: str) -> str:
+    """sha256 del contenido (bytes o archivo, leído por bloques) + extensión del tipo"""
+    digest = hashlib.sha256()
+    if isinstance(origen, (bytes, bytearray)):
+        digest.update(origen)
+    else:
+        with open(origen, 'rb') as archivo:
+            for bloque in iter(lambda: archivo.read(MEDIA_CHUNK), b''):
+                digest.update(bloque)
+    return f"{digest.hexdigest()}.{EXTENSIONES_MEDIA.get(media_type, 'bin')}"
+
+def tipo_media_seguro(contenido: bytes) -> Optional[str]:
+    """
+    Tipo real del contenido según sus bytes (no el declarado por el cliente) si es
+    un PDF o una imagen raster válida de EXTENSIONES_MEDIA; None en cualquier otro caso.
+    """
+    if contenido[:5] == b"%PDF-":
+        return "application/pdf"
+    try:
+        with Image.open(BytesIO(contenido)) as img:
+            if img.size[0] * img.size[1] > UPLOAD_MAX_PIXELES:
+                return None
+            img.verify()
+            media_type = Image.MIME.get(img.format or "")
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        return None
+    return media_type if media_type in EXTENSIONES_MEDIA else None
+
+class AlmacenamientoLocal:
+    """Archivos en MEDIA_DIR/<2 primeros caracteres>/<clave>"""
+    nombre = "local"
+
+    def __init__(self, raiz: Path):
+        self.raiz = raiz
+
+    def ruta(self, clave: str) -> Path:
+        return self.raiz / clave[:2] / clave
+
+    def guardar(self, origen, clave: str, media_type: str) -> str:
+        destino = self.ruta(clave)
+        if not destino.exists():  # mismo contenido = misma clave: nada que escribir
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            temporal = destino.with_name(f"{clave}.{uuid.uuid4().hex}.tmp")
+            if isinstance(origen, (bytes, bytearray)):
+                temporal.write_bytes(origen)
+            else:
+                shutil.copyfile(origen, temporal)
+            os.replace(temporal, destino)  # atómico: nunca se sirve un archivo a medias
+        return MEDIA_PREFIJO + clave
+
+class AlmacenamientoCloudinary:
+    """Archivos en Cloudinary con public_id = hash del contenido (sin sobrescribir)"""
+    nombre = "cloudinary"
+
+    def guardar(self, origen, clave: str, media_type: str) -> str:
+        result = cloudinary.uploader.upload(
+            origen if isinstance(origen, (bytes, bytearray)) else str(origen),
+            folder="ciudadferia",
+            public_id=clave.rsplit('.', 1)[0],
+            overwrite=False,
+            resource_type="raw" if not media_type.startswith("image/") else "image"
+        )
+        return result["secure_url"]
+
+almacenamiento = AlmacenamientoCloudinary() if ALMACENAMIENTO_IMAGENES == 'cloudinary' else AlmacenamientoLocal(MEDIA_DIR)
+almacenamiento_local = almacenamiento if isinstance(almacenamiento, AlmacenamientoLocal) else AlmacenamientoLocal(MEDIA_DIR)
+
+def guardar_contenido(origen, media_type: str) -> dict:
+    """Guarda bytes o un archivo en el backend configurado (síncrono: se llama en un hilo)"""
+    clave = clave_contenido(origen, media_type)
+    return {"url": almacenamiento.guardar(origen, clave, media_type), "clave": clave}
+
+def ruta_media_local(referencia: str) -> Optional[Path]:
+    """Archivo local de una URL /api/media/{clave} (también con dominio delante)"""
+    if MEDIA_PREFIJO not in referencia:
+        return None
+    clave = referencia.split(MEDIA_PREFIJO)[-1].split('?')[0]
+    if not CLAVE_MEDIA_RE.fullmatch(clave):
+        return None
+    return almacenamiento_local.ruta(clave)
+
+def respuesta_archivo(request: Request, ruta: Path, media_type: str, cache_control: str, etag: str):
+    """
+    Sirve un archivo con ETag/304 y soporte de Range (un solo rango, 206/416).
+    Se envía por bloques desde disco sin cargarlo entero en memoria.
+    """
+    from fastapi.responses import Response, StreamingResponse
+
+    tamano = ruta.stat().st_size
+    cabeceras = {"Cache-Control": cache_control, "ETag": etag, "Accept-Ranges": "bytes"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cabeceras)
+
+    inicio, fin, estado = 0, tamano - 1, 200
+    rango = request.headers.get("range")
+    if rango and rango.startswith("bytes=") and "," not in rango:
+        desde, _, hasta = rango[6:].strip().partition("-")
+        try:
+            if desde:
+                inicio = int(desde)
+                fin = min(int(hasta), tamano - 1) if hasta else tamano - 1
+            else:  # sufijo: los últimos N bytes
+                inicio = max(0, tamano - int(hasta))
+        except ValueError:
+            inicio, fin = 0, tamano - 1
+        else:
+            if inicio > fin or inicio >= tamano:
+                return Response(status_code=416, headers={**cabeceras, "Content-Range": f"bytes */{tamano}"})
+            estado = 206
+            cabeceras["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+
+    def leer():
+        with open(ruta, 'rb') as archivo:
+            archivo.seek(inicio)
+            restante = fin - inicio + 1
+            while restante > 0:
+                bloque = archivo.read(min(MEDIA_CHUNK, restante))
+                if not bloque:
+                    break
+                restante -= len(bloque)
+                yield bloque
+
+    cabeceras["Content-Length"] = str(fin - inicio + 1)
+    return StreamingResponse(leer(), status_code=estado, media_type=media_type, headers=cabeceras)
+
+@api_router.get("/media/{clave}")
+async def obtener_media(clave: str, request: Request):
+    """Archivo direccionado por contenido (backend local): caché inmutable de un año"""
+    if not CLAVE_MEDIA_RE.fullmatch(clave):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    ruta = almacenamiento_local.ruta(clave)
+    if not ruta.exists():
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    media_type = MEDIA_TYPES.get(clave.rsplit('.', 1)[-1], "application/octet-stream")
+    respuesta = respuesta_archivo(request, ruta, media_type, "public, max-age=31536000, immutable", f'"{clave[:64]}"')
+    respuesta.headers["X-Content-Type-Options"] = "nosniff"
+    return respuesta
+
 # ==================== UPLOAD DE IMÁGENES ====================
 
+# La subida se vuelca a disco por bloques (nunca entera en memoria) y todo el
+# trabajo bloqueante — decodificar, validar, generar derivados y subir a
+# Cloudinary o al disco local — corre en hilos. Los derivados quedan registrados
+# en db.imagenes para que los renderers los usen sin redimensionar al vuelo.
+
+UPLOAD_CHUNK = 1024 * 1024
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_MB', '20')) * 1024 * 1024
+UPLOAD_MAX_PIXELES = 60_000_000
+
+# tipo -> (tamaño, modo): "exacto" estira como el renderer; "contener" conserva proporción sin agrandar
+DERIVADOS_IMAGEN = {
+    "entrada": ((600, 900), "exacto"),         # template de entrada
+    "miniatura": ((320, 320), "contener"),     # listados del panel
+    "credencial": ((1122, 1713), "contener"),  # 95 x 145 mm a 300 dpi
+}
+
+def procesar_imagen_subida(ruta: Path) -> dict:
+    """Valida y decodifica la imagen subida y escribe sus derivados junto al archivo temporal"""
+    from PIL import ImageOps
+
+    with Image.open(ruta) as img:
+        if img.size[0] * img.size[1] > UPLOAD_MAX_PIXELES:
+            raise ValueError(f"Imagen demasiado grande: {img.size[0]}x{img.size[1]}")
+        img.verify()
+    with Image.open(ruta) as img:
+        formato = (img.format or "png").lower()
+        img = ImageOps.exif_transpose(img)
+        transparente = img.has_transparency_data
+        img = img.convert('RGBA' if transparente else 'RGB')
+    # Con canal alfa real (algún píxel no opaco) los derivados van en PNG para conservarlo
+    # (templates de credencial que se dibujan con máscara); las opacas, en JPEG
+    if transparente and img.getchannel('A').getextrema()[0] == 255:
+        img = img.convert('RGB')
+    formato_derivado = "png" if img.mode == 'RGBA' else "jpeg"
+    _, media_type_derivado, extension = FORMATOS_IMAGEN[formato_derivado]
+
+    derivados = {}
+    for tipo, (tamano, modo) in DERIVADOS_IMAGEN.items():
+        if modo == "exacto":
+            derivado = img.resize(tamano, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        else:
+            derivado = img.copy()
+            derivado.thumbnail(tamano, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        destino = ruta.with_name(f"{ruta.name}_{tipo}.{extension}")
+        destino.write_bytes(codificar_imagen(derivado, formato_derivado, f"derivado_{tipo}"))
+        derivados[tipo] = destino
+    return {
+        "formato": formato, "ancho": img.size[0], "alto": img.size[1],
+        "derivados": derivados, "media_type_derivados": media_type_derivado
+    }
+
+def _limpiar_temporales(*rutas: Path):
+    for ruta in rutas:
+        try:
+            ruta.unlink(missing_ok=True)
+        except OSError as e:
+            logging.warning(f"No se pudo borrar el temporal {ruta}: {e}")
+
 @api_router.post("/upload-imagen")
 async def upload_imagen(file: UploadFile = File(...)):
-    """Subir una imagen a Cloudinary y retornar la URL permanente"""
-    if not file.content_type.startswith('image/'):
+    """Subir una imagen (Cloudinary o almacenamiento local) y retornar la URL permanente y sus derivados"""
+    if not file.content_type or not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="El archivo debe ser una imagen")
     
+    temporal = await asyncio.to_thread(tempfile.NamedTemporaryFile, prefix="upload-", delete=False)
+    ruta = Path(temporal.name)
+    info = None
     try:
-        # Leer contenido del archivo
-        file_content = await file.read()
+        # Volcar a disco por bloques
+        total = 0
+        while True:
+            bloque = await file.read(UPLOAD_CHUNK)
+            if not bloque:
+                break
+            total += len(bloque)
+            if total > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"La imagen supera {UPLOAD_MAX_BYTES // (1024 * 1024)} MB")
+            await asyncio.to_thread(temporal.write, bloque)
+        await asyncio.to_thread(temporal.close)
         
-        # Subir a Cloudinary
-        result = cloudinary.uploader.upload(
-            file_content,
-            folder="ciudadferia",
-            resource_type="image"
-        )
+        # Validar, decodificar y generar derivados fuera del event loop
+        try:
+            info = await asyncio.to_thread(procesar_imagen_subida, ruta)
+        except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+            logging.warning(f"Imagen rechazada ({file.filename}): {e}")
+            raise HTTPException(status_code=400, detail="El archivo no es una imagen válida")
         
-        # Retornar URL de Cloudinary (permanente)
+        # Subir original y derivados en paralelo (cada uno en su hilo), con clave por contenido
+        media_type = Image.MIME.get(info["formato"].upper(), file.content_type)
+        archivos = [("original", ruta, media_type)] + [
+            (tipo, derivado, info["media_type_derivados"]) for tipo, derivado in info["derivados"].items()
+        ]
+        try:
+            subidos = await asyncio.gather(*(
+                asyncio.to_thread(guardar_contenido, origen, tipo_archivo) for _, origen, tipo_archivo in archivos
+            ))
+        except Exception as e:
+            logging.error(f"Error subiendo imagen ({almacenamiento.nombre}): {e}")
+            raise HTTPException(status_code=500, detail=f"Error al subir imagen: {str(e)}")
+        
+        resultado = dict(zip((tipo for tipo, _, _ in archivos), subidos))
+        original = resultado.pop("original")
+        derivados = {tipo: r["url"] for tipo, r in resultado.items()}
+        await db.imagenes.update_one({"url": original["url"]}, {"$setOnInsert": {
+            "id": str(uuid.uuid4()),
+            "url": original["url"],
+            "public_id": original["clave"],
+            "filename": file.filename,
+            "content_type": file.content_type,
+            "bytes": total,
+            "ancho": info["ancho"],
+            "alto": info["alto"],
+            "almacenamiento": almacenamiento.nombre,
+            "derivados": derivados,
+            "fecha_subida": datetime.now(timezone.utc).isoformat()
+        }}, upsert=True)
+        
+        # Retornar URL permanente del original (la que guardan los formularios)
         return {
             "success": True,
-            "url": result["secure_url"],
-            "public_id": result["public_id"],
-            "filename": file.filename
+            "url": original["url"],
+            "public_id": original["clave"],
+            "filename": file.filename,
+            "derivados": derivados
         }
-    except Exception as e:
-        logging.error(f"Error subiendo a Cloudinary: {e}")
-        raise HTTPException(status_code=500, detail=f"Error al subir imagen: {str(e)}")
+    finally:
+        temporal.close()
+        derivados_tmp = list(info["derivados"].values()) if info else []
+        await asyncio.to_thread(_limpiar_temporales, ruta, *derivados_tmp)
 
 @api_router.get("/uploads/{filename}")
-async def get_upload(filename: str):
+async def get_upload(filename: str, request: Request):
     """Servir archivos subidos (legacy - para compatibilidad)"""
-    from fastapi.responses import FileResponse
+    import mimetypes
     file_path = UPLOADS_DIR / filename
-    if not file_path.exists():
+    if file_path.resolve().parent != UPLOADS_DIR.resolve() or not file_path.exists():
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
-    return FileResponse(file_path)
+    estado = file_path.stat()
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    etag = f'"{estado.st_mtime_ns:x}-{estado.st_size:x}"'
+    return respuesta_archivo(request, file_path, media_type, "public, max-age=86400", etag)
+
+# ---------- Migración de imágenes base64 embebidas en documentos ----------
+# Recorre las colecciones con campos que pueden guardar un data URI, sube cada
+# blob al almacenamiento (deduplicado por contenido) y reemplaza el campo por su
+# URL. El $set solo aplica si el campo sigue siendo un data URI.
+
+MIGRACION_CAMPOS = {
+    "eventos": ("imagen", "template_entrada", "template_acreditacion", "config_acreditaciones.*.template_imagen"),
+    "entradas": ("comprobante_pago",),
+    "acreditaciones": ("foto",),
+    "categorias_acreditacion": ("template_imagen",),
+    "metodos_pago": ("imagen",),
+    "configuracion": ("banner_principal", "logo", "imagen_fondo_home"),
+}
+
+def _valores_inline(doc: dict, campo: str, prefijo: str = ""):
+    """(ruta con puntos, data URI) de un campo; '*' recorre todas las claves de un dict"""
+    cabeza, _, resto = campo.partition(".")
+    claves = doc.keys() if cabeza == "*" else [cabeza]
+    for clave in claves:
+        valor = doc.get(clave)
+        ruta = f"{prefijo}{clave}"
+        if resto:
+            if isinstance(valor, dict):
+                yield from _valores_inline(valor, resto, ruta + ".")
+        elif isinstance(valor, str) and valor.startswith("data:") and "," in valor:
+            yield ruta, valor
+
+async def migrar_imagenes_inline(ctx) -> dict:
+    """Trabajo 'migrar_imagenes': extrae los data URI a almacenamiento; con simular=true solo cuenta"""
+    simular = bool(ctx.parametros.get("simular"))
+    vistos: dict = {}  # clave de contenido -> URL (una misma imagen repetida se sube una vez)
+    contadores = {"documentos": 0, "campos": 0, "bytes_liberados": 0, "errores": 0, "rechazados": 0}
+    for coleccion, campos in MIGRACION_CAMPOS.items():
+        simples = [c for c in campos if "*" not in c]
+        # Con comodines no se puede filtrar por el campo: se revisan todos los documentos
+        filtro = {} if len(simples) < len(campos) else {"$or": [{c: {"$regex": "^data:"}} for c in simples]}
+        proyeccion = {c.split(".")[0]: 1 for c in campos}
+        async for doc in db[coleccion].find(filtro, proyeccion):
+            cambios = {}
+            for campo in campos:
+                for ruta, valor in _valores_inline(doc, campo):
+                    _, _, datos = valor.partition(",")
+                    try:
+                        contenido = base64.b64decode(datos)
+                    except ValueError:
+                        contadores["errores"] += 1
+                        continue
+                    # El tipo declarado en el data URI lo escribe el cliente: se usa el real
+                    # y se deja en su sitio todo lo que no sea imagen raster o PDF
+                    media_type = await asyncio.to_thread(tipo_media_seguro, contenido)
+                    if media_type is None:
+                        contadores["rechazados"] += 1
+                        continue
+                    contadores["campos"] += 1
+                    contadores["bytes_liberados"] += len(valor)
+                    if simular:
+                        continue
+                    clave = clave_contenido(contenido, media_type)
+                    if clave not in vistos:
+                        vistos[clave] = (await asyncio.to_thread(guardar_contenido, contenido, media_type))["url"]
+                    cambios[ruta] = vistos[clave]
+            if cambios:
+                await db[coleccion].update_one(
+                    {"_id": doc["_id"], **{ruta: {"$regex": "^data:"} for ruta in cambios}},
+                    {"$set": cambios}
+                )
+                contadores["documentos"] += 1
+            # Solo se tocan campos que siguen siendo data URI: reanudar equivale a empezar de nuevo
+            await ctx.progreso(contadores["documentos"], mensaje=f"{coleccion}: {contadores['campos']} campo(s)")
+    invalidar_evento_cache()
+    logging.info(f"Migración de imágenes {ctx.id} completada: {contadores}")
+    return {**contadores, "archivos": len(vistos), "simular": simular, "almacenamiento": almacenamiento.nombre}
+
+@api_router.post("/admin/almacenamiento/migrar")
+async def iniciar_migracion_imagenes(simular: bool = False, current_user: str = Depends(get_current_user)):
+    """Saca las imágenes base64 de los documentos al almacenamiento (como trabajo); simular=true solo cuenta"""
+    job = await encolar_job("migrar_imagenes", {"simular": simular}, current_user)
+    return respuesta_job_encolado(job)
+
+@api_router.get("/admin/almacenamiento/migraciones/{migracion_id}")
+async def obtener_migracion_imagenes(migracion_id: str, current_user: str = Depends(get_current_user)):
+    """Estado y contadores de una migración de imágenes (es un trabajo de tipo migrar_imagenes)"""
+    job = await db.jobs.find_one({"id": migracion_id, "tipo": "migrar_imagenes"}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Migración no encontrada")
+    return job
 
 # ==================== CATEGORÍAS DE MESAS ====================
 
@@ -1744,7 +2802,210 @@ async def eliminar_categoria_mesa(categoria_id: str, current_user: str = Depends
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
     return {"success": True, "message": "Categoría eliminada"}
 
-# ==================== GENERACIÓN DE ENTRADA COMO IMAGEN ====================
+# ==================== REGISTRO DE RECURSOS DE RENDER ====================
+# Fuentes, logos, fondos decorativos y templates se cargan una sola vez (al
+# arrancar o en el primer uso) y los comparten todos los renderers.
+
+FUENTE_REGULAR = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+FUENTE_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+RECURSOS_MAX_TEMPLATES = int(os.environ.get('RECURSOS_MAX_TEMPLATES', '32'))
+
+_recursos_fuentes: dict = {}      # (ruta, tamaño) -> FreeTypeFont
+_recursos_estaticos: dict = {}    # clave -> Image | bytes (logos, fondos, bases)
+_recursos_templates: dict = {}    # sha1(referencia) -> Image 600x900 | bytes (orden = LRU)
+
+def obtener_fuente(ruta: str, tamano: int):
+    """Fuente TrueType cacheada por (ruta, tamaño); cae a la fuente por defecto si no existe"""
+    clave = (ruta, tamano)
+    fuente = _recursos_fuentes.get(clave)
+    if fuente is None:
+        try:
+            fuente = ImageFont.truetype(ruta, tamano)
+        except Exception:
+            fuente = ImageFont.load_default()
+        _recursos_fuentes[clave] = fuente
+    return fuente
+
+def obtener_recurso_render(clave: str, fabrica):
+    """Recurso estático (imagen o bytes) construido una sola vez por `fabrica`"""
+    recurso = _recursos_estaticos.get(clave)
+    if recurso is None:
+        recurso = fabrica()
+        _recursos_estaticos[clave] = recurso
+    return recurso
+
+def _guardar_template(clave: str, valor):
+    _recursos_templates.pop(clave, None)
+    _recursos_templates[clave] = valor
+    while len(_recursos_templates) > RECURSOS_MAX_TEMPLATES:
+        _recursos_templates.pop(next(iter(_recursos_templates)))
+
+def _leer_template(clave: str):
+    valor = _recursos_templates.pop(clave, None)
+    if valor is not None:
+        _recursos_templates[clave] = valor  # mover al final (más reciente)
+    return valor
+
+def _archivo_local_de_url(referencia: str) -> Optional[Path]:
+    if MEDIA_PREFIJO in referencia:
+        return ruta_media_local(referencia)
+    if '/api/uploads/' in referencia:
+        return UPLOADS_DIR / referencia.split('/api/uploads/')[-1]
+    if '/uploads/' in referencia:
+        return UPLOADS_DIR / referencia.split('/uploads/')[-1]
+    return None
+
+async def descargar_bytes_imagen(referencia: str) -> Optional[bytes]:
+    """Bytes de una imagen referenciada como data URI, URL externa o archivo local (legacy)"""
+    if referencia.startswith('data:image'):
+        return base64.b64decode(referencia.split(',')[1])
+    archivo_media = ruta_media_local(referencia)
+    if archivo_media is not None and archivo_media.exists():
+        return await asyncio.to_thread(archivo_media.read_bytes)
+    if referencia.startswith('http'):
+        import httpx
+        async with httpx.AsyncClient(timeout=30.0) as http_client:
+            response = await http_client.get(referencia)
+            if response.status_code == 200:
+                return response.content
+            logging.warning(f"Error descargando imagen: HTTP {response.status_code}")
+            return None
+    file_path = _archivo_local_de_url(referencia)
+    if file_path and file_path.exists():
+        return await asyncio.to_thread(file_path.read_bytes)
+    logging.warning(f"Imagen no encontrada: {referencia}")
+    return None
+
+_derivados_imagen: dict = {}  # url original -> {tipo: url derivado} (orden = LRU)
+
+async def referencia_derivada(referencia: str, tipo: str) -> str:
+    """URL del derivado `tipo` generado al subir la imagen; la referencia original si no existe"""
+    if not referencia or referencia.startswith('data:image'):
+        return referencia
+    derivados = _derivados_imagen.pop(referencia, None)
+    metrica_cache("imagenes_derivadas", derivados is not None)
+    if derivados is None:
+        doc = await db.imagenes.find_one({"url": referencia}, {"_id": 0, "derivados": 1})
+        derivados = (doc or {}).get("derivados") or {}
+        while len(_derivados_imagen) >= RECURSOS_MAX_TEMPLATES * 8:
+            _derivados_imagen.pop(next(iter(_derivados_imagen)))
+    _derivados_imagen[referencia] = derivados
+    return derivados.get(tipo, referencia)
+
+async def obtener_template_entrada(referencia: str, tamano: tuple = (600, 900)) -> Optional[Image.Image]:
+    """Template de entrada ya decodificado y redimensionado; devuelve una copia editable"""
+    clave = "entrada:" + hashlib.sha1(f"{referencia}|{tamano}".encode()).hexdigest()
+    img = _leer_template(clave)
+    metrica_cache("templates", img is not None)
+    if img is None:
+        # Las imágenes subidas ya tienen un derivado de 600x900: no hace falta redimensionar
+        fuente = await referencia_derivada(referencia, "entrada") if tamano == DERIVADOS_IMAGEN["entrada"][0] else referencia
+        datos = await descargar_bytes_imagen(fuente)
+        if not datos:
+            return None
+        img = Image.open(BytesIO(datos))
+        logging.info(f"Template cargado: {img.size[0]}x{img.size[1]}")
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != tamano:
+            img = img.resize(tamano, Image.Resampling.LANCZOS)
+        _guardar_template(clave, img)
+    return img.copy()
+
+def obtener_bytes_template_sync(referencia: str) -> Optional[bytes]:
+    """Versión síncrona para el dibujo de PDFs: bytes del template, cacheados"""
+    clave = "bytes:" + hashlib.sha1(referencia.encode()).hexdigest()
+    datos = _leer_template(clave)
+    metrica_cache("templates", datos is not None)
+    if datos is None:
+        archivo_media = ruta_media_local(referencia)
+        if referencia.startswith('data:image'):
+            datos = base64.b64decode(referencia.split(',')[1])
+        elif archivo_media is not None and archivo_media.exists():
+            datos = archivo_media.read_bytes()
+        elif referencia.startswith('http'):
+            import httpx
+            response = httpx.get(referencia, timeout=30.0)
+            if response.status_code != 200:
+                return None
+            datos = response.content
+        else:
+            file_path = _archivo_local_de_url(referencia)
+            if not file_path or not file_path.exists():
+                return None
+            datos = file_path.read_bytes()
+        _guardar_template(clave, datos)
+    return datos
+
+def crear_fondo_entrada() -> Image.Image:
+    """Fondo predeterminado de la entrada 600x900 con patrón decorativo"""
+    ancho, alto = 600, 900
+    img = Image.new('RGB', (ancho, alto), color='#1a1a2e')
+    draw = ImageDraw.Draw(img)
+    for i in range(0, alto, 50):
+        opacity = int(20 + (i / alto) * 30)
+        draw.line([(0, i), (ancho, i)], fill=(250, 204, 21, opacity), width=1)
+    return img
+
+def crear_base_termica() -> Image.Image:
+    """Partes fijas del ticket térmico (cabecera con logo y pie)"""
+    ancho, alto = 576, 450
+    img = Image.new('RGB', (ancho, alto), color='white')
+    draw = ImageDraw.Draw(img)
+    font_logo = obtener_fuente(FUENTE_BOLD, 32)
+    font_small = obtener_fuente(FUENTE_REGULAR, 12)
+
+    # Cabecera negra con el logo texto "CIUDAD FERIA"
+    draw.rectangle([(0, 0), (ancho, 60)], fill='black')
+    draw.text((ancho//2, 15), "🎪 CIUDAD FERIA", font=font_logo, fill='white', anchor='mt')
+    draw.text((ancho//2, 45), "FERIA DE SAN SEBASTIÁN 2026", font=font_small, fill='#FFD700', anchor='mt')
+
+    # Pie
+    draw.line([(20, 400), (ancho-20, 400)], fill='black', width=1)
+    draw.text((ancho//2, 415), "San Cristóbal, Táchira - Venezuela", font=font_small, fill='gray', anchor='mt')
+    draw.text((ancho//2, 435), "Entrada válida para un solo uso", font=font_small, fill='gray', anchor='mt')
+    return img
+
+# Tamaños usados por los renderers de entradas (se precargan al arrancar)
+FUENTES_PRECARGA = [
+    (FUENTE_BOLD, 16), (FUENTE_BOLD, 20), (FUENTE_BOLD, 24), (FUENTE_BOLD, 32), (FUENTE_BOLD, 40),
+    (FUENTE_REGULAR, 11), (FUENTE_REGULAR, 12), (FUENTE_REGULAR, 14), (FUENTE_REGULAR, 18),
+]
+
+def precargar_recursos_render():
+    """Carga fuentes y recursos estáticos antes de la primera petición"""
+    for ruta, tamano in FUENTES_PRECARGA:
+        obtener_fuente(ruta, tamano)
+    obtener_recurso_render("fondo_entrada", crear_fondo_entrada)
+    obtener_recurso_render("base_termica", crear_base_termica)
+    obtener_recurso_render("escpos_logo", crear_escpos_logo)
+
+def _bytes_recurso(recurso) -> int:
+    if isinstance(recurso, Image.Image):
+        return recurso.size[0] * recurso.size[1] * len(recurso.getbands())
+    if isinstance(recurso, (bytes, bytearray)):
+        return len(recurso)
+    return 0
+
+def huella_recursos_render() -> dict:
+    """Memoria aproximada ocupada por el registro (imágenes sin comprimir, archivos de fuente)"""
+    rutas_fuentes = {ruta for ruta, _ in _recursos_fuentes}
+    bytes_fuentes = sum(os.path.getsize(r) for r in rutas_fuentes if os.path.exists(r))
+    bytes_estaticos = sum(_bytes_recurso(r) for r in _recursos_estaticos.values())
+    bytes_templates = sum(_bytes_recurso(r) for r in _recursos_templates.values())
+    return {
+        "fuentes": {"cantidad": len(_recursos_fuentes), "archivos": len(rutas_fuentes), "bytes": bytes_fuentes},
+        "estaticos": {"claves": sorted(_recursos_estaticos), "bytes": bytes_estaticos},
+        "templates": {"cantidad": len(_recursos_templates), "maximo": RECURSOS_MAX_TEMPLATES, "bytes": bytes_templates},
+        "bytes_total": bytes_fuentes + bytes_estaticos + bytes_templates
+    }
+
+@api_router.get("/admin/recursos-render")
+async def obtener_recursos_render(current_user: str = Depends(get_current_user)):
+    """Estado y huella de memoria del registro de recursos de render"""
+    return huella_recursos_render()
+
+# ==================== GENERACIÓN DE ENTRADA COMO IMAGEN ====================
 
 def generar_firma_hmac(datos: str) -> str:
     """Genera una firma HMAC-SHA256 para verificar autenticidad del QR"""
@@ -1791,31 +3052,17 @@ def generar_qr_seguro_v2(entrada_id: str, evento_id: str, codigo_alfanumerico: s
     datos_encriptados = encryptor.update(datos_json.encode()) + encryptor.finalize()
     payload = base64.b64encode(iv + datos_encriptados).decode()
     
-    # Generar imagen QR con alta corrección de errores
-    qr = qrcode.QRCode(
-        version=2,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,  # Máxima corrección
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(payload)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-    
-    return f"data:image/png;base64,{qr_base64}", payload
+    # Generar imagen QR con alta corrección de errores (payload único: sin caché de matrices)
+    metrica_inc("ciudadferia_qr_renderizados_total", origen="data_uri_v2")
+    return codificar_qr_png(construir_matriz_qr(payload, version=2)), payload
 
-async def generar_imagen_entrada(entrada: dict, evento: dict) -> bytes:
+async def generar_imagen_entrada(entrada: dict, evento: dict, formato: str = "png") -> bytes:
     """
     Genera una imagen de entrada completa con:
     - Fondo personalizado (template) o predeterminado
     - QR posicionado según configuración
     - Información del evento y comprador
+    Codificada en `formato` (png, webp o jpeg).
     """
     # Dimensiones de la entrada - formato vertical 600x900px
     ancho = 600
@@ -1823,86 +3070,25 @@ async def generar_imagen_entrada(entrada: dict, evento: dict) -> bytes:
     
     # Crear imagen base
     img = None
-    usar_fondo_personalizado = False
     
     if evento.get('template_entrada'):
         try:
-            # Cargar template personalizado
-            template_url = evento['template_entrada']
-            logging.info(f"Cargando template: {template_url}")
-            
-            if template_url.startswith('data:image'):
-                # Es base64
-                img_data = base64.b64decode(template_url.split(',')[1])
-                img = Image.open(BytesIO(img_data))
-                usar_fondo_personalizado = True
-            elif template_url.startswith('http'):
-                # URL externa (Cloudinary u otro servicio)
-                try:
-                    import httpx
-                    async with httpx.AsyncClient(timeout=30.0) as http_client:
-                        response = await http_client.get(template_url)
-                        if response.status_code == 200:
-                            img = Image.open(BytesIO(response.content))
-                            usar_fondo_personalizado = True
-                            logging.info(f"Template cargado desde URL: {template_url}")
-                        else:
-                            logging.warning(f"Error descargando template: HTTP {response.status_code}")
-                except Exception as e:
-                    logging.error(f"Error descargando template: {e}")
-            elif '/api/uploads/' in template_url or '/uploads/' in template_url:
-                # Es archivo local (legacy)
-                if '/api/uploads/' in template_url:
-                    filename = template_url.split('/api/uploads/')[-1]
-                else:
-                    filename = template_url.split('/uploads/')[-1]
-                file_path = UPLOADS_DIR / filename
-                logging.info(f"Buscando archivo local: {file_path}")
-                if file_path.exists():
-                    img = Image.open(file_path)
-                    usar_fondo_personalizado = True
-                    logging.info(f"Template cargado correctamente: {file_path}")
-                else:
-                    logging.warning(f"Template no encontrado: {file_path}")
-            
-            # Si se cargó la imagen, redimensionar a 600x900 exacto
-            if img and usar_fondo_personalizado:
-                orig_w, orig_h = img.size
-                logging.info(f"Imagen original: {orig_w}x{orig_h}")
-                
-                # Redimensionar directamente a 600x900 (el usuario diseñó para este tamaño)
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                img = img.resize((ancho, alto), Image.Resampling.LANCZOS)
-                logging.info(f"Template redimensionado a: {img.size}")
-                    
+            # Template personalizado desde el registro (decodificado y a 600x900 una sola vez)
+            img = await obtener_template_entrada(evento['template_entrada'], (ancho, alto))
         except Exception as e:
             logging.error(f"Error cargando template: {e}")
             img = None
-            usar_fondo_personalizado = False
     
-    # Si no hay template personalizado, crear fondo predeterminado
+    # Si no hay template personalizado, usar el fondo predeterminado
     if img is None:
         logging.info("Usando fondo predeterminado (no hay template)")
-        img = Image.new('RGB', (ancho, alto), color='#1a1a2e')
-        draw = ImageDraw.Draw(img)
-        
-        # Agregar patrón decorativo
-        for i in range(0, alto, 50):
-            opacity = int(20 + (i / alto) * 30)
-            draw.line([(0, i), (ancho, i)], fill=(250, 204, 21, opacity), width=1)
+        img = obtener_recurso_render("fondo_entrada", crear_fondo_entrada).copy()
     
     draw = ImageDraw.Draw(img)
     
-    # Intentar cargar fuente o usar predeterminada - ajustado para 600x900
-    try:
-        font_grande = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 20)
-        font_medio = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 14)
-        font_pequeno = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 11)
-    except Exception:
-        font_grande = ImageFont.load_default()
-        font_medio = ImageFont.load_default()
-        font_pequeno = ImageFont.load_default()
+    font_grande = obtener_fuente(FUENTE_BOLD, 20)
+    font_medio = obtener_fuente(FUENTE_REGULAR, 14)
+    font_pequeno = obtener_fuente(FUENTE_REGULAR, 11)
     
     # Posición del QR - usar configuración del diseñador o valores por defecto
     posicion_qr = evento.get('posicion_qr', {'x': 50, 'y': 40, 'size': 200})
@@ -1987,51 +3173,11 @@ async def generar_imagen_entrada(entrada: dict, evento: dict) -> bytes:
     
     # ========== REGENERAR QR con payload COMPACTO para mejor escaneabilidad ==========
     try:
-        # Crear payload compacto con solo ID y hash parcial
-        entrada_id = entrada.get('id', '')
-        hash_validacion = entrada.get('hash_validacion', '')
-        
-        datos_compactos = {
-            "id": entrada_id,
-            "h": hash_validacion[:16],  # Solo primeros 16 chars
-            "t": "e"  # tipo: entrada
-        }
-        
-        import json as json_module
-        datos_json = json_module.dumps(datos_compactos, separators=(',', ':'))
-        
-        # Encriptar
-        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-        from cryptography.hazmat.backends import default_backend
-        iv = os.urandom(16)
-        cipher = Cipher(
-            algorithms.AES(ENCRYPTION_KEY[:32]),
-            modes.CFB(iv),
-            backend=default_backend()
-        )
-        encryptor = cipher.encryptor()
-        datos_encriptados = encryptor.update(datos_json.encode()) + encryptor.finalize()
-        payload_compacto = base64.b64encode(iv + datos_encriptados).decode()
-        
-        # Generar QR con módulos GRANDES
-        qr = qrcode.QRCode(
-            version=None,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=10,  # Módulos grandes
-            border=4,
-        )
-        qr.add_data(payload_compacto)
-        qr.make(fit=True)
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        
-        original_size = qr_img.size[0]
-        logging.info(f"QR COMPACTO regenerado: versión={qr.version}, módulos={qr.modules_count}, size={original_size}px")
-        
-        # Ajustar tamaño al configurado por el diseñador
-        target_qr_size = qr_size_config  # Usar el tamaño exacto del diseñador
-        
-        if original_size != target_qr_size:
-            qr_img = qr_img.resize((target_qr_size, target_qr_size), Image.Resampling.NEAREST)  # NEAREST mantiene nitidez
+        # Payload compacto determinista (id + hash parcial + qr_nonce): la matriz
+        # sale del caché y se rasteriza directamente al tamaño del diseñador
+        payload_compacto = payload_qr_entrada(entrada)
+        qr_img = rasterizar_qr(matriz_qr(payload_compacto), qr_size_config, modo='RGB')
+        metrica_inc("ciudadferia_qr_renderizados_total", origen="imagen_entrada")
         
         actual_qr_size = qr_img.size[0]
         
@@ -2070,18 +3216,26 @@ async def generar_imagen_entrada(entrada: dict, evento: dict) -> bytes:
         import traceback
         traceback.print_exc()
     
-    # Convertir a bytes
-    buffer = BytesIO()
-    img.save(buffer, format='PNG', quality=95)
-    buffer.seek(0)
-    
-    return buffer.getvalue()
+    # Convertir a bytes (con template fotográfico: mejor WebP/JPEG que PNG), fuera del event loop
+    uso = "entrada_template" if evento.get('template_entrada') else "entrada"
+    return await asyncio.to_thread(codificar_imagen, img, formato, uso)
+
+def preferencia_formatos_entrada(evento: dict) -> tuple:
+    """(formatos en orden de preferencia, formato por defecto) para la imagen de entrada"""
+    if evento.get('template_entrada'):
+        # Template fotográfico: WebP/JPEG pesan una fracción del PNG
+        return ("webp", "jpeg", "png"), "jpeg"
+    # Fondo predeterminado de colores planos: el PNG es el más pequeño
+    return ("png", "webp", "jpeg"), "png"
 
 @api_router.get("/entrada/{entrada_id}/imagen")
-async def obtener_imagen_entrada(entrada_id: str):
-    """Genera y retorna la imagen de una entrada"""
+async def obtener_imagen_entrada(entrada_id: str, request: Request, formato: Optional[str] = None):
+    """Genera y retorna la imagen de una entrada (formato por `?formato=` o por el header Accept)"""
     from fastapi.responses import Response
     
+    if formato is not None and formato not in FORMATOS_IMAGEN:
+        raise HTTPException(status_code=400, detail="Formato no soportado (png, webp o jpeg)")
+    
     entrada = await db.entradas.find_one({"id": entrada_id}, {"_id": 0})
     if not entrada:
         raise HTTPException(status_code=404, detail="Entrada no encontrada")
@@ -2089,33 +3243,46 @@ async def obtener_imagen_entrada(entrada_id: str):
     if entrada.get('estado_pago') != 'aprobado':
         raise HTTPException(status_code=403, detail="Entrada no aprobada aún")
     
-    evento = await db.eventos.find_one({"id": entrada['evento_id']}, {"_id": 0})
+    evento = await obtener_evento_cache(entrada['evento_id'])
     if not evento:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
     
-    imagen_bytes = await generar_imagen_entrada(entrada, evento)
+    if formato is None:
+        formato = negociar_formato_imagen(request.headers.get("accept"), *preferencia_formatos_entrada(evento))
+    _, media_type, extension = FORMATOS_IMAGEN[formato]
+    imagen_bytes = await generar_imagen_entrada(entrada, evento, formato)
     
     return Response(
         content=imagen_bytes,
-        media_type="image/png",
+        media_type=media_type,
         headers={
-            "Content-Disposition": f"attachment; filename=entrada-{entrada_id[:8]}.png"
+            "Content-Disposition": f"attachment; filename=entrada-{entrada_id[:8]}.{extension}",
+            "Vary": "Accept"
         }
     )
 
 # ==================== ENVÍO DE EMAIL ====================
 
+EMAIL_FORMATO_ENTRADA = os.environ.get('EMAIL_FORMATO_ENTRADA', 'auto')  # auto, png, webp o jpeg
+if EMAIL_FORMATO_ENTRADA != 'auto' and EMAIL_FORMATO_ENTRADA not in FORMATOS_IMAGEN:
+    EMAIL_FORMATO_ENTRADA = 'auto'
+
 async def enviar_email_entrada(email_destino: str, entrada: dict, evento: dict) -> bool:
     """
     Envía la entrada por email con la imagen adjunta
     """
     if not GMAIL_USER or not GMAIL_APP_PASSWORD:
         logging.warning("Credenciales de Gmail no configuradas")
+        metrica_inc("ciudadferia_emails_total", resultado="sin_configurar")
         return False
     
     try:
-        # Generar imagen de entrada
-        imagen_bytes = await generar_imagen_entrada(entrada, evento)
+        # Generar imagen de entrada (en "auto": JPEG con template, PNG sin él; ambos los abre cualquier cliente)
+        formato = EMAIL_FORMATO_ENTRADA
+        if formato == 'auto':
+            formato = preferencia_formatos_entrada(evento)[1]
+        imagen_bytes = await generar_imagen_entrada(entrada, evento, formato)
+        _, media_type, extension = FORMATOS_IMAGEN[formato]
         
         # Crear mensaje
         msg = MIMEMultipart('mixed')
@@ -2171,12 +3338,12 @@ async def enviar_email_entrada(email_destino: str, entrada: dict, evento: dict)
         msg.attach(MIMEText(html_body, 'html'))
         
         # Adjuntar imagen de entrada
-        attachment = MIMEBase('image', 'png')
+        attachment = MIMEBase(*media_type.split('/'))
         attachment.set_payload(imagen_bytes)
         encoders.encode_base64(attachment)
         attachment.add_header(
             'Content-Disposition',
-            f'attachment; filename="entrada-{codigo}.png"'
+            f'attachment; filename="entrada-{codigo}.{extension}"'
         )
         msg.attach(attachment)
         
@@ -2189,40 +3356,36 @@ async def enviar_email_entrada(email_destino: str, entrada: dict, evento: dict)
         await asyncio.to_thread(send_sync)
         
         logging.info(f"Email enviado exitosamente a {email_destino}")
+        metrica_inc("ciudadferia_emails_total", resultado="enviado")
         return True
         
     except Exception as e:
         logging.error(f"Error enviando email: {e}")
+        metrica_inc("ciudadferia_emails_total", resultado="fallido")
         return False
 
-@api_router.post("/admin/aprobar-y-enviar")
-async def aprobar_y_enviar_entrada(
-    datos: AprobarCompra, 
-    background_tasks: BackgroundTasks,
-    current_user: str = Depends(get_current_user)
-):
-    """
-    Aprueba las compras y envía las entradas por email automáticamente
-    """
+async def aprobar_y_enviar(entrada_ids: List[str], ctx=None) -> dict:
+    """Aprueba las entradas y envía cada una por email; con ctx (trabajo) reporta progreso"""
     # Aprobar entradas
     result = await db.entradas.update_many(
-        {"id": {"$in": datos.entrada_ids}},
+        {"id": {"$in": entrada_ids}},
         {"$set": {"estado_pago": "aprobado"}}
     )
     
-    # Obtener entradas aprobadas para enviar emails
-    entradas = await db.entradas.find(
-        {"id": {"$in": datos.entrada_ids}},
-        {"_id": 0}
-    ).to_list(100)
-    
     emails_enviados = 0
     emails_fallidos = 0
-    
-    for entrada in entradas:
-        evento = await db.eventos.find_one({"id": entrada['evento_id']}, {"_id": 0})
+    procesadas = 0
+    
+    # Obtener entradas aprobadas para enviar emails, en orden de id para poder reanudar
+    filtro = {"id": {"$in": entrada_ids}}
+    if ctx is not None and ctx.punto_control:
+        filtro["id"]["$gt"] = ctx.punto_control["ultimo_id"]
+        procesadas = ctx.punto_control["procesadas"]
+        emails_enviados = ctx.punto_control["emails_enviados"]
+        emails_fallidos = ctx.punto_control["emails_fallidos"]
+    async for entrada in db.entradas.find(filtro, {"_id": 0}).sort("id", 1):
+        evento = await obtener_evento_cache(entrada['evento_id'])
         if evento and entrada.get('email_comprador'):
-            # Enviar en background para no bloquear
             email_enviado = await enviar_email_entrada(
                 entrada['email_comprador'],
                 entrada,
@@ -2237,6 +3400,15 @@ async def aprobar_y_enviar_entrada(
                 )
             else:
                 emails_fallidos += 1
+        procesadas += 1
+        if ctx is not None:
+            await ctx.progreso(
+                procesadas, len(entrada_ids), f"{emails_enviados} email(s) enviado(s)",
+                punto_control={
+                    "ultimo_id": entrada['id'], "procesadas": procesadas,
+                    "emails_enviados": emails_enviados, "emails_fallidos": emails_fallidos
+                }
+            )
     
     return {
         "message": f"{result.modified_count} entrada(s) aprobada(s)",
@@ -2246,6 +3418,21 @@ async def aprobar_y_enviar_entrada(
         "email_configurado": bool(GMAIL_USER and GMAIL_APP_PASSWORD)
     }
 
+@api_router.post("/admin/aprobar-y-enviar")
+async def aprobar_y_enviar_entrada(
+    datos: AprobarCompra, 
+    en_segundo_plano: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Aprueba las compras y envía las entradas por email automáticamente.
+    Con en_segundo_plano=true se encola como trabajo y responde 202 con su id.
+    """
+    if en_segundo_plano:
+        job = await encolar_job("aprobar_y_enviar", {"entrada_ids": datos.entrada_ids}, current_user)
+        return respuesta_job_encolado(job)
+    return await aprobar_y_enviar(datos.entrada_ids)
+
 @api_router.post("/admin/reenviar-entrada/{entrada_id}")
 async def reenviar_entrada_email(entrada_id: str, current_user: str = Depends(get_current_user)):
     """
@@ -2258,7 +3445,7 @@ async def reenviar_entrada_email(entrada_id: str, current_user: str = Depends(ge
     if entrada.get('estado_pago') != 'aprobado':
         raise HTTPException(status_code=400, detail="La entrada debe estar aprobada primero")
     
-    evento = await db.eventos.find_one({"id": entrada['evento_id']}, {"_id": 0})
+    evento = await obtener_evento_cache(entrada['evento_id'])
     if not evento:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
     
@@ -2384,6 +3571,9 @@ async def eliminar_acreditacion(acreditacion_id: str, current_user: str = Depend
 
 @api_router.post("/validar-acreditacion")
 async def validar_acreditacion(request: Request):
+    return await contar_escaneo("acreditacion", _validar_acreditacion(request))
+
+async def _validar_acreditacion(request: Request):
     """Valida una acreditación por QR o código"""
     body = await request.json()
     qr_payload = body.get('qr_payload')
@@ -2451,6 +3641,7 @@ async def validar_acreditacion(request: Request):
             {"id": acreditacion['id']},
             {"$set": {"estado_entrada": "dentro", "historial_acceso": historial}}
         )
+        await registrar_flujo(acreditacion.get('evento_id'), "entrada", acreditacion['categoria_nombre'])
         
         return {
             "valido": True,
@@ -2481,6 +3672,7 @@ async def validar_acreditacion(request: Request):
             {"id": acreditacion['id']},
             {"$set": {"estado_entrada": "fuera", "historial_acceso": historial}}
         )
+        await registrar_flujo(acreditacion.get('evento_id'), "salida", acreditacion['categoria_nombre'])
         
         return {
             "valido": True,
@@ -2499,7 +3691,7 @@ async def obtener_aforo_evento(evento_id: str, current_user: str = Depends(get_c
     """Obtiene el aforo en tiempo real de un evento"""
     
     # Obtener evento
-    evento = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
+    evento = await obtener_evento_cache(evento_id)
     if not evento:
         raise HTTPException(status_code=404, detail="Evento no encontrado")
     
@@ -2555,20 +3747,138 @@ async def obtener_aforo_evento(evento_id: str, current_user: str = Depends(get_c
     
     return aforo
 
+# ==================== FLUJO DE ACCESOS (SERIE TEMPORAL PRE-AGREGADA) ====================
+# Cada entrada/salida registrada suma 1 con $inc en el documento del minuto de su
+# evento (flujo_eventos: evento_id + minuto, contadores por categoría). La curva de
+# flujo a cualquier resolución se obtiene agrupando esos minutos, sin recorrer los
+# historial_acceso de las entradas.
+
+FLUJO_MAX_MINUTOS = 7 * 24 * 60  # una semana de minutos por consulta
+
+def _clave_categoria_flujo(categoria: Optional[str]) -> str:
+    """Nombre de campo seguro para Mongo (sin puntos ni $ inicial)"""
+    clave = (categoria or "General").strip().replace(".", "_") or "General"
+    return clave.lstrip("$") or "General"
+
+async def registrar_flujo(evento_id: Optional[str], tipo: str, categoria: Optional[str] = None):
+    """Suma una entrada o salida al contador del minuto actual del evento"""
+    if not evento_id:
+        return
+    ahora = datetime.now(timezone.utc)
+    minuto = ahora.replace(second=0, microsecond=0)
+    clave = _clave_categoria_flujo(categoria)
+    campo_total = "total_entradas" if tipo == "entrada" else "total_salidas"
+    actualizacion = {"$inc": {campo_total: 1, f"{tipo}s.{clave}": 1}}
+    try:
+        await db.flujo_eventos.update_one({"evento_id": evento_id, "minuto": minuto}, actualizacion, upsert=True)
+    except DuplicateKeyError:
+        # Dos escaneos crearon el mismo minuto a la vez: el otro ya insertó, reintentar como update
+        await db.flujo_eventos.update_one({"evento_id": evento_id, "minuto": minuto}, actualizacion)
+    except Exception as e:
+        # El contador es auxiliar: nunca debe impedir registrar el acceso
+        logging.error(f"Error registrando flujo de {evento_id}: {e}")
+
+@api_router.get("/admin/eventos/{evento_id}/flujo")
+async def obtener_flujo_evento(
+    evento_id: str,
+    resolucion: int = 5,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """Curva de entradas/salidas del evento agrupada cada `resolucion` minutos"""
+    if not 1 <= resolucion <= 1440:
+        raise HTTPException(status_code=400, detail="La resolución debe estar entre 1 y 1440 minutos")
+    evento = await obtener_evento_cache(evento_id)
+    if not evento:
+        raise HTTPException(status_code=404, detail="Evento no encontrado")
+
+    # Los minutos se guardan como fechas BSON (UTC, se leen sin zona): el rango va a la consulta
+    rango = {operador: fecha.replace(tzinfo=None) for operador, fecha in rango_fechas_utc(desde, hasta).items()}
+    filtro = {"evento_id": evento_id}
+    if rango:
+        filtro["minuto"] = rango
+    minutos = await db.flujo_eventos.find(
+        filtro, {"_id": 0, "evento_id": 0}
+    ).sort("minuto", 1).to_list(FLUJO_MAX_MINUTOS + 1)
+    if len(minutos) > FLUJO_MAX_MINUTOS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"La ventana tiene más de {FLUJO_MAX_MINUTOS} minutos con actividad; acótela con desde/hasta"
+        )
+
+    # Ocupación antes de `desde` (punto de partida de la serie) y total actual, en una sola agregación
+    previo = {"$lt": ["$minuto", rango["$gte"]]} if "$gte" in rango else False
+    neto = {"$subtract": [{"$ifNull": ["$total_entradas", 0]}, {"$ifNull": ["$total_salidas", 0]}]}
+    acumulados = await db.flujo_eventos.aggregate([
+        {"$match": {"evento_id": evento_id}},
+        {"$group": {
+            "_id": None,
+            "antes": {"$sum": {"$cond": [previo, neto, 0]}},
+            "total": {"$sum": neto}
+        }}
+    ]).to_list(1)
+    dentro = acumulados[0]["antes"] if acumulados else 0
+    dentro_ahora = acumulados[0]["total"] if acumulados else 0
+
+    # Rollup: los minutos ya vienen ordenados, se agrupan en ventanas de `resolucion`
+    serie = []
+    paso = resolucion * 60
+    for doc in minutos:
+        minuto = doc["minuto"] if doc["minuto"].tzinfo else doc["minuto"].replace(tzinfo=timezone.utc)
+        dentro += doc.get("total_entradas", 0) - doc.get("total_salidas", 0)
+        inicio = datetime.fromtimestamp(int(minuto.timestamp()) // paso * paso, timezone.utc)
+        if not serie or serie[-1]["inicio"] != inicio:
+            serie.append({"inicio": inicio, "entradas": 0, "salidas": 0, "dentro": 0, "por_categoria": {}})
+        punto = serie[-1]
+        punto["entradas"] += doc.get("total_entradas", 0)
+        punto["salidas"] += doc.get("total_salidas", 0)
+        punto["dentro"] = dentro
+        for tipo in ("entradas", "salidas"):
+            for categoria, cantidad in (doc.get(tipo) or {}).items():
+                conteo = punto["por_categoria"].setdefault(categoria, {"entradas": 0, "salidas": 0})
+                conteo[tipo] += cantidad
+
+    for punto in serie:
+        punto["inicio"] = punto["inicio"].isoformat()
+    pico = max(serie, key=lambda p: p["dentro"]) if serie else None
+    return {
+        "evento_id": evento_id,
+        "evento": evento.get("nombre"),
+        "resolucion_min": resolucion,
+        "total_entradas": sum(p["entradas"] for p in serie),
+        "total_salidas": sum(p["salidas"] for p in serie),
+        "dentro_ahora": dentro_ahora,
+        "pico": {"inicio": pico["inicio"], "dentro": pico["dentro"]} if pico else None,
+        "serie": serie
+    }
+
 # ==================== GENERADOR DE ENTRADAS PARA IMPRESORA TÉRMICA ====================
 
+def numero_body(body: dict, campo: str, defecto, tipo=int):
+    """Campo numérico del cuerpo JSON; 400 (no 500) si falta el valor o no es un número"""
+    valor = body.get(campo, defecto)
+    if isinstance(valor, bool):
+        valor = None
+    try:
+        return tipo(valor)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"El campo {campo} debe ser numérico")
+
 @api_router.post("/admin/generar-entradas-termicas")
 async def generar_entradas_termicas(request: Request, current_user: str = Depends(get_current_user)):
     """Genera entradas genéricas Ciudad Feria para impresora térmica 80mm"""
     body = await request.json()
     categoria = body.get('categoria', 'General')
-    cantidad = body.get('cantidad', 1)
-    precio = body.get('precio', 0)
-    numero_inicio = body.get('numero_inicio', 1)  # Numeración inicial
+    cantidad = numero_body(body, 'cantidad', 1)
+    precio = numero_body(body, 'precio', 0, float)
+    numero_inicio = numero_body(body, 'numero_inicio', 1)  # Numeración inicial
     
     # Validar cantidad máxima
+    if cantidad < 1:
+        raise HTTPException(status_code=400, detail="La cantidad debe ser al menos 1")
     if cantidad > 100:
-        raise HTTPException(status_code=400, detail="Máximo 100 tickets por lote")
+        raise HTTPException(status_code=400, detail="Máximo 100 tickets por lote (use /admin/generar-entradas-termicas/lote para lotes masivos)")
     
     entradas_generadas = []
     
@@ -2620,6 +3930,13 @@ async def generar_entradas_termicas(request: Request, current_user: str = Depend
         await db.entradas.insert_one(entrada_data)
         entradas_generadas.append(entrada_respuesta)
     
+    # Mantener el contador al día para que los lotes masivos no se solapen
+    await db.contadores.update_one(
+        {"id": CONTADOR_TERMICAS},
+        {"$max": {"valor": numero_inicio + cantidad - 1}},
+        upsert=True
+    )
+    
     return {
         "success": True,
         "cantidad": len(entradas_generadas),
@@ -2628,6 +3945,159 @@ async def generar_entradas_termicas(request: Request, current_user: str = Depend
         "entradas": entradas_generadas
     }
 
+# ---------- Modo lote masivo (miles de tickets) ----------
+
+CONTADOR_TERMICAS = "entradas_termicas"
+LOTE_TERMICO_MAX = 50000
+LOTE_TERMICO_CHUNK = 500  # documentos por insert_many
+
+async def reservar_rango_termico(cantidad: int) -> tuple:
+    """Reserva atómicamente un rango de numeración [inicio, fin] para tickets térmicos"""
+    # Inicializar el contador con el mayor número ya emitido ($max es idempotente)
+    ultima = await db.entradas.find_one(
+        {"tipo_venta": "taquilla", "numero_ticket": {"$exists": True}},
+        {"_id": 0, "numero_ticket": 1},
+        sort=[("numero_ticket", -1)]
+    )
+    await db.contadores.update_one(
+        {"id": CONTADOR_TERMICAS},
+        {"$max": {"valor": ultima.get('numero_ticket', 0) if ultima else 0}},
+        upsert=True
+    )
+    contador = await db.contadores.find_one_and_update(
+        {"id": CONTADOR_TERMICAS},
+        {"$inc": {"valor": cantidad}},
+        return_document=ReturnDocument.AFTER
+    )
+    numero_fin = contador["valor"]
+    return numero_fin - cantidad + 1, numero_fin
+
+def construir_entradas_termicas(categoria: str, precio: float, numero_inicio: int, cantidad: int, lote_id: str) -> list:
+    """Genera en una sola pasada los documentos de un lote (sin renderizar QR: se hace bajo demanda)"""
+    fecha_compra = datetime.now(timezone.utc).isoformat()
+    prefijo = f"CF-{categoria[:3].upper()}"
+    documentos = []
+    for numero_ticket in range(numero_inicio, numero_inicio + cantidad):
+        entrada_id = str(uuid.uuid4())
+        codigo_alfanumerico = f"{prefijo}-{numero_ticket:04d}-{uuid.uuid4().hex[:6].upper()}"
+        datos_qr = {
+            "tipo": "entrada_taquilla",
+            "entrada_id": entrada_id,
+            "codigo": codigo_alfanumerico,
+            "numero": numero_ticket,
+            "categoria": categoria
+        }
+        documentos.append({
+            "id": entrada_id,
+            "evento_id": "ciudad-feria-general",
+            "nombre_evento": "CIUDAD FERIA 2026",
+            "nombre_comprador": "Venta Taquilla",
+            "email_comprador": "",
+            "telefono_comprador": "",
+            "cantidad": 1,
+            "precio_unitario": precio,
+            "precio_total": precio,
+            "categoria_entrada": categoria,
+            "codigo_alfanumerico": codigo_alfanumerico,
+            "numero_ticket": numero_ticket,
+            "metodo_pago": "Efectivo Taquilla",
+            "estado_pago": "aprobado",
+            "fecha_compra": fecha_compra,
+            "estado_entrada": "fuera",
+            "historial_acceso": [],
+            "tipo_venta": "taquilla",
+            "lote_id": lote_id,
+            "qr_payload": construir_payload_qr(datos_qr),
+            "hash_validacion": generar_hash(datos_qr)
+        })
+    return documentos
+
+async def procesar_lote_termico(ctx) -> dict:
+    """Trabajo 'lote_termico': inserta el lote por bloques con insert_many y va reportando el progreso.
+    Al reanudar continúa a partir de los tickets ya generados."""
+    lote_id = ctx.parametros["lote_id"]
+    lote = await db.lotes_termicos.find_one({"id": lote_id}, {"_id": 0})
+    if not lote:
+        raise HTTPException(status_code=404, detail="Lote no encontrado")
+    try:
+        # Al reanudar se parte de lo que realmente está en db.entradas: `generadas` se
+        # incrementa en otra escritura y puede ir un bloque por detrás si el proceso cayó
+        ultima = await db.entradas.find_one(
+            {"lote_id": lote_id}, {"_id": 0, "numero_ticket": 1}, sort=[("numero_ticket", -1)]
+        )
+        generadas = ultima["numero_ticket"] - lote["numero_inicio"] + 1 if ultima else 0
+        await db.lotes_termicos.update_one(
+            {"id": lote_id}, {"$set": {"estado": "procesando", "generadas": generadas}}
+        )
+        documentos = construir_entradas_termicas(
+            lote["categoria"], lote["precio"], lote["numero_inicio"] + generadas, lote["total"] - generadas, lote_id
+        )
+        for i in range(0, len(documentos), LOTE_TERMICO_CHUNK):
+            bloque = documentos[i:i + LOTE_TERMICO_CHUNK]
+            await db.entradas.insert_many(bloque, ordered=False)
+            await db.lotes_termicos.update_one(
+                {"id": lote_id},
+                {"$inc": {"generadas": len(bloque)}}
+            )
+            await ctx.progreso(generadas + i + len(bloque), lote["total"])
+        await db.lotes_termicos.update_one(
+            {"id": lote_id},
+            {"$set": {"estado": "completado", "fecha_fin": datetime.now(timezone.utc).isoformat()}}
+        )
+        logging.info(f"Lote térmico {lote_id} completado: {lote['total']} tickets")
+        return {"lote_id": lote_id, "generadas": lote["total"]}
+    except JobCancelado:
+        await db.lotes_termicos.update_one({"id": lote_id}, {"$set": {"estado": "cancelado"}})
+        raise
+    except Exception as e:
+        logging.error(f"Error procesando lote térmico {lote_id}: {e}")
+        await db.lotes_termicos.update_one(
+            {"id": lote_id},
+            {"$set": {"estado": "error", "error": str(e), "fecha_fin": datetime.now(timezone.utc).isoformat()}}
+        )
+        raise
+
+@api_router.post("/admin/generar-entradas-termicas/lote")
+async def generar_lote_entradas_termicas(request: Request, current_user: str = Depends(get_current_user)):
+    """Genera un lote masivo de tickets térmicos en segundo plano (hasta 50.000)"""
+    body = await request.json()
+    categoria = body.get('categoria', 'General')
+    cantidad = numero_body(body, 'cantidad', 1)
+    precio = numero_body(body, 'precio', 0, float)
+    
+    if cantidad < 1 or cantidad > LOTE_TERMICO_MAX:
+        raise HTTPException(status_code=400, detail=f"La cantidad debe estar entre 1 y {LOTE_TERMICO_MAX}")
+    
+    numero_inicio, numero_fin = await reservar_rango_termico(cantidad)
+    
+    lote = {
+        "id": str(uuid.uuid4()),
+        "categoria": categoria,
+        "precio": precio,
+        "total": cantidad,
+        "generadas": 0,
+        "numero_inicio": numero_inicio,
+        "numero_fin": numero_fin,
+        "estado": "procesando",
+        "creado_por": current_user,
+        "fecha_creacion": datetime.now(timezone.utc).isoformat()
+    }
+    await db.lotes_termicos.insert_one(dict(lote))
+    
+    job = await encolar_job("lote_termico", {"lote_id": lote["id"]}, current_user)
+    await db.lotes_termicos.update_one({"id": lote["id"]}, {"$set": {"job_id": job["id"]}})
+    
+    return {"success": True, **lote, "job_id": job["id"]}
+
+@api_router.get("/admin/lotes-termicos/{lote_id}")
+async def obtener_lote_termico(lote_id: str, current_user: str = Depends(get_current_user)):
+    """Progreso de un lote masivo de tickets térmicos"""
+    lote = await db.lotes_termicos.find_one({"id": lote_id}, {"_id": 0})
+    if not lote:
+        raise HTTPException(status_code=404, detail="Lote no encontrado")
+    lote["progreso"] = round(lote["generadas"] / lote["total"] * 100, 1) if lote["total"] else 100.0
+    return lote
+
 @api_router.get("/admin/entrada-termica/{entrada_id}")
 async def obtener_entrada_termica(entrada_id: str, current_user: str = Depends(get_current_user)):
     """Genera imagen de entrada para impresora térmica 80mm (576px ancho) con logo y numeración"""
@@ -2635,36 +4105,22 @@ async def obtener_entrada_termica(entrada_id: str, current_user: str = Depends(g
     if not entrada:
         raise HTTPException(status_code=404, detail="Entrada no encontrada")
     
+    from fastapi.responses import Response
+    return Response(content=renderizar_entrada_termica(entrada), media_type="image/png")
+
+def renderizar_entrada_termica(entrada: dict) -> bytes:
+    """Renderiza el ticket térmico como PNG (función pura: apta para el pool de procesos)"""
     # Dimensiones para impresora térmica 80mm (aprox 576px a 203dpi)
     ancho = 576
-    alto = 450  # Un poco más alto para el logo
     
-    # Crear imagen
-    img = Image.new('RGB', (ancho, alto), color='white')
+    # Partir de la base cacheada (cabecera con logo y pie ya dibujados)
+    img = obtener_recurso_render("base_termica", crear_base_termica).copy()
     draw = ImageDraw.Draw(img)
     
-    try:
-        font_logo = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 32)
-        font_titulo = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 24)
-        font_normal = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 18)
-        font_codigo = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 16)
-        font_numero = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
-        font_small = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 12)
-    except:
-        font_logo = ImageFont.load_default()
-        font_titulo = ImageFont.load_default()
-        font_normal = ImageFont.load_default()
-        font_codigo = ImageFont.load_default()
-        font_numero = ImageFont.load_default()
-        font_small = ImageFont.load_default()
-    
-    # === HEADER CON LOGO ===
-    # Rectángulo negro para el header
-    draw.rectangle([(0, 0), (ancho, 60)], fill='black')
-    
-    # Logo texto "CIUDAD FERIA"
-    draw.text((ancho//2, 15), "🎪 CIUDAD FERIA", font=font_logo, fill='white', anchor='mt')
-    draw.text((ancho//2, 45), "FERIA DE SAN SEBASTIÁN 2026", font=font_small, fill='#FFD700', anchor='mt')
+    font_titulo = obtener_fuente(FUENTE_BOLD, 24)
+    font_normal = obtener_fuente(FUENTE_REGULAR, 18)
+    font_codigo = obtener_fuente(FUENTE_BOLD, 16)
+    font_numero = obtener_fuente(FUENTE_BOLD, 40)
     
     # === NÚMERO DE TICKET (grande y visible) ===
     numero_ticket = entrada.get('numero_ticket', 0)
@@ -2678,17 +4134,22 @@ async def obtener_entrada_termica(entrada_id: str, current_user: str = Depends(g
     draw.text((110, 90), categoria.upper(), font=font_normal, fill='white', anchor='mm')
     
     # === QR CODE (centrado) ===
-    if entrada.get('codigo_qr'):
-        try:
+    # Con payload se rasteriza la matriz cacheada a 180px exactos; el PNG guardado
+    # solo se decodifica para entradas antiguas sin payload
+    qr_size = 180
+    qr_x = (ancho - qr_size) // 2
+    qr_y = 120
+    try:
+        if entrada.get('qr_payload'):
+            img.paste(rasterizar_qr(matriz_qr(entrada['qr_payload']), qr_size), (qr_x, qr_y))
+            metrica_inc("ciudadferia_qr_renderizados_total", origen="termica")
+        elif entrada.get('codigo_qr'):
             qr_data = entrada['codigo_qr'].split(',')[1]
             qr_img = Image.open(BytesIO(base64.b64decode(qr_data)))
-            qr_size = 180
             qr_img = qr_img.resize((qr_size, qr_size), Image.Resampling.LANCZOS)
-            qr_x = (ancho - qr_size) // 2
-            qr_y = 120
             img.paste(qr_img, (qr_x, qr_y))
-        except Exception as e:
-            logging.error(f"Error procesando QR: {e}")
+    except Exception as e:
+        logging.error(f"Error procesando QR: {e}")
     
     # === CÓDIGO ALFANUMÉRICO ===
     codigo = entrada.get('codigo_alfanumerico', '')
@@ -2700,18 +4161,268 @@ async def obtener_entrada_termica(entrada_id: str, current_user: str = Depends(g
     draw.rectangle([(ancho//2 - 80, 340), (ancho//2 + 80, 380)], fill='#FFD700', outline='black', width=2)
     draw.text((ancho//2, 360), f"${precio:.2f}", font=font_titulo, fill='black', anchor='mm')
     
-    # === FOOTER ===
-    draw.line([(20, 400), (ancho-20, 400)], fill='black', width=1)
-    draw.text((ancho//2, 415), "San Cristóbal, Táchira - Venezuela", font=font_small, fill='gray', anchor='mt')
-    draw.text((ancho//2, 435), "Entrada válida para un solo uso", font=font_small, fill='gray', anchor='mt')
-    
     # Convertir a bytes
     buffer = BytesIO()
     img.save(buffer, format='PNG')
-    buffer.seek(0)
-    
-    from fastapi.responses import Response
-    return Response(content=buffer.getvalue(), media_type="image/png")
+    return buffer.getvalue()
+
+# ---------- Salida ESC/POS nativa (impresora térmica 80mm) ----------
+# En vez de una imagen por ticket se envía el flujo de bytes listo para la
+# impresora: logo rasterizado una sola vez, texto con las fuentes internas y
+# QR con el comando nativo GS ( k. Un lote completo viaja en una sola respuesta.
+
+ESCPOS_ANCHO_PX = 576  # 72 mm imprimibles a 203 dpi
+ESCPOS_MAX_TICKETS = 5000  # por rango de numeración; un lote se imprime completo
+ESCPOS_INIT = b'\x1b@' + b'\x1bt\x10'  # reset + página de códigos WPC1252 (acentos)
+
+def _escpos_texto(texto: str) -> bytes:
+    return texto.encode('cp1252', errors='replace') + b'\n'
+
+def crear_escpos_logo() -> bytes:
+    """Logo de cabecera en 1 bit (dithering Floyd-Steinberg) como comando GS v 0"""
+    font_logo = obtener_fuente(FUENTE_BOLD, 32)
+    font_small = obtener_fuente(FUENTE_REGULAR, 12)
+
+    img = Image.new('L', (ESCPOS_ANCHO_PX, 60), color=0)
+    draw = ImageDraw.Draw(img)
+    draw.text((ESCPOS_ANCHO_PX // 2, 15), "CIUDAD FERIA", font=font_logo, fill=255, anchor='mt')
+    draw.text((ESCPOS_ANCHO_PX // 2, 45), "FERIA DE SAN SEBASTIÁN 2026", font=font_small, fill=200, anchor='mt')
+
+    # En modo '1' de PIL el bit 1 es blanco; en ESC/POS el bit 1 imprime (negro)
+    bits = img.convert('1').tobytes()
+    datos = bytes(b ^ 0xFF for b in bits)
+    ancho_bytes = ESCPOS_ANCHO_PX // 8
+    alto = img.size[1]
+    return (
+        b'\x1dv0\x00'
+        + bytes([ancho_bytes & 0xFF, ancho_bytes >> 8, alto & 0xFF, alto >> 8])
+        + datos
+    )
+
+def escpos_qr(payload: str, tamano_modulo: int = 6) -> bytes:
+    """QR nativo (modelo 2, corrección H) mediante GS ( k"""
+    datos = payload.encode()
+    largo = len(datos) + 3
+    return (
+        b'\x1d(k\x04\x00\x31\x41\x32\x00'                          # modelo 2
+        + b'\x1d(k\x03\x00\x31\x43' + bytes([tamano_modulo])       # tamaño de módulo
+        + b'\x1d(k\x03\x00\x31\x45\x33'                            # corrección H
+        + b'\x1d(k' + bytes([largo & 0xFF, largo >> 8]) + b'\x31\x50\x30' + datos  # almacenar
+        + b'\x1d(k\x03\x00\x31\x51\x30'                            # imprimir
+    )
+
+def construir_ticket_escpos(entrada: dict) -> bytes:
+    """Un ticket térmico completo en ESC/POS, terminado con corte de papel"""
+    numero_ticket = entrada.get('numero_ticket', 0)
+    categoria = entrada.get('categoria_entrada', 'General')
+    precio = entrada.get('precio_total', 0)
+
+    partes = [
+        b'\x1ba\x01',                       # centrado
+        obtener_recurso_render("escpos_logo", crear_escpos_logo),
+        b'\n',
+    ]
+    if numero_ticket:
+        partes += [b'\x1b!\x30', _escpos_texto(f"#{numero_ticket:04d}")]  # doble alto y ancho
+    partes += [
+        b'\x1b!\x10\x1dB\x01', _escpos_texto(f" {categoria.upper()} "), b'\x1dB\x00\x1b!\x00',
+        b'\n',
+    ]
+    if entrada.get('qr_payload'):
+        partes.append(escpos_qr(entrada['qr_payload']))
+    partes += [
+        b'\x1bE\x01', _escpos_texto(entrada.get('codigo_alfanumerico', '')), b'\x1bE\x00',
+        b'\x1b!\x30', _escpos_texto(f"${precio:.2f}"), b'\x1b!\x00',
+        b'\x1bM\x01',                       # fuente B (pequeña)
+        _escpos_texto("San Cristóbal, Táchira - Venezuela"),
+        _escpos_texto("Entrada válida para un solo uso"),
+        b'\x1bM\x00',
+        b'\x1bd\x03',                       # avanzar 3 líneas
+        b'\x1dV\x42\x00',                   # corte parcial
+    ]
+    return b''.join(partes)
+
+@api_router.get("/admin/entradas-termicas/escpos")
+async def obtener_entradas_termicas_escpos(
+    numero_inicio: Optional[int] = None,
+    numero_fin: Optional[int] = None,
+    lote_id: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """Flujo ESC/POS listo para imprimir de un rango numerado o de un lote de tickets térmicos"""
+    from fastapi.responses import StreamingResponse
+
+    filtro = {"tipo_venta": "taquilla"}
+    if lote_id:
+        if not await db.lotes_termicos.find_one({"id": lote_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Lote no encontrado")
+        filtro["lote_id"] = lote_id
+    elif numero_inicio is not None and numero_fin is not None:
+        if numero_fin < numero_inicio:
+            raise HTTPException(status_code=400, detail="Rango de numeración inválido")
+        if numero_fin - numero_inicio + 1 > ESCPOS_MAX_TICKETS:
+            raise HTTPException(status_code=400, detail=f"Máximo {ESCPOS_MAX_TICKETS} tickets por impresión")
+        filtro["numero_ticket"] = {"$gte": numero_inicio, "$lte": numero_fin}
+    else:
+        raise HTTPException(status_code=400, detail="Indique numero_inicio y numero_fin, o lote_id")
+
+    proyeccion = {
+        "_id": 0, "numero_ticket": 1, "categoria_entrada": 1, "precio_total": 1,
+        "qr_payload": 1, "codigo_alfanumerico": 1
+    }
+    # Sin limit: el rango ya se validó arriba y un lote (hasta LOTE_TERMICO_MAX) se envía
+    # completo; el flujo se genera ticket a ticket sin cargar el lote en memoria
+    cursor = db.entradas.find(filtro, proyeccion).sort("numero_ticket", 1)
+
+    async def generar_flujo():
+        yield ESCPOS_INIT
+        async for entrada in cursor:
+            yield construir_ticket_escpos(entrada)
+
+    nombre = f"lote-{lote_id[:8]}" if lote_id else f"tickets-{numero_inicio}-{numero_fin}"
+    return StreamingResponse(
+        generar_flujo(),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f"attachment; filename={nombre}.bin"}
+    )
+
+# ---------- Hojas de impresión por lote (PDF multipágina o rollo) ----------
+
+IMPRESION_MAX_TICKETS = 2000
+IMPRESION_MAX_ROLLO = 200  # el rollo es una sola imagen: limitar su alto
+_pool_impresion = None
+
+def obtener_pool_impresion():
+    """Pool de procesos compartido para renderizar tickets en paralelo (creado bajo demanda)"""
+    global _pool_impresion
+    if _pool_impresion is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _pool_impresion = ProcessPoolExecutor(max_workers=os.cpu_count() or 2)
+    return _pool_impresion
+
+def renderizar_bloque_termico(entradas: list) -> list:
+    """Renderiza un bloque de tickets dentro de un proceso del pool"""
+    return [renderizar_entrada_termica(entrada) for entrada in entradas]
+
+async def renderizar_termicas_en_paralelo(entradas: list) -> list:
+    """Reparte los tickets en un bloque por proceso y devuelve los PNG en el mismo orden"""
+    workers = os.cpu_count() or 2
+    tamano = max(1, -(-len(entradas) // workers))  # división hacia arriba
+    bloques = [entradas[i:i + tamano] for i in range(0, len(entradas), tamano)]
+    loop = asyncio.get_running_loop()
+    pool = obtener_pool_impresion()
+    resultados = await asyncio.gather(*[
+        loop.run_in_executor(pool, renderizar_bloque_termico, bloque) for bloque in bloques
+    ])
+    return [png for bloque in resultados for png in bloque]
+
+def componer_pdf_termicas(pngs: list, hoja: str) -> bytes:
+    """Arma un PDF multipágina: un ticket por página (80mm) o rejilla en A4"""
+    buffer = BytesIO()
+    # 576x450 px a 203 dpi ≈ 72 x 56.3 mm
+    ticket_w = 72 * mm
+    ticket_h = ticket_w * 450 / 576
+
+    if hoja == 'a4':
+        c = canvas.Canvas(buffer, pagesize=A4)
+        page_width, page_height = A4
+        margen = 10 * mm
+        espacio = 6 * mm
+        cols = int((page_width - 2 * margen + espacio) // (ticket_w + espacio))
+        rows = int((page_height - 2 * margen + espacio) // (ticket_h + espacio))
+        por_pagina = cols * rows
+        for i, png in enumerate(pngs):
+            pos = i % por_pagina
+            if pos == 0 and i > 0:
+                c.showPage()
+            col, row = pos % cols, pos // cols
+            x = margen + col * (ticket_w + espacio)
+            y = page_height - margen - ticket_h - row * (ticket_h + espacio)
+            c.drawImage(ImageReader(BytesIO(png)), x, y, ticket_w, ticket_h)
+    else:
+        page_size = (80 * mm, ticket_h + 4 * mm)
+        c = canvas.Canvas(buffer, pagesize=page_size)
+        for i, png in enumerate(pngs):
+            if i > 0:
+                c.showPage()
+            c.drawImage(ImageReader(BytesIO(png)), 4 * mm, 2 * mm, ticket_w, ticket_h)
+
+    c.save()
+    return buffer.getvalue()
+
+def componer_rollo_termicas(pngs: list) -> bytes:
+    """Concatena los tickets en una sola imagen vertical (rollo continuo)"""
+    imagenes = [Image.open(BytesIO(png)).convert('L') for png in pngs]
+    separacion = 12
+    alto_total = sum(img.size[1] for img in imagenes) + separacion * (len(imagenes) - 1)
+    rollo = Image.new('L', (imagenes[0].size[0], alto_total), color=255)
+    y = 0
+    for img in imagenes:
+        rollo.paste(img, (0, y))
+        y += img.size[1] + separacion
+    buffer = BytesIO()
+    rollo.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+@api_router.post("/admin/entradas-termicas/imprimir")
+async def imprimir_entradas_termicas(request: Request, current_user: str = Depends(get_current_user)):
+    """
+    Genera un único documento de impresión para muchos tickets térmicos.
+    Body: numero_inicio/numero_fin, ids o lote_id; formato "pdf" | "rollo"; hoja "termica" | "a4"
+    """
+    from fastapi.responses import StreamingResponse
+
+    body = await request.json()
+    formato = body.get('formato', 'pdf')
+    hoja = body.get('hoja', 'termica')
+    if formato not in ('pdf', 'rollo'):
+        raise HTTPException(status_code=400, detail="Formato inválido (pdf o rollo)")
+
+    filtro = {"tipo_venta": "taquilla"}
+    if body.get('ids'):
+        ids = body['ids']
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            raise HTTPException(status_code=400, detail="ids debe ser una lista de identificadores")
+        filtro["id"] = {"$in": ids}
+    elif body.get('lote_id'):
+        filtro["lote_id"] = body['lote_id']
+    elif body.get('numero_inicio') is not None and body.get('numero_fin') is not None:
+        numero_inicio = numero_body(body, 'numero_inicio', None)
+        numero_fin = numero_body(body, 'numero_fin', None)
+        if numero_inicio > numero_fin:
+            raise HTTPException(status_code=400, detail="numero_inicio no puede ser mayor que numero_fin")
+        filtro["numero_ticket"] = {"$gte": numero_inicio, "$lte": numero_fin}
+    else:
+        raise HTTPException(status_code=400, detail="Indique numero_inicio y numero_fin, ids o lote_id")
+
+    limite = IMPRESION_MAX_ROLLO if formato == 'rollo' else IMPRESION_MAX_TICKETS
+    proyeccion = {
+        "_id": 0, "id": 1, "numero_ticket": 1, "categoria_entrada": 1, "precio_total": 1,
+        "qr_payload": 1, "codigo_qr": 1, "codigo_alfanumerico": 1
+    }
+    # Una sola consulta para todo el lote
+    entradas = await db.entradas.find(filtro, proyeccion).sort("numero_ticket", 1).to_list(limite + 1)
+    if not entradas:
+        raise HTTPException(status_code=404, detail="No se encontraron tickets")
+    if len(entradas) > limite:
+        raise HTTPException(status_code=400, detail=f"Máximo {limite} tickets por documento en formato {formato}")
+
+    pngs = await renderizar_termicas_en_paralelo(entradas)
+
+    if formato == 'pdf':
+        contenido = await asyncio.to_thread(componer_pdf_termicas, pngs, hoja)
+        media_type, extension = "application/pdf", "pdf"
+    else:
+        contenido = await asyncio.to_thread(componer_rollo_termicas, pngs)
+        media_type, extension = "image/png", "png"
+
+    primero = entradas[0].get('numero_ticket', 0)
+    ultimo = entradas[-1].get('numero_ticket', 0)
+    return StreamingResponse(
+        BytesIO(contenido),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=tickets-{primero}-{ultimo}.{extension}"}
+    )
 
 # ============== ENDPOINTS PARA PDF DE ACREDITACIONES ==============
 
@@ -2726,6 +4437,7 @@ import tempfile
 # Tamaño de credencial: 14.5 cm (alto) x 9.5 cm (ancho) - formato vertical/portrait
 CREDENCIAL_WIDTH = 95 * mm   # 9.5 cm ancho
 CREDENCIAL_HEIGHT = 145 * mm  # 14.5 cm alto
+QR_PDF_PX = 300  # resolución mínima del QR incrustado (~300 dpi para un QR de 25 mm)
 
 @api_router.get("/admin/acreditaciones/{acreditacion_id}/pdf")
 async def generar_pdf_acreditacion(acreditacion_id: str, current_user: str = Depends(get_current_user)):
@@ -2735,7 +4447,7 @@ async def generar_pdf_acreditacion(acreditacion_id: str, current_user: str = Dep
         raise HTTPException(status_code=404, detail="Acreditación no encontrada")
     
     # Obtener evento
-    evento = await db.eventos.find_one({"id": acreditacion.get("evento_id")}, {"_id": 0})
+    evento = await obtener_evento_cache(acreditacion.get("evento_id"))
     
     # Obtener configuración de diseño de la categoría
     categoria = await db.categorias_acreditacion.find_one({"id": acreditacion.get("categoria_id")}, {"_id": 0})
@@ -2757,86 +4469,144 @@ async def generar_pdf_acreditacion(acreditacion_id: str, current_user: str = Dep
         headers={"Content-Disposition": f"attachment; filename=acreditacion_{acreditacion.get('nombre_persona', 'sin_nombre').replace(' ', '_')}.pdf"}
     )
 
-@api_router.get("/admin/acreditaciones/evento/{evento_id}/pdf")
-async def generar_pdf_todas_acreditaciones(evento_id: str, current_user: str = Depends(get_current_user)):
-    """Genera PDF con todas las acreditaciones de un evento - 4 por página tamaño carta"""
-    acreditaciones = await db.acreditaciones.find({"evento_id": evento_id}, {"_id": 0}).to_list(1000)
-    
-    if not acreditaciones:
-        raise HTTPException(status_code=404, detail="No hay acreditaciones para este evento")
-    
-    # Obtener evento
-    evento = await db.eventos.find_one({"id": evento_id}, {"_id": 0})
-    
-    # Obtener todas las categorías
-    categorias = await db.categorias_acreditacion.find({}, {"_id": 0}).to_list(100)
-    categorias_dict = {cat["id"]: cat for cat in categorias}
-    
-    # Crear PDF tamaño CARTA (letter: 8.5 x 11 pulgadas = 215.9 x 279.4 mm)
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
+# Layout carta: 2 columnas x 2 filas = 4 credenciales por página
+ACREDITACIONES_POR_PAGINA = 4
+ACREDITACIONES_PARALELO_MIN_PAGINAS = int(os.environ.get('ACREDITACIONES_PARALELO_MIN_PAGINAS', '8'))
+
+def posiciones_carta_acreditaciones() -> tuple:
+    """(ancho, alto, [(x, y) por posición]) de cada credencial en la hoja carta"""
     page_width, page_height = letter  # 612 x 792 puntos
-    
-    # Configuración de layout: 2 columnas x 2 filas = 4 credenciales por página
     margin_x = 15 * mm  # Margen horizontal
     margin_y = 15 * mm  # Margen vertical
     spacing_x = 10 * mm  # Espacio entre columnas
     spacing_y = 10 * mm  # Espacio entre filas
-    
-    cols = 2
-    rows = 2
-    acred_per_page = cols * rows  # 4 por página
+    cols, rows = 2, 2
     
     # Calcular tamaño de cada acreditación para que quepan 4 en carta
-    # Ancho disponible: page_width - 2*margin_x - spacing_x
     cred_width = (page_width - 2*margin_x - spacing_x) / cols
-    # Alto disponible: page_height - 2*margin_y - spacing_y  
     cred_height = (page_height - 2*margin_y - spacing_y) / rows
     
-    logging.info(f"PDF carta: {page_width:.0f}x{page_height:.0f}pt, acreditación: {cred_width:.0f}x{cred_height:.0f}pt ({cred_width/mm:.0f}x{cred_height/mm:.0f}mm)")
-    
-    for i, acred in enumerate(acreditaciones):
-        # Calcular posición en la página
-        pos_in_page = i % acred_per_page
+    posiciones = []
+    for pos_in_page in range(cols * rows):
         col = pos_in_page % cols
         row = pos_in_page // cols
-        
+        # X: desde la izquierda; Y: desde abajo (la fila 0 está arriba)
+        posiciones.append((
+            margin_x + col * (cred_width + spacing_x),
+            page_height - margin_y - cred_height - row * (cred_height + spacing_y)
+        ))
+    return cred_width, cred_height, posiciones
+
+def renderizar_paginas_acreditaciones(acreditaciones: list, categorias_dict: dict, evento: Optional[dict], templates: dict) -> bytes:
+    """PDF carta de un grupo de acreditaciones (4 por página). Corre en el proceso que la llame"""
+    cred_width, cred_height, posiciones = posiciones_carta_acreditaciones()
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    formas = {}  # templates ya definidos como XObject en este documento
+    for i, acred in enumerate(acreditaciones):
+        pos_in_page = i % ACREDITACIONES_POR_PAGINA
         # Nueva página si es necesario
         if pos_in_page == 0 and i > 0:
             c.showPage()
-        
-        # Calcular coordenadas
-        # X: desde la izquierda
-        x = margin_x + col * (cred_width + spacing_x)
-        # Y: desde abajo (la fila 0 está arriba)
-        y = page_height - margin_y - cred_height - row * (cred_height + spacing_y)
-        
-        # Obtener categoría
+        x, y = posiciones[pos_in_page]
         categoria = categorias_dict.get(acred.get("categoria_id"))
-        
-        # Dibujar la acreditación
-        await dibujar_acreditacion(c, acred, categoria, x, y, cred_width, cred_height, evento)
-    
+        dibujar_acreditacion_sync(c, acred, categoria, x, y, cred_width, cred_height, evento, templates, formas)
     c.save()
-    buffer.seek(0)
+    return buffer.getvalue()
+
+def unir_pdfs(partes: list) -> bytes:
+    """Concatena PDFs en orden con pypdf; los templates repetidos entre partes se deduplican"""
+    from pypdf import PdfReader, PdfWriter
+
+    writer = PdfWriter()
+    for parte in partes:
+        writer.append(PdfReader(BytesIO(parte)))
+    writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+async def renderizar_acreditaciones_en_paralelo(acreditaciones: list, categorias_dict: dict, evento: Optional[dict], templates: dict) -> bytes:
+    """
+    Reparte las páginas en un grupo contiguo por proceso (templates enviados una vez
+    por grupo) y une los PDF parciales en orden.
+    """
+    workers = os.cpu_count() or 2
+    paginas = -(-len(acreditaciones) // ACREDITACIONES_POR_PAGINA)
+    paginas_por_grupo = max(1, -(-paginas // workers))
+    tamano = paginas_por_grupo * ACREDITACIONES_POR_PAGINA
+    grupos = [acreditaciones[i:i + tamano] for i in range(0, len(acreditaciones), tamano)]
+    loop = asyncio.get_running_loop()
+    pool = obtener_pool_impresion()
+    partes = await asyncio.gather(*[
+        loop.run_in_executor(pool, renderizar_paginas_acreditaciones, grupo, categorias_dict, evento, templates)
+        for grupo in grupos
+    ])
+    return await asyncio.to_thread(unir_pdfs, partes)
+
+async def construir_pdf_acreditaciones(evento_id: str, paralelo: Optional[bool] = None) -> tuple:
+    """(bytes del PDF, nombre de archivo) con todas las acreditaciones de un evento"""
+    acreditaciones = await db.acreditaciones.find({"evento_id": evento_id}, {"_id": 0}).to_list(None)
+    
+    if not acreditaciones:
+        raise HTTPException(status_code=404, detail="No hay acreditaciones para este evento")
+    
+    # Obtener evento
+    evento = await obtener_evento_cache(evento_id)
+    
+    # Obtener todas las categorías
+    categorias = await db.categorias_acreditacion.find({}, {"_id": 0}).to_list(100)
+    categorias_dict = {cat["id"]: cat for cat in categorias}
+    
+    # Templates descargados una sola vez para todo el PDF
+    templates = await cargar_templates_acreditaciones(acreditaciones, categorias_dict, evento)
+    
+    paginas = -(-len(acreditaciones) // ACREDITACIONES_POR_PAGINA)
+    if paralelo is None:
+        paralelo = paginas >= ACREDITACIONES_PARALELO_MIN_PAGINAS and (os.cpu_count() or 1) > 1
+    
+    contenido = None
+    if paralelo:
+        try:
+            contenido = await renderizar_acreditaciones_en_paralelo(acreditaciones, categorias_dict, evento, templates)
+        except ImportError:
+            logging.warning("pypdf no está instalado: PDF de acreditaciones en modo serie")
+        except Exception as e:
+            logging.error(f"Error en el PDF paralelo de acreditaciones, reintentando en serie: {e}")
+    if contenido is None:
+        contenido = await asyncio.to_thread(renderizar_paginas_acreditaciones, acreditaciones, categorias_dict, evento, templates)
+    logging.info(f"PDF acreditaciones: {len(acreditaciones)} credenciales, {paginas} páginas, paralelo={paralelo}")
     
-    from fastapi.responses import Response
     nombre_evento = evento.get("nombre", "evento").replace(" ", "_") if evento else "evento"
+    return contenido, f"acreditaciones_{nombre_evento}.pdf"
+
+@api_router.get("/admin/acreditaciones/evento/{evento_id}/pdf")
+async def generar_pdf_todas_acreditaciones(
+    evento_id: str,
+    paralelo: Optional[bool] = None,
+    en_segundo_plano: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Genera PDF con todas las acreditaciones de un evento - 4 por página tamaño carta.
+    Con muchas páginas (o paralelo=true) se renderiza por grupos de páginas en el pool de procesos.
+    Con en_segundo_plano=true se encola como trabajo y el PDF queda como artefacto del trabajo.
+    """
+    if en_segundo_plano:
+        job = await encolar_job("pdf_acreditaciones", {"evento_id": evento_id, "paralelo": paralelo}, current_user)
+        return respuesta_job_encolado(job)
+    
+    contenido, nombre_archivo = await construir_pdf_acreditaciones(evento_id, paralelo)
+    
+    from fastapi.responses import Response
     return Response(
-        content=buffer.getvalue(), 
+        content=contenido, 
         media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=acreditaciones_{nombre_evento}.pdf"}
+        headers={"Content-Disposition": f"attachment; filename={nombre_archivo}"}
     )
 
-async def dibujar_acreditacion(c, acreditacion: dict, categoria: dict, x: float, y: float, width: float, height: float, evento: dict = None):
-    """Dibuja una acreditación en el canvas PDF"""
-    # Color de fondo basado en la categoría
-    color_hex = categoria.get("color", "#8B5CF6") if categoria else "#8B5CF6"
-    # Convertir hex a RGB
-    r = int(color_hex[1:3], 16) / 255
-    g = int(color_hex[3:5], 16) / 255
-    b = int(color_hex[5:7], 16) / 255
-    
+def diseno_acreditacion(acreditacion: dict, categoria: dict, evento: dict = None) -> tuple:
+    """(config_elementos, referencia del template) de una acreditación"""
     # Obtener configuración de elementos - primero del evento, luego de la categoría
     config = None
     template_img = None
@@ -2847,14 +4617,99 @@ async def dibujar_acreditacion(c, acreditacion: dict, categoria: dict, x: float,
         if config_evento:
             config = config_evento.get("config_elementos")
             template_img = config_evento.get("template_imagen")
-            logging.info(f"Config acreditación encontrada: nombre_size={config.get('nombre', {}).get('size') if config else 'N/A'}")
+            logging.debug(f"Config acreditación encontrada: nombre_size={config.get('nombre', {}).get('size') if config else 'N/A'}")
     
     # Fallback a config de categoría
     if not config and categoria:
         config = categoria.get("config_elementos")
-        logging.info(f"Usando config de categoría: {config is not None}")
+        logging.debug(f"Usando config de categoría: {config is not None}")
     if not template_img and categoria:
         template_img = categoria.get("template_imagen")
+    return config, template_img
+
+# ---------- Assets de impresión: imágenes reducidas a la resolución impresa ----------
+# Las fotos y templates llegan a resolución de cámara; en el PDF nunca se ven a
+# más de ASSETS_PDF_DPI. Se reducen una vez, se cachean por hash de contenido y
+# cada template se incrusta como un único form XObject por documento.
+
+ASSETS_PDF_DPI = int(os.environ.get('ASSETS_PDF_DPI', '300'))
+ASSETS_PDF_MAX = 64
+_assets_pdf: dict = {}  # (sha1 del original, ancho px, alto px) -> bytes reducidos (orden = LRU)
+
+def preparar_imagen_impresion(datos: bytes, ancho_pt: float, alto_pt: float) -> bytes:
+    """Imagen reducida para caber en ancho_pt x alto_pt a ASSETS_PDF_DPI (conserva proporción, nunca agranda)"""
+    limite = (int(ancho_pt / 72 * ASSETS_PDF_DPI), int(alto_pt / 72 * ASSETS_PDF_DPI))
+    clave = (hashlib.sha1(datos).hexdigest(), *limite)
+    preparada = _assets_pdf.pop(clave, None)
+    metrica_cache("assets_pdf", preparada is not None)
+    if preparada is None:
+        with Image.open(BytesIO(datos)) as img:
+            if img.size[0] <= limite[0] and img.size[1] <= limite[1] and img.format in ("JPEG", "PNG"):
+                preparada = datos  # ya está a la resolución de impresión o menos
+            else:
+                img.draft("RGB", limite)  # JPEG: decodifica directamente a escala reducida
+                transparente = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+                reducida = img.convert("RGBA" if transparente else "RGB")
+                reducida.thumbnail(limite, Image.Resampling.LANCZOS, reducing_gap=3.0)
+                preparada = codificar_imagen(reducida, "png" if transparente else "jpeg", "pdf_asset")
+                logging.info(f"Asset PDF reducido: {img.size[0]}x{img.size[1]} -> {reducida.size[0]}x{reducida.size[1]} ({len(datos)//1024} -> {len(preparada)//1024} KB)")
+        while len(_assets_pdf) >= ASSETS_PDF_MAX:
+            _assets_pdf.pop(next(iter(_assets_pdf)))
+    _assets_pdf[clave] = preparada
+    return preparada
+
+async def cargar_templates_acreditaciones(acreditaciones: list, categorias_dict: dict, evento: dict = None) -> dict:
+    """Bytes de cada template distinto (derivado a 300 dpi si existe) ya reducidos a la resolución impresa"""
+    templates = {}
+    for acreditacion in acreditaciones:
+        _, referencia = diseno_acreditacion(acreditacion, categorias_dict.get(acreditacion.get("categoria_id")), evento)
+        if referencia and referencia not in templates:
+            try:
+                fuente = await referencia_derivada(referencia, "credencial")
+                datos = await asyncio.to_thread(obtener_bytes_template_sync, fuente)
+                if datos:
+                    datos = await asyncio.to_thread(preparar_imagen_impresion, datos, CREDENCIAL_WIDTH, CREDENCIAL_HEIGHT)
+                templates[referencia] = datos
+            except Exception as e:
+                logging.warning(f"Error cargando template de acreditación: {e}")
+                templates[referencia] = None
+    return templates
+
+async def dibujar_acreditacion(c, acreditacion: dict, categoria: dict, x: float, y: float, width: float, height: float, evento: dict = None,
+                               formas: dict = None):
+    """Dibuja una acreditación en el canvas PDF"""
+    templates = await cargar_templates_acreditaciones([acreditacion], {acreditacion.get("categoria_id"): categoria}, evento)
+    dibujar_acreditacion_sync(c, acreditacion, categoria, x, y, width, height, evento, templates, formas)
+
+def dibujar_template_pdf(c, img_bytes: bytes, x: float, y: float, width: float, height: float, formas: dict):
+    """
+    Dibuja el template como form XObject: se define una vez por documento y tamaño
+    y cada credencial solo lo referencia (sin volver a decodificar ni a incrustar).
+    `formas` es el registro del documento: (hash, ancho, alto) -> nombre del XObject.
+    """
+    clave = (hashlib.sha1(img_bytes).hexdigest(), round(width, 2), round(height, 2))
+    nombre = formas.get(clave)
+    if nombre is None:
+        nombre = formas[clave] = f"tpl{len(formas)}"
+        c.beginForm(nombre, 0, 0, width, height)
+        c.drawImage(ImageReader(BytesIO(img_bytes)), 0, 0, width, height, preserveAspectRatio=True, mask='auto')
+        c.endForm()
+    c.saveState()
+    c.translate(x, y)
+    c.doForm(nombre)
+    c.restoreState()
+
+def dibujar_acreditacion_sync(c, acreditacion: dict, categoria: dict, x: float, y: float, width: float, height: float,
+                              evento: dict = None, templates: dict = None, formas: dict = None):
+    """Dibuja una acreditación con los templates ya cargados (apta para procesos del pool)"""
+    # Color de fondo basado en la categoría
+    color_hex = categoria.get("color", "#8B5CF6") if categoria else "#8B5CF6"
+    # Convertir hex a RGB
+    r = int(color_hex[1:3], 16) / 255
+    g = int(color_hex[3:5], 16) / 255
+    b = int(color_hex[5:7], 16) / 255
+    
+    config, template_img = diseno_acreditacion(acreditacion, categoria, evento)
     
     # Fondo con gradiente simulado
     c.setFillColorRGB(r * 0.3, g * 0.3, b * 0.3)  # Fondo oscuro
@@ -2864,33 +4719,16 @@ async def dibujar_acreditacion(c, acreditacion: dict, categoria: dict, x: float,
     c.setFillColorRGB(r, g, b)
     c.rect(x, y + height - 18*mm, width, 18*mm, fill=1, stroke=0)
     
-    # Imagen de fondo personalizada si existe
+    # Imagen de fondo personalizada si existe (ya reducida a resolución de impresión; un XObject por documento)
     if template_img:
         try:
-            if template_img.startswith("data:image"):
-                # Base64
-                img_data = BytesIO(base64.b64decode(template_img.split(',')[1]))
-                img = ImageReader(img_data)
-                c.drawImage(img, x, y, width, height, preserveAspectRatio=True, mask='auto')
-            elif template_img.startswith("http"):
-                # URL externa (Cloudinary u otro servicio)
-                import httpx
-                response = httpx.get(template_img, timeout=30.0)
-                if response.status_code == 200:
-                    img_data = BytesIO(response.content)
-                    img = ImageReader(img_data)
-                    c.drawImage(img, x, y, width, height, preserveAspectRatio=True, mask='auto')
-                    logging.info(f"Template acreditación cargado desde URL: {template_img}")
-            elif '/api/uploads/' in template_img or '/uploads/' in template_img:
-                # Archivo local
-                if '/api/uploads/' in template_img:
-                    filename = template_img.split('/api/uploads/')[-1]
-                else:
-                    filename = template_img.split('/uploads/')[-1]
-                file_path = UPLOADS_DIR / filename
-                if file_path.exists():
-                    img = ImageReader(str(file_path))
-                    c.drawImage(img, x, y, width, height, preserveAspectRatio=True, mask='auto')
+            img_bytes = (templates or {}).get(template_img)
+            if img_bytes is None and template_img not in (templates or {}):
+                img_bytes = obtener_bytes_template_sync(template_img)
+                if img_bytes:
+                    img_bytes = preparar_imagen_impresion(img_bytes, CREDENCIAL_WIDTH, CREDENCIAL_HEIGHT)
+            if img_bytes:
+                dibujar_template_pdf(c, img_bytes, x, y, width, height, {} if formas is None else formas)
         except Exception as e:
             logging.warning(f"Error cargando template de acreditación: {e}")
             pass  # Si falla, usar diseño por defecto
@@ -2987,14 +4825,21 @@ async def dibujar_acreditacion(c, acreditacion: dict, categoria: dict, x: float,
         mostrar_qr = config["qr"].get("visible", True)
     
     qr_data = acreditacion.get("codigo_qr")
-    if mostrar_qr and qr_data:
+    qr_payload = acreditacion.get("qr_payload")
+    if mostrar_qr and (qr_payload or qr_data):
         try:
-            # Extraer imagen base64 del QR
-            if qr_data.startswith("data:image"):
+            qr_img = None
+            if qr_payload:
+                # Matriz cacheada rasterizada a ~300 dpi del tamaño impreso (múltiplo entero de módulos)
+                matriz = matriz_qr(qr_payload)
+                qr_img = ImageReader(rasterizar_qr(matriz, tamano_qr_escalado(matriz, QR_PDF_PX), modo='L'))
+            elif qr_data.startswith("data:image"):
+                # Extraer imagen base64 del QR (acreditaciones antiguas sin payload)
                 qr_base64 = qr_data.split(",")[1]
                 qr_bytes = base64.b64decode(qr_base64)
                 qr_img = ImageReader(BytesIO(qr_bytes))
-                
+            
+            if qr_img is not None:
                 # Tamaño del QR desde config (en px del diseñador -> mm)
                 # El diseñador usa 285px = 95mm, entonces 1px ≈ 0.33mm
                 QR_SCALE = 0.33  # px a mm
@@ -3027,19 +4872,936 @@ async def dibujar_acreditacion(c, acreditacion: dict, categoria: dict, x: float,
     c.setLineWidth(1)
     c.roundRect(x, y, width, height, 5, fill=0, stroke=1)
 
+# ==================== EXPORTACIÓN MASIVA (NDJSON / CSV) ====================
+# Las exportaciones leen un cursor con proyección y van emitiendo bloques de
+# texto a medida que llegan los documentos: la memoria no depende del total de
+# filas. Con gzip=true el flujo se comprime al vuelo (zlib con cabecera gzip).
+
+EXPORT_CAMPOS_ENTRADAS = [
+    "id", "evento_id", "nombre_evento", "codigo_alfanumerico", "numero_ticket",
+    "nombre_comprador", "cedula_comprador", "email_comprador", "telefono_comprador",
+    "categoria_asiento", "categoria_entrada", "asiento", "mesa", "precio_total",
+    "metodo_pago", "estado_pago", "fecha_compra", "tipo_venta", "lote_id",
+    "estado_entrada", "usado", "fecha_uso", "historial_acceso"
+]
+EXPORT_CAMPOS_ACREDITACIONES = [
+    "id", "evento_id", "categoria_id", "categoria_nombre", "codigo_alfanumerico",
+    "nombre_persona", "cedula", "organizacion", "cargo", "email", "telefono",
+    "zonas_acceso", "estado", "fecha_creacion", "estado_entrada", "historial_acceso"
+]
+EXPORT_BLOQUE_BYTES = 64 * 1024
+EXPORT_BATCH_CURSOR = 1000
+
+registrar_metrica("ciudadferia_exportaciones_filas_total", "counter", "Filas exportadas por colección y formato")
+
+def filtro_exportacion(evento_id: Optional[str], campo_estado: str, estado: Optional[str],
+                       campo_fecha: str, desde: Optional[str], hasta: Optional[str]) -> dict:
+    """Filtro común de las exportaciones; las fechas se guardan como ISO 8601 (comparables como texto)"""
+    filtro = {}
+    if evento_id:
+        filtro["evento_id"] = evento_id
+    if estado:
+        filtro[campo_estado] = estado
+    rango = {operador: fecha.isoformat() for operador, fecha in rango_fechas_utc(desde, hasta).items()}
+    if rango:
+        filtro[campo_fecha] = rango
+    return filtro
+
+def _valor_csv(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, (list, dict)):
+        return json.dumps(valor, ensure_ascii=False, separators=(',', ':'))
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+async def _bloques_exportacion(cursor, campos: list, formato: str, coleccion: str):
+    """Serializa el cursor en bloques de ~64KB de NDJSON o CSV"""
+    import csv
+    import io
+
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer) if formato == "csv" else None
+    if escritor:
+        escritor.writerow(campos)
+    filas = 0
+    async for documento in cursor:
+        if escritor:
+            escritor.writerow([_valor_csv(documento.get(campo)) for campo in campos])
+        else:
+            buffer.write(json.dumps({c: documento.get(c) for c in campos}, ensure_ascii=False, default=str))
+            buffer.write("\n")
+        filas += 1
+        if buffer.tell() >= EXPORT_BLOQUE_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+    metrica_inc("ciudadferia_exportaciones_filas_total", filas, coleccion=coleccion, formato=formato)
+    logging.info(f"Exportación de {coleccion} ({formato}): {filas} filas")
+
+async def _comprimir_gzip(bloques):
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+    async for bloque in bloques:
+        comprimido = compresor.compress(bloque)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+def respuesta_exportacion(coleccion: str, filtro: dict, campos: list, formato: str, gzip: bool):
+    from fastapi.responses import StreamingResponse
+
+    if formato not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Formato no soportado (use ndjson o csv)")
+    proyeccion = {"_id": 0, **{campo: 1 for campo in campos}}
+    cursor = db[coleccion].find(filtro, proyeccion).sort("_id", 1).batch_size(EXPORT_BATCH_CURSOR)
+    flujo = _bloques_exportacion(cursor, campos, formato, coleccion)
+
+    media_type = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    nombre = f"{coleccion}-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{formato}"
+    if gzip:
+        flujo = _comprimir_gzip(flujo)
+        media_type = "application/gzip"
+        nombre += ".gz"
+    return StreamingResponse(
+        flujo,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={nombre}"}
+    )
+
+@api_router.get("/admin/export/entradas")
+async def exportar_entradas(
+    formato: str = "ndjson",
+    evento_id: Optional[str] = None,
+    estado: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    gzip: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """Exporta todas las entradas que cumplan el filtro (estado de pago y rango de fecha de compra)"""
+    filtro = filtro_exportacion(evento_id, "estado_pago", estado, "fecha_compra", desde, hasta)
+    return respuesta_exportacion("entradas", filtro, EXPORT_CAMPOS_ENTRADAS, formato, gzip)
+
+@api_router.get("/admin/export/acreditaciones")
+async def exportar_acreditaciones(
+    formato: str = "ndjson",
+    evento_id: Optional[str] = None,
+    estado: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    gzip: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """Exporta las acreditaciones que cumplan el filtro (estado y rango de fecha de creación)"""
+    filtro = filtro_exportacion(evento_id, "estado", estado, "fecha_creacion", desde, hasta)
+    return respuesta_exportacion("acreditaciones", filtro, EXPORT_CAMPOS_ACREDITACIONES, formato, gzip)
+
+# ==================== ANALÍTICA POST-EVENTO (PARQUET) ====================
+# Las entradas y acreditaciones de un evento se vuelcan por bloques a archivos
+# Parquet (columnar) en analitica/<evento_id>/: uno con las ventas y otro con los
+# accesos ya aplanados desde historial_acceso. Los resúmenes (ventas por hora y
+# categoría, llegadas a puerta, ocupación máxima) se calculan vectorizados con
+# pandas sobre esos archivos, sin volver a agregar en Mongo.
+# pyarrow/pandas se importan solo al usar estos endpoints.
+
+ANALITICA_DIR = ROOT_DIR / "analitica"
+ANALITICA_CHUNK = 5000
+_analitica_locks: dict = {}  # evento_id -> asyncio.Lock (una reconstrucción a la vez)
+_analitica_resumenes: dict = {}  # (evento_id, mtime, resolucion) -> resumen
+
+def _esquemas_analitica():
+    import pyarrow as pa
+    ventas = pa.schema([
+        ("id", pa.string()),
+        ("origen", pa.string()),  # entrada | acreditacion
+        ("categoria", pa.string()),
+        ("estado_pago", pa.string()),
+        ("metodo_pago", pa.string()),
+        ("tipo_venta", pa.string()),
+        ("precio", pa.float64()),
+        ("fecha_compra", pa.timestamp("us", tz="UTC")),
+        ("estado_entrada", pa.string()),
+    ])
+    accesos = pa.schema([
+        ("id", pa.string()),
+        ("origen", pa.string()),
+        ("categoria", pa.string()),
+        ("tipo", pa.string()),  # entrada | salida
+        ("fecha", pa.timestamp("us", tz="UTC")),
+    ])
+    return ventas, accesos
+
+def _fecha_analitica(valor):
+    if not valor:
+        return None
+    if isinstance(valor, datetime):
+        return valor if valor.tzinfo else valor.replace(tzinfo=timezone.utc)
+    try:
+        fecha = datetime.fromisoformat(str(valor).replace("Z", "+00:00"))
+        return fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+def _filas_analitica(documentos: list, origen: str, precio_evento: float):
+    """Convierte un bloque de documentos en columnas de ventas y de accesos"""
+    ventas = {c: [] for c in ("id", "origen", "categoria", "estado_pago", "metodo_pago", "tipo_venta", "precio", "fecha_compra", "estado_entrada")}
+    accesos = {c: [] for c in ("id", "origen", "categoria", "tipo", "fecha")}
+    for doc in documentos:
+        if origen == "entrada":
+            categoria = doc.get("categoria_entrada") or doc.get("categoria_asiento") or "General"
+            precio = doc.get("precio_total")
+            ventas["estado_pago"].append(doc.get("estado_pago"))
+            ventas["metodo_pago"].append(doc.get("metodo_pago"))
+            ventas["tipo_venta"].append(doc.get("tipo_venta") or "online")
+            ventas["precio"].append(float(precio) if isinstance(precio, (int, float)) else precio_evento)
+            ventas["fecha_compra"].append(_fecha_analitica(doc.get("fecha_compra")))
+        else:
+            categoria = doc.get("categoria_nombre") or "Acreditación"
+            ventas["estado_pago"].append(doc.get("estado"))
+            ventas["metodo_pago"].append(None)
+            ventas["tipo_venta"].append("acreditacion")
+            ventas["precio"].append(0.0)
+            ventas["fecha_compra"].append(_fecha_analitica(doc.get("fecha_creacion")))
+        ventas["id"].append(doc.get("id"))
+        ventas["origen"].append(origen)
+        ventas["categoria"].append(categoria)
+        ventas["estado_entrada"].append(doc.get("estado_entrada", "fuera"))
+        for acceso in doc.get("historial_acceso") or []:
+            fecha = _fecha_analitica(acceso.get("fecha"))
+            if fecha is None:
+                continue
+            accesos["id"].append(doc.get("id"))
+            accesos["origen"].append(origen)
+            accesos["categoria"].append(categoria)
+            accesos["tipo"].append(acceso.get("tipo"))
+            accesos["fecha"].append(fecha)
+    return ventas, accesos
+
+async def construir_parquet_evento(evento_id: str) -> dict:
+    """Vuelca entradas y acreditaciones del evento a Parquet leyendo el cursor por bloques"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    evento = await obtener_evento_cache(evento_id)
+    if not evento:
+        raise HTTPException(status_code=404, detail="Evento no encontrado")
+    esquema_ventas, esquema_accesos = _esquemas_analitica()
+    carpeta = ANALITICA_DIR / evento_id
+    carpeta.mkdir(parents=True, exist_ok=True)
+    tmp_ventas, tmp_accesos = carpeta / "ventas.parquet.tmp", carpeta / "accesos.parquet.tmp"
+    escritor_ventas = pq.ParquetWriter(tmp_ventas, esquema_ventas, compression="zstd")
+    escritor_accesos = pq.ParquetWriter(tmp_accesos, esquema_accesos, compression="zstd")
+    totales = {"ventas": 0, "accesos": 0}
+    precio_evento = float(evento.get("precio") or 0)
+
+    async def volcar(bloque: list, origen: str):
+        ventas, accesos = _filas_analitica(bloque, origen, precio_evento)
+        tabla_ventas = pa.Table.from_pydict(ventas, schema=esquema_ventas)
+        tabla_accesos = pa.Table.from_pydict(accesos, schema=esquema_accesos)
+        await asyncio.to_thread(escritor_ventas.write_table, tabla_ventas)
+        await asyncio.to_thread(escritor_accesos.write_table, tabla_accesos)
+        totales["ventas"] += tabla_ventas.num_rows
+        totales["accesos"] += tabla_accesos.num_rows
+
+    fuentes = [
+        ("entrada", db.entradas, {"_id": 0, "id": 1, "categoria_entrada": 1, "categoria_asiento": 1, "precio_total": 1,
+                                  "estado_pago": 1, "metodo_pago": 1, "tipo_venta": 1, "fecha_compra": 1,
+                                  "estado_entrada": 1, "historial_acceso": 1}),
+        ("acreditacion", db.acreditaciones, {"_id": 0, "id": 1, "categoria_nombre": 1, "estado": 1, "fecha_creacion": 1,
+                                             "estado_entrada": 1, "historial_acceso": 1}),
+    ]
+    try:
+        for origen, coleccion, proyeccion in fuentes:
+            bloque = []
+            async for doc in coleccion.find({"evento_id": evento_id}, proyeccion).batch_size(ANALITICA_CHUNK):
+                bloque.append(doc)
+                if len(bloque) >= ANALITICA_CHUNK:
+                    await volcar(bloque, origen)
+                    bloque = []
+            if bloque:
+                await volcar(bloque, origen)
+    finally:
+        escritor_ventas.close()
+        escritor_accesos.close()
+    os.replace(tmp_ventas, carpeta / "ventas.parquet")
+    os.replace(tmp_accesos, carpeta / "accesos.parquet")
+    logging.info(f"Analítica de {evento_id}: {totales['ventas']} ventas, {totales['accesos']} accesos")
+    return {"evento_id": evento_id, **totales, "generado": datetime.now(timezone.utc).isoformat()}
+
+def resumir_parquet_evento(carpeta: Path, resolucion_min: int) -> dict:
+    """Resúmenes vectorizados sobre los Parquet del evento"""
+    import pandas as pd
+
+    ventas = pd.read_parquet(carpeta / "ventas.parquet")
+    accesos = pd.read_parquet(carpeta / "accesos.parquet")
+    entradas = ventas[ventas["origen"] == "entrada"]
+    aprobadas = entradas[entradas["estado_pago"] == "aprobado"]
+
+    por_hora = (
+        aprobadas.dropna(subset=["fecha_compra"])
+        .groupby(aprobadas["fecha_compra"].dt.floor("h"))["precio"]
+        .agg(["size", "sum"])
+    )
+    por_categoria = (
+        entradas.groupby(["categoria", "estado_pago"])["precio"].agg(["size", "sum"]).reset_index()
+    )
+    intervalo = f"{resolucion_min}min"
+    llegadas = accesos[accesos["tipo"] == "entrada"].groupby(accesos["fecha"].dt.floor(intervalo)).size()
+
+    # Ocupación: +1 por entrada, -1 por salida, acumulado en orden cronológico
+    movimientos = accesos[accesos["tipo"].isin(["entrada", "salida"])].sort_values("fecha", kind="stable")
+    ocupacion = movimientos["tipo"].map({"entrada": 1, "salida": -1}).cumsum()
+    pico = None
+    curva = []
+    if not ocupacion.empty:
+        indice_pico = ocupacion.values.argmax()
+        pico = {"personas": int(ocupacion.iloc[indice_pico]), "fecha": movimientos["fecha"].iloc[indice_pico].isoformat()}
+        por_intervalo = ocupacion.groupby(movimientos["fecha"].dt.floor(intervalo).values).max()
+        curva = [{"intervalo": pd.Timestamp(t).isoformat(), "ocupacion_max": int(v)} for t, v in por_intervalo.items()]
+
+    return {
+        "totales": {
+            "entradas": int(len(entradas)),
+            "aprobadas": int(len(aprobadas)),
+            "ingresos": round(float(aprobadas["precio"].sum()), 2),
+            "acreditaciones": int((ventas["origen"] == "acreditacion").sum()),
+            "accesos": int(len(accesos)),
+            "dentro_ahora": int((ventas["estado_entrada"] == "dentro").sum())
+        },
+        "ventas_por_hora": [
+            {"hora": t.isoformat(), "vendidas": int(fila["size"]), "ingresos": round(float(fila["sum"]), 2)}
+            for t, fila in por_hora.iterrows()
+        ],
+        "ventas_por_categoria": [
+            {"categoria": fila["categoria"], "estado_pago": fila["estado_pago"], "cantidad": int(fila["size"]), "monto": round(float(fila["sum"]), 2)}
+            for _, fila in por_categoria.iterrows()
+        ],
+        "llegadas": [{"intervalo": t.isoformat(), "entradas": int(v)} for t, v in llegadas.items()],
+        "ocupacion_pico": pico,
+        "ocupacion": curva
+    }
+
+@api_router.post("/admin/analitica/{evento_id}/generar")
+async def generar_analitica_evento(evento_id: str, current_user: str = Depends(get_current_user)):
+    """(Re)construye los Parquet de analítica del evento"""
+    candado = _analitica_locks.setdefault(evento_id, asyncio.Lock())
+    async with candado:
+        return await construir_parquet_evento(evento_id)
+
+@api_router.get("/admin/analitica/{evento_id}")
+async def obtener_analitica_evento(
+    evento_id: str,
+    resolucion_min: int = 15,
+    regenerar: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """Reporte post-evento desde el Parquet cacheado (se genera si no existe)"""
+    if not 1 <= resolucion_min <= 1440:
+        raise HTTPException(status_code=400, detail="resolucion_min debe estar entre 1 y 1440")
+    carpeta = ANALITICA_DIR / evento_id
+    candado = _analitica_locks.setdefault(evento_id, asyncio.Lock())
+    async with candado:
+        if regenerar or not (carpeta / "ventas.parquet").exists():
+            await construir_parquet_evento(evento_id)
+    mtime = (carpeta / "ventas.parquet").stat().st_mtime
+    clave = (evento_id, mtime, resolucion_min)
+    resumen = _analitica_resumenes.get(clave)
+    metrica_cache("analitica", resumen is not None)
+    if resumen is None:
+        resumen = await asyncio.to_thread(resumir_parquet_evento, carpeta, resolucion_min)
+        for vieja in [k for k in _analitica_resumenes if k[0] == evento_id and k[1] != mtime]:
+            del _analitica_resumenes[vieja]
+        _analitica_resumenes[clave] = resumen
+    return {
+        "evento_id": evento_id,
+        "generado": datetime.fromtimestamp(mtime, timezone.utc).isoformat(),
+        "resolucion_min": resolucion_min,
+        **resumen
+    }
+
+# ==================== DIAGNÓSTICO: BLOQUEOS DEL EVENT LOOP Y PROFILER ====================
+# Un latido en el event loop actualiza una marca de tiempo; un hilo vigilante
+# detecta cuándo deja de avanzar y captura la pila del hilo del loop en ese
+# momento, es decir, el código que lo está bloqueando (Pillow, ReportLab, bcrypt...).
+# El profiler de muestreo (opcional) toma la pila del loop cada pocos ms y, si una
+# petición supera el umbral, vuelca las muestras de su ventana a un archivo.
+
+BLOQUEO_UMBRAL_MS = int(os.environ.get('BLOQUEO_UMBRAL_MS', '100'))
+BLOQUEO_INTERVALO = 0.05  # segundos entre latidos
+PERFILES_DIR = ROOT_DIR / "perfiles"
+_bloqueos = collections.deque(maxlen=100)
+_latido = {"t": time.monotonic(), "hilo": None}
+_profiler = {"activo": False, "umbral_ms": 500, "intervalo_ms": 5}
+_muestras = collections.deque(maxlen=20000)  # (monotonic, pila colapsada)
+_diagnostico_parar = threading.Event()
+_tarea_latido = None
+
+def _pila_hilo(hilo_id: int, limite: int = 40) -> list:
+    frame = sys._current_frames().get(hilo_id)
+    pila = []
+    while frame is not None and len(pila) < limite:
+        codigo = frame.f_code
+        pila.append({
+            "archivo": os.path.basename(codigo.co_filename),
+            "linea": frame.f_lineno,
+            "funcion": codigo.co_name,
+            "corrutina": bool(codigo.co_flags & inspect.CO_COROUTINE)
+        })
+        frame = frame.f_back
+    pila.reverse()  # de la más externa a la más interna
+    return pila
+
+async def _latido_event_loop():
+    _latido["hilo"] = threading.get_ident()
+    while True:
+        _latido["t"] = time.monotonic()
+        await asyncio.sleep(BLOQUEO_INTERVALO)
+
+def _vigilante_bloqueos():
+    """Hilo que detecta el loop detenido y guarda la pila del código que lo bloquea"""
+    bloqueo_actual = None
+    latido_bloqueado = None
+    while not _diagnostico_parar.wait(BLOQUEO_INTERVALO):
+        hilo = _latido["hilo"]
+        if hilo is None:
+            continue
+        ultimo = _latido["t"]
+        retraso_ms = (time.monotonic() - ultimo - BLOQUEO_INTERVALO) * 1000
+
+        if bloqueo_actual is not None and ultimo != latido_bloqueado:
+            # El loop se recuperó: cerrar el registro con la duración total
+            bloqueo_actual["duracion_ms"] = round((ultimo - latido_bloqueado - BLOQUEO_INTERVALO) * 1000, 1)
+            bloqueo_actual = None
+
+        if bloqueo_actual is None and retraso_ms > BLOQUEO_UMBRAL_MS:
+            pila = _pila_hilo(hilo)
+            corrutinas = [f for f in pila if f["corrutina"]]
+            bloqueo_actual = {
+                "fecha": datetime.now(timezone.utc).isoformat(),
+                "duracion_ms": round(retraso_ms, 1),  # se actualiza al recuperarse
+                "corrutina": corrutinas[-1]["funcion"] if corrutinas else None,
+                "pila": [f"{f['archivo']}:{f['linea']} {f['funcion']}" for f in pila]
+            }
+            latido_bloqueado = ultimo
+            _bloqueos.append(bloqueo_actual)
+            logging.warning(f"Event loop bloqueado >{BLOQUEO_UMBRAL_MS}ms en {bloqueo_actual['corrutina']}: {bloqueo_actual['pila'][-1] if pila else ''}")
+
+def _muestreador_profiler():
+    """Hilo del profiler: muestrea la pila del event loop mientras esté activo"""
+    while not _diagnostico_parar.wait(_profiler["intervalo_ms"] / 1000):
+        hilo = _latido["hilo"]
+        if not _profiler["activo"] or hilo is None:
+            continue
+        pila = _pila_hilo(hilo, limite=60)
+        _muestras.append((time.monotonic(), ";".join(f"{f['funcion']} ({f['archivo']}:{f['linea']})" for f in pila)))
+
+def _volcar_perfil(ruta: str, metodo: str, inicio: float, fin: float) -> Optional[str]:
+    conteo: dict = {}
+    for t, pila in list(_muestras):
+        if inicio <= t <= fin:
+            conteo[pila] = conteo.get(pila, 0) + 1
+    if not conteo:
+        return None
+    PERFILES_DIR.mkdir(exist_ok=True)
+    nombre_ruta = ruta.strip('/').replace('/', '_').replace('{', '').replace('}', '') or 'raiz'
+    archivo = PERFILES_DIR / f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}_{metodo}_{nombre_ruta}.txt"
+    duracion_ms = (fin - inicio) * 1000
+    with open(archivo, 'w') as f:
+        # Formato "pilas colapsadas" (compatible con flamegraph.pl / speedscope)
+        f.write(f"# {metodo} {ruta} {duracion_ms:.0f}ms, muestras cada {_profiler['intervalo_ms']}ms\n")
+        for pila, n in sorted(conteo.items(), key=lambda x: -x[1]):
+            f.write(f"{pila} {n}\n")
+    return archivo.name
+
+async def perfilar_si_lenta(ruta: str, metodo: str, inicio: float, fin: float):
+    """Llamado por el middleware: vuelca las muestras si la petición superó el umbral"""
+    if _profiler["activo"] and (fin - inicio) * 1000 >= _profiler["umbral_ms"]:
+        archivo = await asyncio.to_thread(_volcar_perfil, ruta, metodo, inicio, fin)
+        if archivo:
+            logging.info(f"Perfil de petición lenta guardado: {archivo}")
+
+def iniciar_diagnostico():
+    global _tarea_latido
+    _tarea_latido = asyncio.get_running_loop().create_task(_latido_event_loop())
+    threading.Thread(target=_vigilante_bloqueos, name="vigilante-bloqueos", daemon=True).start()
+    threading.Thread(target=_muestreador_profiler, name="profiler-muestreo", daemon=True).start()
+
+@api_router.get("/admin/diagnostico/bloqueos")
+async def listar_bloqueos_event_loop(current_user: str = Depends(get_current_user)):
+    """Bloqueos recientes del event loop con la pila del código responsable"""
+    return {
+        "umbral_ms": BLOQUEO_UMBRAL_MS,
+        "total": len(_bloqueos),
+        "bloqueos": list(reversed(_bloqueos))
+    }
+
+@api_router.get("/admin/diagnostico/profiler")
+async def obtener_estado_profiler(current_user: str = Depends(get_current_user)):
+    """Estado del profiler de peticiones lentas y perfiles guardados"""
+    archivos = sorted(PERFILES_DIR.glob("*.txt"), reverse=True)[:50] if PERFILES_DIR.exists() else []
+    return {**_profiler, "muestras_en_memoria": len(_muestras), "perfiles": [a.name for a in archivos]}
+
+@api_router.post("/admin/diagnostico/profiler")
+async def configurar_profiler(request: Request, current_user: str = Depends(get_current_user)):
+    """Activa/desactiva el profiler de muestreo. Body: activo, umbral_ms, intervalo_ms"""
+    body = await request.json()
+    if 'umbral_ms' in body:
+        _profiler["umbral_ms"] = max(1, int(body['umbral_ms']))
+    if 'intervalo_ms' in body:
+        _profiler["intervalo_ms"] = min(100, max(1, int(body['intervalo_ms'])))
+    if 'activo' in body:
+        _profiler["activo"] = bool(body['activo'])
+        if not _profiler["activo"]:
+            _muestras.clear()
+    logging.info(f"Profiler {'activado' if _profiler['activo'] else 'desactivado'} por {current_user}: {_profiler}")
+    return _profiler
+
+@api_router.get("/admin/diagnostico/perfiles/{nombre}")
+async def descargar_perfil(nombre: str, current_user: str = Depends(get_current_user)):
+    """Descarga un perfil guardado (pilas colapsadas)"""
+    from fastapi.responses import FileResponse
+    archivo = PERFILES_DIR / os.path.basename(nombre)
+    if not archivo.exists():
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return FileResponse(archivo, media_type="text/plain")
+
+# ==================== TRABAJOS EN SEGUNDO PLANO ====================
+# Cola persistente en db.jobs para las operaciones largas del panel (PDFs masivos,
+# aprobaciones con email, lotes térmicos, asientos, migraciones). Los workers de
+# cada proceso reclaman trabajos con find_one_and_update, así que varias réplicas
+# pueden compartir la cola; un trabajo sin latido reciente se da por abandonado y
+# otro worker lo retoma (desde su punto de control si el tipo lo guarda).
+
+JOBS_DIR = ROOT_DIR / "trabajos"  # artefactos: trabajos/<job_id>/<archivo>
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', '2'))
+JOBS_SONDEO_S = 5             # espera máxima entre sondeos de la cola
+JOBS_LATIDO_S = 15            # cada cuánto se renueva el latido de un trabajo en curso
+JOBS_LATIDO_VENCIDO_S = 120   # sin latido en este tiempo, el trabajo se considera abandonado
+JOBS_INTENTOS_MAX = 3
+JOBS_RETENCION_HORAS = int(os.environ.get('JOBS_RETENCION_HORAS', '72'))
+JOBS_LIMPIEZA_S = 600
+ESTADOS_FINALES_JOB = ("completado", "error", "cancelado")
+
+registrar_metrica("ciudadferia_jobs_total", "counter", "Trabajos en segundo plano terminados, por tipo y estado")
+registrar_metrica("ciudadferia_jobs_duracion_segundos", "histogram", "Duración de los trabajos en segundo plano")
+
+TIPOS_JOB: dict = {}        # tipo -> {"funcion": async fn(ctx) -> dict, "concurrencia": int}
+_jobs_en_curso: dict = {}   # job_id -> (tipo, tarea, ctx) de este proceso
+_jobs_workers: set = set()
+_jobs_despertar = asyncio.Event()
+_JOBS_WORKER_ID = f"{os.uname().nodename}:{os.getpid()}"
+
+class JobCancelado(Exception):
+    """Se pidió cancelar el trabajo; la lanza ContextoJob.progreso"""
+
+class ContextoJob:
+    """Lo que recibe la función de un trabajo: parámetros, progreso, punto de control y artefacto"""
+
+    def __init__(self, job: dict):
+        self.id = job["id"]
+        self.tipo = job["tipo"]
+        self.parametros = job.get("parametros") or {}
+        self.punto_control = job.get("punto_control")
+        self.creado_por = job.get("creado_por")
+        self.progreso_actual = dict(job.get("progreso") or {"hechos": 0, "total": None})
+        self.artefacto = None
+        self.cancelacion_pedida = False
+        self._ultimo_guardado = 0.0
+
+    async def progreso(self, hechos: int, total: Optional[int] = None, mensaje: Optional[str] = None,
+                       punto_control=None, forzar: bool = False):
+        """Guarda el avance (como mucho una vez por segundo) y lanza JobCancelado si se pidió cancelar"""
+        if punto_control is not None:
+            self.punto_control = punto_control
+        self.progreso_actual["hechos"] = hechos
+        if total is not None:
+            self.progreso_actual["total"] = total
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_guardado < 1.0:
+            return
+        self._ultimo_guardado = ahora
+        cambios = {"progreso.hechos": hechos, "latido": datetime.now(timezone.utc).isoformat()}
+        if total is not None:
+            cambios["progreso.total"] = total
+        if mensaje is not None:
+            cambios["mensaje"] = mensaje
+        if self.punto_control is not None:
+            cambios["punto_control"] = self.punto_control
+        job = await db.jobs.find_one_and_update(
+            {"id": self.id}, {"$set": cambios}, projection={"_id": 0, "cancelar": 1}
+        )
+        if self.cancelacion_pedida or (job and job.get("cancelar")):
+            self.cancelacion_pedida = True
+            raise JobCancelado()
+
+    async def guardar_artefacto(self, nombre: str, contenido: bytes, media_type: str) -> dict:
+        """Escribe el archivo resultado en JOBS_DIR/<id>/ (de forma atómica) y lo asocia al trabajo"""
+        carpeta = JOBS_DIR / self.id
+        nombre = os.path.basename(nombre)
+
+        def escribir():
+            carpeta.mkdir(parents=True, exist_ok=True)
+            temporal = carpeta / f".{nombre}.tmp"
+            temporal.write_bytes(contenido)
+            os.replace(temporal, carpeta / nombre)
+
+        await asyncio.to_thread(escribir)
+        self.artefacto = {"nombre": nombre, "media_type": media_type, "bytes": len(contenido)}
+        return self.artefacto
+
+def registrar_tipo_job(tipo: str, funcion, concurrencia: int = 1):
+    """Da de alta un tipo de trabajo; concurrencia = máximo en paralelo por proceso"""
+    TIPOS_JOB[tipo] = {"funcion": funcion, "concurrencia": concurrencia}
+
+async def encolar_job(tipo: str, parametros: dict, creado_por: str) -> dict:
+    """Inserta un trabajo pendiente y despierta a los workers"""
+    if tipo not in TIPOS_JOB:
+        raise HTTPException(status_code=400, detail=f"Tipo de trabajo desconocido: {tipo}")
+    job = {
+        "id": str(uuid.uuid4()),
+        "tipo": tipo,
+        "estado": "pendiente",
+        "parametros": parametros,
+        "progreso": {"hechos": 0, "total": None},
+        "mensaje": None,
+        "resultado": None,
+        "error": None,
+        "artefacto": None,
+        "punto_control": None,
+        "cancelar": False,
+        "intentos": 0,
+        "creado_por": creado_por,
+        "fecha_creacion": datetime.now(timezone.utc).isoformat()
+    }
+    await db.jobs.insert_one(dict(job))
+    _jobs_despertar.set()
+    logging.info(f"Trabajo {tipo} {job['id']} encolado por {creado_por}")
+    return job
+
+def respuesta_job_encolado(job: dict):
+    """202 con el id del trabajo y la URL para consultar su estado"""
+    from fastapi.responses import JSONResponse
+    return JSONResponse(status_code=202, content={
+        "success": True,
+        "job_id": job["id"],
+        "estado_url": f"/api/admin/jobs/{job['id']}",
+        **job
+    })
+
+async def reclamar_job() -> Optional[dict]:
+    """Toma atómicamente el trabajo pendiente (o abandonado) más antiguo de un tipo con cupo"""
+    ocupados = collections.Counter(tipo for tipo, _, _ in _jobs_en_curso.values())
+    tipos = [t for t, conf in TIPOS_JOB.items() if ocupados[t] < conf["concurrencia"]]
+    if not tipos:
+        return None
+    ahora = datetime.now(timezone.utc)
+    vencido = (ahora - timedelta(seconds=JOBS_LATIDO_VENCIDO_S)).isoformat()
+    return await db.jobs.find_one_and_update(
+        {
+            "tipo": {"$in": tipos},
+            "cancelar": {"$ne": True},
+            "intentos": {"$lt": JOBS_INTENTOS_MAX},
+            "$or": [{"estado": "pendiente"}, {"estado": "ejecutando", "latido": {"$lt": vencido}}]
+        },
+        {
+            "$set": {"estado": "ejecutando", "worker": _JOBS_WORKER_ID, "latido": ahora.isoformat(), "fecha_inicio": ahora.isoformat()},
+            "$inc": {"intentos": 1}
+        },
+        sort=[("fecha_creacion", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def _latido_job(ctx: ContextoJob, tarea: asyncio.Task):
+    """Mantiene vivo el trabajo aunque no reporte progreso y atiende cancelaciones pedidas desde otra réplica"""
+    while not tarea.done():
+        await asyncio.sleep(JOBS_LATIDO_S)
+        job = await db.jobs.find_one_and_update(
+            {"id": ctx.id}, {"$set": {"latido": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0, "cancelar": 1}
+        )
+        if job and job.get("cancelar") and not tarea.done():
+            ctx.cancelacion_pedida = True
+            tarea.cancel()
+
+async def ejecutar_job(job: dict):
+    """Corre un trabajo reclamado y guarda su estado final"""
+    ctx = ContextoJob(job)
+    inicio = time.monotonic()
+    tarea = asyncio.create_task(TIPOS_JOB[job["tipo"]]["funcion"](ctx))
+    _jobs_en_curso[ctx.id] = (ctx.tipo, tarea, ctx)
+    latido = asyncio.create_task(_latido_job(ctx, tarea))
+    try:
+        resultado = await tarea
+        cambios = {"estado": "completado", "resultado": resultado}
+    except (asyncio.CancelledError, JobCancelado):
+        if not ctx.cancelacion_pedida:
+            # Apagado del proceso: el trabajo vuelve a la cola y otro worker lo retoma
+            tarea.cancel()
+            await asyncio.shield(db.jobs.update_one(
+                {"id": ctx.id, "worker": _JOBS_WORKER_ID},
+                {"$set": {"estado": "pendiente", "punto_control": ctx.punto_control}, "$inc": {"intentos": -1}}
+            ))
+            raise
+        cambios = {"estado": "cancelado"}
+    except Exception as e:
+        logging.error(f"Error en el trabajo {ctx.tipo} {ctx.id}: {e}")
+        cambios = {"estado": "error", "error": e.detail if isinstance(e, HTTPException) else str(e)}
+    finally:
+        latido.cancel()
+        _jobs_en_curso.pop(ctx.id, None)
+    cambios.update({
+        "progreso": ctx.progreso_actual,
+        "artefacto": ctx.artefacto,
+        "punto_control": ctx.punto_control,
+        "fecha_fin": datetime.now(timezone.utc).isoformat()
+    })
+    # Si otro worker lo retomó (latido perdido), el estado final es suyo
+    await db.jobs.update_one({"id": ctx.id, "worker": _JOBS_WORKER_ID}, {"$set": cambios})
+    duracion = time.monotonic() - inicio
+    metrica_inc("ciudadferia_jobs_total", tipo=ctx.tipo, estado=cambios["estado"])
+    metrica_observar("ciudadferia_jobs_duracion_segundos", duracion, tipo=ctx.tipo)
+    logging.info(f"Trabajo {ctx.tipo} {ctx.id}: {cambios['estado']} en {duracion:.1f}s")
+
+async def limpiar_jobs_antiguos():
+    """Cierra los trabajos abandonados que ya no se reintentan y borra los terminados pasada la retención"""
+    ahora = datetime.now(timezone.utc)
+    vencido = (ahora - timedelta(seconds=JOBS_LATIDO_VENCIDO_S)).isoformat()
+    abandonados = {"estado": "ejecutando", "latido": {"$lt": vencido}}
+    await db.jobs.update_many(
+        {**abandonados, "cancelar": True},
+        {"$set": {"estado": "cancelado", "fecha_fin": ahora.isoformat()}}
+    )
+    await db.jobs.update_many(
+        {**abandonados, "intentos": {"$gte": JOBS_INTENTOS_MAX}},
+        {"$set": {"estado": "error", "error": f"Abandonado tras {JOBS_INTENTOS_MAX} intentos", "fecha_fin": ahora.isoformat()}}
+    )
+    limite = (ahora - timedelta(hours=JOBS_RETENCION_HORAS)).isoformat()
+    filtro = {"estado": {"$in": list(ESTADOS_FINALES_JOB)}, "fecha_fin": {"$lt": limite}}
+    async for job in db.jobs.find(filtro, {"_id": 0, "id": 1}):
+        await asyncio.to_thread(shutil.rmtree, JOBS_DIR / job["id"], True)
+    await db.jobs.delete_many(filtro)
+
+async def worker_jobs(numero: int):
+    """Bucle de un worker: reclama, ejecuta y, si no hay nada, espera aviso o el siguiente sondeo"""
+    ultima_limpieza = 0.0
+    while True:
+        try:
+            if numero == 0 and time.monotonic() - ultima_limpieza > JOBS_LIMPIEZA_S:
+                ultima_limpieza = time.monotonic()
+                await limpiar_jobs_antiguos()
+            job = await reclamar_job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Worker de trabajos {numero}: {e}")
+            job = None
+        if job is None:
+            _jobs_despertar.clear()
+            try:
+                await asyncio.wait_for(_jobs_despertar.wait(), timeout=JOBS_SONDEO_S)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await ejecutar_job(job)
+
+def iniciar_workers_jobs():
+    for numero in range(JOBS_WORKERS):
+        tarea = asyncio.create_task(worker_jobs(numero))
+        _jobs_workers.add(tarea)
+        tarea.add_done_callback(_jobs_workers.discard)
+
+async def detener_workers_jobs():
+    """Cancela los workers; los trabajos en curso vuelven a 'pendiente'"""
+    for tarea in list(_jobs_workers):
+        tarea.cancel()
+    await asyncio.gather(*_jobs_workers, return_exceptions=True)
+
+# ---------- Tipos de trabajo ----------
+
+async def job_pdf_acreditaciones(ctx: ContextoJob) -> dict:
+    evento_id = ctx.parametros["evento_id"]
+    await ctx.progreso(0, mensaje="Renderizando PDF", forzar=True)
+    contenido, nombre_archivo = await construir_pdf_acreditaciones(evento_id, ctx.parametros.get("paralelo"))
+    await ctx.guardar_artefacto(nombre_archivo, contenido, "application/pdf")
+    return {"evento_id": evento_id, "bytes": len(contenido)}
+
+async def job_aprobar_y_enviar(ctx: ContextoJob) -> dict:
+    return await aprobar_y_enviar(ctx.parametros["entrada_ids"], ctx)
+
+async def job_configurar_asientos(ctx: ContextoJob) -> dict:
+    return await aplicar_configuracion_asientos(ctx.parametros["evento_id"], ctx.parametros["body"], ctx)
+
+async def job_moderar_compras(ctx: ContextoJob) -> dict:
+    parametros = dict(ctx.parametros)
+    accion = parametros.pop("accion")
+    return await moderar_compras(accion, filtro_moderacion(accion, **parametros), ctx)
+
+registrar_tipo_job("pdf_acreditaciones", job_pdf_acreditaciones, concurrencia=1)
+registrar_tipo_job("aprobar_y_enviar", job_aprobar_y_enviar, concurrencia=1)
+registrar_tipo_job("lote_termico", procesar_lote_termico, concurrencia=2)
+registrar_tipo_job("configurar_asientos", job_configurar_asientos, concurrencia=2)
+registrar_tipo_job("migrar_imagenes", migrar_imagenes_inline, concurrencia=1)
+registrar_tipo_job("moderar_compras", job_moderar_compras, concurrencia=1)
+
+# ---------- Endpoints ----------
+
+@api_router.post("/admin/jobs")
+async def crear_job(request: Request, current_user: str = Depends(get_current_user)):
+    """Encola un trabajo: {"tipo": ..., "parametros": {...}}"""
+    body = await request.json()
+    job = await encolar_job(body.get("tipo"), body.get("parametros") or {}, current_user)
+    return respuesta_job_encolado(job)
+
+@api_router.get("/admin/jobs")
+async def listar_jobs(
+    estado: Optional[str] = None,
+    tipo: Optional[str] = None,
+    limite: int = 50,
+    current_user: str = Depends(get_current_user)
+):
+    """Trabajos más recientes, opcionalmente filtrados por estado y tipo"""
+    filtro = {}
+    if estado:
+        filtro["estado"] = estado
+    if tipo:
+        filtro["tipo"] = tipo
+    jobs = await db.jobs.find(filtro, {"_id": 0, "punto_control": 0}).sort("fecha_creacion", -1).to_list(min(max(limite, 1), 500))
+    return {"jobs": jobs, "tipos": list(TIPOS_JOB)}
+
+@api_router.get("/admin/jobs/{job_id}")
+async def obtener_job(job_id: str, current_user: str = Depends(get_current_user)):
+    """Estado, progreso y resultado de un trabajo"""
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    total = job["progreso"].get("total")
+    job["porcentaje"] = 100.0 if job["estado"] == "completado" else (
+        round(job["progreso"]["hechos"] / total * 100, 1) if total else None
+    )
+    if job.get("artefacto"):
+        job["artefacto_url"] = f"/api/admin/jobs/{job_id}/artefacto"
+    return job
+
+@api_router.post("/admin/jobs/{job_id}/cancelar")
+async def cancelar_job(job_id: str, current_user: str = Depends(get_current_user)):
+    """Cancela un trabajo pendiente al instante; uno en curso se detiene en su próximo progreso o latido"""
+    ahora = datetime.now(timezone.utc).isoformat()
+    job = await db.jobs.find_one_and_update(
+        {"id": job_id, "estado": "pendiente"},
+        {"$set": {"estado": "cancelado", "cancelar": True, "fecha_fin": ahora}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        job = await db.jobs.find_one_and_update(
+            {"id": job_id, "estado": "ejecutando"},
+            {"$set": {"cancelar": True}},
+            return_document=ReturnDocument.AFTER
+        )
+        en_curso = _jobs_en_curso.get(job_id)
+        if job and en_curso:
+            _, tarea, ctx = en_curso
+            ctx.cancelacion_pedida = True
+            tarea.cancel()
+    if not job:
+        if await db.jobs.find_one({"id": job_id}, {"_id": 1}):
+            raise HTTPException(status_code=409, detail="El trabajo ya terminó")
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    logging.info(f"Cancelación del trabajo {job_id} pedida por {current_user}")
+    return {"success": True, "id": job_id, "estado": job["estado"], "cancelar": True}
+
+@api_router.get("/admin/jobs/{job_id}/artefacto")
+async def descargar_artefacto_job(job_id: str, request: Request, current_user: str = Depends(get_current_user)):
+    """Descarga el archivo generado por un trabajo completado"""
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0, "estado": 1, "artefacto": 1})
+    if not job or not job.get("artefacto"):
+        raise HTTPException(status_code=404, detail="El trabajo no tiene artefacto")
+    artefacto = job["artefacto"]
+    ruta = JOBS_DIR / job_id / os.path.basename(artefacto["nombre"])
+    if not ruta.is_file():
+        raise HTTPException(status_code=404, detail="El artefacto ya no está disponible")
+    respuesta = respuesta_archivo(request, ruta, artefacto["media_type"], "private, no-cache", f'"{job_id}"')
+    respuesta.headers["Content-Disposition"] = f"attachment; filename={artefacto['nombre']}"
+    return respuesta
+
 app.include_router(api_router)
 
+# Plantilla de ruta por endpoint, para etiquetar métricas sin ids concretos
+_rutas_por_endpoint: dict = {}
+
+@app.middleware("http")
+async def medir_peticiones(request: Request, call_next):
+    inicio = time.monotonic()
+    estado = 500
+    try:
+        response = await call_next(request)
+        estado = response.status_code
+        return response
+    finally:
+        fin = time.monotonic()
+        duracion = fin - inicio
+        if not _rutas_por_endpoint:
+            _rutas_por_endpoint.update({getattr(r, "endpoint", None): r.path for r in app.routes})
+        ruta = _rutas_por_endpoint.get(request.scope.get("endpoint"), "desconocida")
+        metrica_observar("ciudadferia_http_duracion_segundos", duracion, metodo=request.method, ruta=ruta)
+        metrica_inc("ciudadferia_http_peticiones_total", metodo=request.method, ruta=ruta, estado=str(estado))
+        await perfilar_si_lenta(ruta, request.method, inicio, fin)
+
+@app.get("/metrics")
+async def metricas_prometheus():
+    from fastapi.responses import PlainTextResponse
+    return PlainTextResponse(exportar_metricas(), media_type="text/plain; version=0.0.4")
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Idempotent-Replayed", "Retry-After"],
 )
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_tareas_inicio: set = set()
+
+async def crear_indices():
+    """Índices que necesitan las consultas y contadores; si Mongo no responde, solo se registra"""
+    try:
+        await db.flujo_eventos.create_index([("evento_id", 1), ("minuto", 1)], unique=True)
+        await db.entradas.create_index(
+            [("email_comprador", 1), ("fecha_compra", -1), ("id", -1)],
+            name="email_comprador_ci", collation=COLLATION_EMAIL
+        )
+        await db.imagenes.create_index("url")
+        await db.jobs.create_index("id", unique=True)
+        await db.jobs.create_index([("estado", 1), ("tipo", 1), ("fecha_creacion", 1)])
+        await db.entradas.create_index([("lote_id", 1), ("numero_ticket", -1)], sparse=True)
+        await db.compra_requests.create_index("clave", unique=True)
+        await db.compra_requests.create_index("fecha_creacion", expireAfterSeconds=IDEMPOTENCIA_TTL_HORAS * 3600)
+    except Exception as e:
+        logging.error(f"Error creando índices: {e}")
+
+@app.on_event("startup")
+async def precargar_recursos():
+    # En segundo plano: no retrasar el arranque si Mongo tarda en responder
+    tarea = asyncio.create_task(crear_indices())
+    _tareas_inicio.add(tarea)
+    tarea.add_done_callback(_tareas_inicio.discard)
+    iniciar_diagnostico()
+    iniciar_workers_jobs()
+    await asyncio.to_thread(precargar_recursos_render)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await detener_workers_jobs()
+    client.close()
+    _diagnostico_parar.set()
+    if _tarea_latido is not None:
+        _tarea_latido.cancel()
+    _pool_bcrypt.shutdown(wait=False)
+    if _pool_impresion is not None:
+        _pool_impresion.shutdown(wait=False, cancel_futures=True)
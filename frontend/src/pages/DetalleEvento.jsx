@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { motion } from 'framer-motion';
 import axios from 'axios';
@@ -11,12 +11,27 @@ import { getImageUrl } from '../utils/imageHelpers';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// crypto.randomUUID solo existe en contextos seguros (HTTPS/localhost): en HTTP plano
+// o por IP de la red local se arma la clave con getRandomValues o, en último caso, Math.random
+const nuevaClaveIdempotencia = () => {
+  if (typeof crypto !== 'undefined' && typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID();
+  }
+  if (typeof crypto !== 'undefined' && typeof crypto.getRandomValues === 'function') {
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+};
+
 const DetalleEvento = () => {
   const { id } = useParams();
   const navigate = useNavigate();
   const [evento, setEvento] = useState(null);
   const [loading, setLoading] = useState(true);
   const [comprando, setComprando] = useState(false);
+  // Misma clave mientras no cambien los datos: un reintento no duplica la compra
+  const intentoCompra = useRef({ datos: null, clave: null });
   const [cantidad, setCantidad] = useState(1);
   const [nombre, setNombre] = useState('');
   const [cedula, setCedula] = useState('');  // Campo de cédula
@@ -164,7 +179,15 @@ const DetalleEvento = () => {
         detalles_compra: seleccionAsientos.detalles || []
       };
       
-      const response = await axios.post(`${API}/comprar-entrada`, datosCompra);
+      const datosSerializados = JSON.stringify(datosCompra);
+      if (intentoCompra.current.datos !== datosSerializados) {
+        intentoCompra.current = { datos: datosSerializados, clave: nuevaClaveIdempotencia() };
+      }
+      
+      const response = await axios.post(`${API}/comprar-entrada`, datosCompra, {
+        headers: { 'Idempotency-Key': intentoCompra.current.clave }
+      });
+      intentoCompra.current = { datos: null, clave: null };
 
       if (response.data.requiere_aprobacion) {
         toast.success('Compra registrada. Espera la aprobación del pago.', { duration: 5000 });
@@ -13,6 +13,8 @@ const MisEntradas = () => {
   const [entradas, setEntradas] = useState([]);
   const [loading, setLoading] = useState(false);
   const [buscado, setBuscado] = useState(false);
+  const [siguiente, setSiguiente] = useState(null);
+  const [cargandoMas, setCargandoMas] = useState(false);
 
   const buscarEntradas = async (e) => {
     e.preventDefault();
@@ -26,13 +28,14 @@ const MisEntradas = () => {
     setBuscado(true);
 
     try {
-      const response = await axios.get(`${API}/mis-entradas/${email}`);
-      setEntradas(response.data);
+      const response = await axios.get(`${API}/mis-entradas/${encodeURIComponent(email.trim())}`);
+      setEntradas(response.data.entradas);
+      setSiguiente(response.data.siguiente);
       
-      if (response.data.length === 0) {
+      if (response.data.entradas.length === 0) {
         toast.info('No se encontraron entradas para este email');
       } else {
-        toast.success(`Se encontraron ${response.data.length} entrada(s)`);
+        toast.success(`Se encontraron ${response.data.entradas.length}${response.data.siguiente ? '+' : ''} entrada(s)`);
       }
     } catch (error) {
       console.error('Error buscando entradas:', error);
@@ -42,12 +45,36 @@ const MisEntradas = () => {
     }
   };
 
-  const descargarEntrada = (entrada) => {
-    const link = document.createElement('a');
-    link.href = entrada.codigo_qr;
-    link.download = `entrada-${entrada.nombre_evento}-${entrada.id}.png`;
-    link.click();
-    toast.success('QR descargado');
+  const cargarMas = async () => {
+    setCargandoMas(true);
+    try {
+      const response = await axios.get(`${API}/mis-entradas/${encodeURIComponent(email.trim())}`, {
+        params: { cursor: siguiente }
+      });
+      setEntradas((anteriores) => [...anteriores, ...response.data.entradas]);
+      setSiguiente(response.data.siguiente);
+    } catch (error) {
+      console.error('Error cargando más entradas:', error);
+      toast.error('Error al cargar más entradas');
+    } finally {
+      setCargandoMas(false);
+    }
+  };
+
+  const descargarEntrada = async (entrada) => {
+    try {
+      const response = await axios.get(`${BACKEND_URL}${entrada.qr_url}`, { responseType: 'blob' });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `entrada-${entrada.nombre_evento}-${entrada.id}.png`;
+      link.click();
+      URL.revokeObjectURL(url);
+      toast.success('QR descargado');
+    } catch (error) {
+      console.error('Error descargando QR:', error);
+      toast.error('Error al descargar el QR');
+    }
   };
 
   const descargarEntradaCompleta = (entradaId) => {
@@ -140,8 +167,9 @@ const MisEntradas = () => {
                     <div className="flex justify-center items-center">
                       {entrada.estado_pago === 'aprobado' ? (
                         <img
-                          src={entrada.codigo_qr}
+                          src={`${BACKEND_URL}${entrada.qr_url}`}
                           alt="Código QR"
+                          loading="lazy"
                           className="w-48 h-48 rounded-xl"
                         />
                       ) : (
@@ -265,6 +293,19 @@ const MisEntradas = () => {
                 </motion.div>
               ))
             )}
+
+            {siguiente && (
+              <div className="flex justify-center">
+                <button
+                  onClick={cargarMas}
+                  disabled={cargandoMas}
+                  className="glass-card px-8 py-3 rounded-full font-medium hover:border-primary transition-all disabled:opacity-50"
+                  data-testid="button-cargar-mas"
+                >
+                  {cargandoMas ? 'Cargando...' : 'Cargar más entradas'}
+                </button>
+              </div>
+            )}
           </motion.div>
         )}
       </div>
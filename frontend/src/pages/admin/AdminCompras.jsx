@@ -7,6 +7,7 @@ import { toast } from 'sonner';
 import { Toaster } from '../../components/ui/sonner';
 import * as XLSX from 'xlsx';
 import { saveAs } from 'file-saver';
+import { getImageUrl } from '../../utils/imageHelpers';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -516,7 +517,7 @@ const AdminCompras = () => {
               </button>
             </div>
             <img 
-              src={comprobanteModal} 
+              src={getImageUrl(comprobanteModal)} 
               alt="Comprobante de pago" 
               className="w-full rounded-xl"
             />
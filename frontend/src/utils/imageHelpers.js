@@ -5,10 +5,11 @@ export const getImageUrl = (url) => {
   if (!url) return null;
   // Si ya es URL completa o base64, verificar si necesita actualizar dominio
   if (url.startsWith('http') || url.startsWith('data:')) {
-    // Si es una URL con dominio diferente pero tiene /api/uploads/, extraer y reconstruir
-    if (url.includes('/api/uploads/')) {
-      const path = '/api/uploads/' + url.split('/api/uploads/').pop();
-      return `${BACKEND_URL}${path}`;
+    // Si es una URL con dominio diferente pero tiene /api/uploads/ o /api/media/, extraer y reconstruir
+    for (const prefijo of ['/api/uploads/', '/api/media/']) {
+      if (url.includes(prefijo)) {
+        return `${BACKEND_URL}${prefijo}${url.split(prefijo).pop()}`;
+      }
     }
     return url;
   }
@@ -20,8 +21,10 @@ export const getImageUrl = (url) => {
 export const getRelativePath = (url) => {
   if (!url) return null;
   if (url.startsWith('data:')) return url; // Base64 se guarda completo
-  if (url.includes('/api/uploads/')) {
-    return '/api/uploads/' + url.split('/api/uploads/').pop();
+  for (const prefijo of ['/api/uploads/', '/api/media/']) {
+    if (url.includes(prefijo)) {
+      return prefijo + url.split(prefijo).pop();
+    }
   }
   return url;
 };
@@ -0,0 +1,108 @@
+"""
+Fixtures para los micro-benchmarks de renderizado.
+
+Se ejecutan solo con BENCHMARKS=1 (son lentos y no necesitan el backend desplegado):
+
+    BENCHMARKS=1 pytest tests/benchmarks -s
+    BENCHMARKS=1 pytest tests/benchmarks --benchmark-json=render.json   # con pytest-benchmark
+
+Si pytest-benchmark está instalado se usa su fixture `benchmark`; si no, una
+versión mínima compatible (`pedantic` + `extra_info`) que imprime los tiempos.
+Cada benchmark registra además memoria: pico de Python (tracemalloc), bloques
+asignados y RSS máximo del proceso.
+"""
+import os
+import sys
+import gc
+import time
+import resource
+import statistics
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[2] / "backend"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "ciudadferia_benchmark")
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get("BENCHMARKS") == "1":
+        return
+    saltar = pytest.mark.skip(reason="Micro-benchmarks: ejecutar con BENCHMARKS=1")
+    for item in items:
+        if "benchmarks" in item.nodeid:
+            item.add_marker(saltar)
+
+
+@pytest.fixture(scope="session")
+def server():
+    import server as modulo
+    return modulo
+
+
+def medir_memoria(funcion) -> dict:
+    """Ejecuta `funcion` una vez midiendo asignaciones de Python y RSS"""
+    gc.collect()
+    tracemalloc.start()
+    antes = tracemalloc.take_snapshot()
+    funcion()
+    despues = tracemalloc.take_snapshot()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    bloques = sum(s.count_diff for s in despues.compare_to(antes, "filename") if s.count_diff > 0)
+    return {
+        "pico_python_kb": round(pico / 1024, 1),
+        "bloques_nuevos": bloques,
+        "rss_max_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+class _BenchmarkMinimo:
+    """Subconjunto de la fixture de pytest-benchmark usado por esta suite"""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.extra_info = {}
+        self.tiempos = []
+
+    def pedantic(self, funcion, args=(), kwargs=None, rounds=5, iterations=1, warmup_rounds=1):
+        kwargs = kwargs or {}
+        for _ in range(warmup_rounds):
+            funcion(*args, **kwargs)
+        resultado = None
+        for _ in range(rounds):
+            inicio = time.perf_counter()
+            for _ in range(iterations):
+                resultado = funcion(*args, **kwargs)
+            self.tiempos.append((time.perf_counter() - inicio) / iterations)
+        return resultado
+
+    def __call__(self, funcion, *args, **kwargs):
+        return self.pedantic(funcion, args=args, kwargs=kwargs)
+
+    def resumen(self) -> str:
+        ms = [t * 1000 for t in self.tiempos]
+        return (f"{self.nombre}: min {min(ms):.2f}ms mediana {statistics.median(ms):.2f}ms "
+                f"max {max(ms):.2f}ms ({len(ms)} rondas) {self.extra_info}")
+
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    _resultados = []
+
+    @pytest.fixture
+    def benchmark(request):
+        bench = _BenchmarkMinimo(request.node.name)
+        yield bench
+        if bench.tiempos:
+            _resultados.append(bench.resumen())
+
+    def pytest_terminal_summary(terminalreporter):
+        if _resultados:
+            terminalreporter.section("micro-benchmarks de renderizado")
+            for linea in _resultados:
+                terminalreporter.write_line(linea)
@@ -0,0 +1,242 @@
+"""
+Micro-benchmarks de los caminos de CPU del renderizado:
+QR (v1 y v2), imagen de entrada, ticket térmico y PDF de acreditaciones,
+con y sin template y en lotes de tamaño realista.
+
+    BENCHMARKS=1 pytest tests/benchmarks -s
+"""
+import asyncio
+import base64
+import uuid
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from .conftest import medir_memoria
+
+LOTE_QR = 100
+LOTE_IMAGENES = 20
+LOTE_TERMICAS = 50
+LOTE_ACREDITACIONES = 40  # 10 hojas carta de 4 credenciales
+
+
+def imagen_data_uri(ancho: int, alto: int, color=(120, 30, 160)) -> str:
+    buffer = BytesIO()
+    Image.new("RGB", (ancho, alto), color).save(buffer, format="JPEG", quality=85)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+# Templates como los que suben los organizadores (fotos grandes, no del tamaño final)
+TEMPLATE_ENTRADA = imagen_data_uri(1200, 1800)
+TEMPLATE_ACREDITACION = imagen_data_uri(1100, 1700, (20, 60, 140))
+
+
+def datos_entrada(i: int) -> dict:
+    entrada_id = str(uuid.uuid4())
+    return {
+        "entrada_id": entrada_id,
+        "codigo_alfanumerico": f"CF-2026-{entrada_id[-6:].upper()}-BNCH",
+        "evento_id": "evento-benchmark",
+        "nombre_evento": "Gran Concierto de la Feria",
+        "nombre_comprador": f"Comprador {i}",
+        "cedula_comprador": f"V-{20000000 + i}",
+        "email_comprador": f"comprador{i}@benchmark.test",
+        "telefono_comprador": "04140000000",
+        "numero_entrada": 1,
+        "asiento": None
+    }
+
+
+def entrada_renderizable(server, i: int) -> dict:
+    datos = datos_entrada(i)
+    datos["hash"] = server.generar_hash(datos)
+    _, payload = server.generar_qr_seguro(datos)
+    return {
+        "id": datos["entrada_id"],
+        "codigo_alfanumerico": datos["codigo_alfanumerico"],
+        "nombre_comprador": datos["nombre_comprador"],
+        "cedula_comprador": datos["cedula_comprador"],
+        "categoria_entrada": "VIP",
+        "qr_payload": payload
+    }
+
+
+def evento_benchmark(template: bool) -> dict:
+    return {
+        "id": "evento-benchmark",
+        "nombre": "Gran Concierto de la Feria",
+        "fecha": "2026-01-20",
+        "hora": "20:00",
+        "ubicacion": "Plaza de Toros de San Cristóbal",
+        "posicion_qr": {"x": 50, "y": 40, "size": 220},
+        "template_entrada": TEMPLATE_ENTRADA if template else None
+    }
+
+
+def registrar(benchmark, funcion, lote: int, rounds: int):
+    resultado = benchmark.pedantic(funcion, rounds=rounds, iterations=1, warmup_rounds=1)
+    benchmark.extra_info.update(medir_memoria(funcion))
+    benchmark.extra_info["lote"] = lote
+    return resultado
+
+
+# ==================== QR ====================
+
+def test_generar_qr_seguro(benchmark, server):
+    datos = [datos_entrada(i) for i in range(LOTE_QR)]
+
+    def lote():
+        return [server.generar_qr_seguro(d) for d in datos]
+
+    resultados = registrar(benchmark, lote, LOTE_QR, rounds=5)
+    assert all(img.startswith("data:image/png;base64,") for img, _ in resultados)
+
+
+def test_generar_qr_seguro_v2(benchmark, server):
+    def lote():
+        return [server.generar_qr_seguro_v2(str(uuid.uuid4()), "evento-benchmark", f"CF-2026-{i:06d}") for i in range(LOTE_QR)]
+
+    resultados = registrar(benchmark, lote, LOTE_QR, rounds=5)
+    assert len(resultados) == LOTE_QR
+
+
+@pytest.mark.parametrize("camino", ["make_image", "numpy"])
+def test_rasterizar_qr(benchmark, server, camino):
+    """Matriz ya construida -> imagen de 180px: qrcode.make_image + LANCZOS frente a NumPy"""
+    import qrcode
+
+    payloads = [entrada_renderizable(server, i)["qr_payload"] for i in range(LOTE_QR)]
+    qrs, matrices = [], []
+    for payload in payloads:
+        qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=4)
+        qr.add_data(payload)
+        qr.make(fit=True)
+        qrs.append(qr)
+        matrices.append(server.matriz_qr(payload))
+
+    if camino == "make_image":
+        def lote():
+            return [qr.make_image().get_image().resize((180, 180), Image.Resampling.LANCZOS) for qr in qrs]
+    else:
+        def lote():
+            return [server.rasterizar_qr(m, 180) for m in matrices]
+
+    imagenes = registrar(benchmark, lote, LOTE_QR, rounds=5)
+    assert all(img.size == (180, 180) for img in imagenes)
+
+
+# ==================== IMAGEN DE ENTRADA ====================
+
+@pytest.mark.parametrize("con_template", [False, True], ids=["sin_template", "con_template"])
+def test_generar_imagen_entrada(benchmark, server, con_template):
+    evento = evento_benchmark(con_template)
+    entradas = [entrada_renderizable(server, i) for i in range(LOTE_IMAGENES)]
+    for entrada in entradas:
+        entrada["codigo_qr"] = server.renderizar_qr_png(entrada["qr_payload"])
+
+    async def renderizar():
+        return [await server.generar_imagen_entrada(e, evento) for e in entradas]
+
+    def lote():
+        return asyncio.run(renderizar())
+
+    imagenes = registrar(benchmark, lote, LOTE_IMAGENES, rounds=3)
+    assert all(img[:8] == b"\x89PNG\r\n\x1a\n" for img in imagenes)
+
+
+# ==================== TICKET TÉRMICO ====================
+
+@pytest.mark.parametrize("qr_guardado", [False, True], ids=["qr_desde_payload", "qr_guardado"])
+def test_renderizar_entrada_termica(benchmark, server, qr_guardado):
+    entradas = []
+    for i in range(LOTE_TERMICAS):
+        entrada = entrada_renderizable(server, i)
+        entrada.update({"numero_ticket": i + 1, "precio_total": 10.0})
+        if qr_guardado:
+            entrada["codigo_qr"] = server.renderizar_qr_png(entrada["qr_payload"])
+        entradas.append(entrada)
+
+    def lote():
+        return [server.renderizar_entrada_termica(e) for e in entradas]
+
+    pngs = registrar(benchmark, lote, LOTE_TERMICAS, rounds=3)
+    assert len(pngs) == LOTE_TERMICAS
+
+
+# ==================== PDF DE ACREDITACIONES ====================
+
+@pytest.mark.parametrize("con_template", [False, True], ids=["sin_template", "con_template"])
+def test_pdf_acreditaciones(benchmark, server, con_template):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    categoria = {
+        "id": "cat-prensa",
+        "nombre": "Prensa",
+        "color": "#1E40AF",
+        "template_imagen": TEMPLATE_ACREDITACION if con_template else None
+    }
+    acreditaciones = []
+    for i in range(LOTE_ACREDITACIONES):
+        datos_qr = {"tipo": "acreditacion", "acreditacion_id": str(uuid.uuid4()), "codigo": f"AC-PRE-{i:06d}"}
+        codigo_qr, _ = server.generar_qr_seguro(datos_qr)
+        acreditaciones.append({
+            "id": datos_qr["acreditacion_id"],
+            "categoria_id": categoria["id"],
+            "nombre_persona": f"Periodista {i}",
+            "cedula": f"V-{10000000 + i}",
+            "organizacion": "Diario La Nación",
+            "codigo_qr": codigo_qr,
+            "codigo_alfanumerico": datos_qr["codigo"]
+        })
+
+    ancho, alto = server.CREDENCIAL_WIDTH, server.CREDENCIAL_HEIGHT
+    posiciones = [(0, alto), (ancho, alto), (0, 0), (ancho, 0)]
+
+    async def dibujar():
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=letter)
+        for i, acreditacion in enumerate(acreditaciones):
+            if i and i % 4 == 0:
+                c.showPage()
+            x, y = posiciones[i % 4]
+            await server.dibujar_acreditacion(c, acreditacion, categoria, x, y, ancho, alto, None)
+        c.save()
+        return buffer.getvalue()
+
+    def lote():
+        return asyncio.run(dibujar())
+
+    pdf = registrar(benchmark, lote, LOTE_ACREDITACIONES, rounds=3)
+    assert pdf.startswith(b"%PDF")
+
+
+@pytest.mark.parametrize("modo", ["serie", "paralelo"])
+def test_pdf_acreditaciones_por_paginas(benchmark, server, modo):
+    """PDF completo (4 por hoja carta): un canvas en serie frente a grupos de páginas en el pool de procesos"""
+    categoria = {"id": "cat-prensa", "nombre": "Prensa", "color": "#1E40AF", "template_imagen": TEMPLATE_ACREDITACION}
+    acreditaciones = []
+    for i in range(LOTE_ACREDITACIONES * 5):
+        datos_qr = {"tipo": "acreditacion", "acreditacion_id": str(uuid.uuid4()), "codigo": f"AC-PRE-{i:06d}"}
+        _, payload = server.generar_qr_seguro(datos_qr)
+        acreditaciones.append({
+            "id": datos_qr["acreditacion_id"],
+            "categoria_id": categoria["id"],
+            "nombre_persona": f"Periodista {i}",
+            "cedula": f"V-{10000000 + i}",
+            "codigo_alfanumerico": datos_qr["codigo"],
+            "qr_payload": payload
+        })
+    categorias = {categoria["id"]: categoria}
+    templates = asyncio.run(server.cargar_templates_acreditaciones(acreditaciones, categorias))
+
+    if modo == "serie":
+        def lote():
+            return server.renderizar_paginas_acreditaciones(acreditaciones, categorias, None, templates)
+    else:
+        def lote():
+            return asyncio.run(server.renderizar_acreditaciones_en_paralelo(acreditaciones, categorias, None, templates))
+
+    pdf = registrar(benchmark, lote, len(acreditaciones), rounds=3)
+    assert pdf.startswith(b"%PDF")
@@ -0,0 +1,49 @@
+"""
+Negociación del formato de la imagen de entrada con headers Accept reales de navegador.
+No necesita el backend desplegado: prueba la función directamente.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "ciudadferia_test")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+import server  # noqa: E402
+
+ACCEPT_NAVEGADORES = {
+    "chrome": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+    "firefox": "image/avif,image/webp,image/png,image/svg+xml,image/*;q=0.8,*/*;q=0.5",
+    "firefox_antiguo": "image/avif,image/webp,*/*",
+    "safari": "image/webp,image/avif,image/jxl,image/heic,image/heic-sequence,video/*;q=0.8,image/png,image/svg+xml,image/*;q=0.8,*/*;q=0.5",
+}
+
+
+@pytest.mark.parametrize("navegador", ACCEPT_NAVEGADORES)
+def test_navegador_recibe_png_sin_template(navegador):
+    """Fondo plano: PNG es el más pequeño y los navegadores lo aceptan con la misma q que WebP"""
+    evento = {"template_entrada": None}
+    formato = server.negociar_formato_imagen(ACCEPT_NAVEGADORES[navegador], *server.preferencia_formatos_entrada(evento))
+    assert formato == "png"
+
+
+@pytest.mark.parametrize("navegador", ACCEPT_NAVEGADORES)
+def test_navegador_recibe_webp_con_template(navegador):
+    evento = {"template_entrada": "/api/media/plantilla.jpg"}
+    formato = server.negociar_formato_imagen(ACCEPT_NAVEGADORES[navegador], *server.preferencia_formatos_entrada(evento))
+    assert formato == "webp"
+
+
+@pytest.mark.parametrize("accept, esperado", [
+    (None, "png"),
+    ("image/webp", "webp"),
+    ("image/jpeg", "jpeg"),
+    ("image/webp;q=0.5,image/*;q=0.9", "png"),
+    ("image/png;q=0,image/webp", "webp"),
+    ("text/html", "png"),
+])
+def test_q_y_comodines(accept, esperado):
+    assert server.negociar_formato_imagen(accept, ("png", "webp", "jpeg"), "png") == esperado
@@ -296,6 +296,82 @@ class TestThermalTickets:
         
         print(f"✅ Codigo alfanumerico format correct: {codigo}")
 
+    def test_generar_lote_masivo(self):
+        """Test bulk mode: >100 tickets, reserved range, no PNGs in the response"""
+        import time
+
+        response = requests.post(
+            f"{BASE_URL}/api/admin/generar-entradas-termicas/lote",
+            json={"categoria": "Lote", "cantidad": 250, "precio": 5.00},
+            headers=self.headers
+        )
+
+        assert response.status_code == 200, f"Failed to start bulk batch: {response.text}"
+        lote = response.json()
+        assert lote["numero_fin"] - lote["numero_inicio"] + 1 == 250
+        assert "entradas" not in lote
+
+        # Poll progress until done
+        for _ in range(30):
+            progreso = requests.get(
+                f"{BASE_URL}/api/admin/lotes-termicos/{lote['id']}",
+                headers=self.headers
+            ).json()
+            if progreso["estado"] != "procesando":
+                break
+            time.sleep(1)
+
+        assert progreso["estado"] == "completado", f"Batch did not complete: {progreso}"
+        assert progreso["generadas"] == 250
+
+        print(f"✅ Bulk batch generated: #{lote['numero_inicio']}-#{lote['numero_fin']}")
+
+    def test_entradas_termicas_escpos(self):
+        """Test ESC/POS stream for a numbered range"""
+        gen_response = requests.post(
+            f"{BASE_URL}/api/admin/generar-entradas-termicas",
+            json={"categoria": "EscPos", "cantidad": 3, "precio": 5.00},
+            headers=self.headers
+        )
+        assert gen_response.status_code == 200
+        data = gen_response.json()
+
+        response = requests.get(
+            f"{BASE_URL}/api/admin/entradas-termicas/escpos",
+            params={"numero_inicio": data["numero_inicio"], "numero_fin": data["numero_fin"]},
+            headers=self.headers
+        )
+
+        assert response.status_code == 200, f"Failed to get ESC/POS stream: {response.text}"
+        assert response.content.startswith(b'\x1b@')
+        # One native QR print command and one paper cut per ticket
+        assert response.content.count(b'\x1d(k\x03\x00\x31\x51\x30') >= 3
+        assert response.content.count(b'\x1dV\x42\x00') >= 3
+
+        print(f"✅ ESC/POS stream: {len(response.content)} bytes")
+
+    def test_imprimir_lote_pdf(self):
+        """Test batch print: many thermal tickets as a single multi-page PDF"""
+        gen_response = requests.post(
+            f"{BASE_URL}/api/admin/generar-entradas-termicas",
+            json={"categoria": "Hoja", "cantidad": 5, "precio": 5.00},
+            headers=self.headers
+        )
+        assert gen_response.status_code == 200
+        ids = [e["id"] for e in gen_response.json()["entradas"]]
+
+        response = requests.post(
+            f"{BASE_URL}/api/admin/entradas-termicas/imprimir",
+            json={"ids": ids, "formato": "pdf", "hoja": "a4"},
+            headers=self.headers
+        )
+
+        assert response.status_code == 200, f"Failed to print batch: {response.text}"
+        assert response.headers.get("content-type") == "application/pdf"
+        assert response.content.startswith(b"%PDF")
+
+        print(f"✅ Batch print PDF: {len(response.content)} bytes")
+
 
 class TestThermalTicketsValidation:
     """Tests for thermal ticket validation"""